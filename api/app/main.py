@@ -1,18 +1,46 @@
 from fastapi import FastAPI, HTTPException, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from .routers import kpi, auth, ai
-from .services.enhanced_azure_openai import get_azure_openai_service
+from fastapi.responses import JSONResponse, ORJSONResponse, PlainTextResponse
+from .routers import kpi, auth, ai, data
+from .services.enhanced_azure_openai import get_async_azure_openai_service
+from .services.azure_clients import close_clients
+from .services.metrics import PrometheusMiddleware, get_metrics_registry
+from .services.kpi_cache import get_kpi_cache
+from .services.rate_limit import get_rate_limiter
+from .services.resilience import circuit_breaker_stats
+from .services.upstreams import get_upstream_pool
+from .services.job_queue import JOB_STATES, get_job_counts
+from .services.token_budget import get_token_budget_planner
+from .models.auth import token_cache
+from contextlib import asynccontextmanager
+import asyncio
 import os
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start the routers' background components, and stop them on shutdown"""
+    kpi.load_example_catalog()
+    await asyncio.to_thread(get_token_budget_planner().tokenizer.load)
+    await auth.seed_users()
+    await ai.start_job_queue()
+    try:
+        yield
+    finally:
+        await ai.stop_job_queue()
+        kpi.stop_bootstrap_pool()
+        # Close pooled upstream connections
+        await close_clients()
+
 app = FastAPI(
     title="Metrically API",
     description="API for Metrically - Your KPIs. Architected by AI.",
     version="1.0.0",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan,
 )
 
 # Add CORS middleware
@@ -24,6 +52,33 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Time every request; added last so it wraps the other middleware
+app.add_middleware(PrometheusMiddleware)
+
+def _component_metrics():
+    """Scrape-time samples from components that keep their own counters"""
+    service = get_async_azure_openai_service()
+    cache = get_kpi_cache().stats()
+    yield "metrically_kpi_cache_lookups_total", "counter", "KPI cache lookups by result", {"result": "hit"}, cache["hits"]
+    yield "metrically_kpi_cache_lookups_total", "counter", "KPI cache lookups by result", {"result": "disk_hit"}, cache["disk_hits"]
+    yield "metrically_kpi_cache_lookups_total", "counter", "KPI cache lookups by result", {"result": "miss"}, cache["misses"]
+    yield "metrically_kpi_cache_entries", "gauge", "Entries in the in-memory KPI cache", {}, cache["entries"]
+    flights = service.singleflight.stats()
+    yield "metrically_coalesced_requests_total", "counter", "Completion requests by coalescing role", {"role": "leader"}, flights["leaders"]
+    yield "metrically_coalesced_requests_total", "counter", "Completion requests by coalescing role", {"role": "follower"}, flights["coalesced"]
+    yield "metrically_rate_limited_requests_total", "counter", "Requests rejected by the per-user rate limiter", {}, get_rate_limiter().rejected
+    yield "metrically_token_cache_lookups_total", "counter", "Verified-token cache lookups by result", {"result": "hit"}, token_cache.hits
+    yield "metrically_token_cache_lookups_total", "counter", "Verified-token cache lookups by result", {"result": "miss"}, token_cache.misses
+    for deployment, breaker in circuit_breaker_stats().items():
+        yield "metrically_circuit_breaker_open", "gauge", "1 while a deployment's circuit breaker is open or half-open", {"deployment": deployment}, int(breaker["state"] != "closed")
+    for upstream in get_upstream_pool().stats():
+        yield "metrically_upstream_healthy", "gauge", "1 while an upstream is routable (circuit closed, no 429 cool-down)", {"upstream": upstream["name"]}, int(upstream["healthy"])
+    jobs = get_job_counts()
+    for state in JOB_STATES:
+        yield "metrically_jobs", "gauge", "Background jobs by state", {"state": state}, jobs.get(state, 0)
+
+get_metrics_registry().add_collector(_component_metrics)
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
@@ -32,17 +87,27 @@ async def health_check():
 @app.get("/api-status")
 async def api_status():
     """Check if Azure OpenAI API is configured"""
-    service = get_azure_openai_service()
+    service = get_async_azure_openai_service()
     is_available = service.is_available()
     return {
         "azure_openai_configured": is_available,
-        "deployment": service.deployment_name if is_available else None
+        "deployment": service.deployment_name if is_available else None,
+        "upstreams": get_upstream_pool().stats()
     }
 
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def metrics():
+    """Prometheus metrics in the text exposition format"""
+    return PlainTextResponse(
+        get_metrics_registry().render(),
+        media_type="text/plain; version=0.0.4"
+    )
+
 # Include routers
 app.include_router(auth.router, prefix="/auth", tags=["Authentication"])
 app.include_router(kpi.router, prefix="/kpi", tags=["KPI Generation"])
 app.include_router(ai.router, prefix="/ai", tags=["AI Services"])
+app.include_router(data.router, prefix="/data", tags=["Data Ingestion"])
 
 @app.exception_handler(Exception)
 async def global_exception_handler(request, exc):
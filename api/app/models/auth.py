@@ -3,10 +3,18 @@ from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Optional, Tuple, Dict, Any
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+import threading
+import hashlib
+import asyncio
+import time
 import os
 from dotenv import load_dotenv
 
+from ..services.user_store import get_user_store
+
 # Load environment variables
 load_dotenv()
 
@@ -15,10 +23,29 @@ SECRET_KEY = os.getenv("JWT_SECRET_KEY", "metrically_default_secret_key_change_i
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24  # 24 hours
 
+# bcrypt cost factor; hashes made with any other cost are upgraded on the next login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "4"))
+
 # Setup password context and OAuth2 scheme
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS
+)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/token")
 
+# Number of verified tokens remembered by get_current_user
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+
+# bcrypt releases the GIL, so a small thread pool keeps hashing off the event loop
+_password_executor = ThreadPoolExecutor(
+    max_workers=PASSWORD_HASH_WORKERS,
+    thread_name_prefix="password-hash"
+)
+
 def verify_password(plain_password, hashed_password):
     """Verify a password against a hash"""
     return pwd_context.verify(plain_password, hashed_password)
@@ -27,6 +54,134 @@ def get_password_hash(password):
     """Get password hash"""
     return pwd_context.hash(password)
 
+async def verify_password_async(plain_password, hashed_password) -> bool:
+    """Verify a password against a hash on the password worker pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _password_executor, pwd_context.verify, plain_password, hashed_password
+    )
+
+async def get_password_hash_async(password) -> str:
+    """Get password hash on the password worker pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_password_executor, pwd_context.hash, password)
+
+async def verify_and_update_password(plain_password, hashed_password) -> Tuple[bool, Optional[str]]:
+    """
+    Verify a password and produce a replacement hash if the stored one is outdated
+    
+    Returns:
+        (valid, new_hash) where new_hash is None unless the stored hash was made
+        with a different cost factor or scheme and should be replaced
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _password_executor, pwd_context.verify_and_update, plain_password, hashed_password
+    )
+
+class VerifiedTokenCache:
+    """
+    Bounded LRU of tokens whose signature has already been verified
+    
+    Entries expire at the token's own "exp" claim. Revoked tokens are
+    remembered until they would have expired anyway, so a revoked token is
+    rejected even if it is presented again after being evicted. This only
+    covers the current process; revoke_token also records the revocation in
+    the user store, which get_current_user checks for the other workers.
+    """
+    
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._revoked: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, token: str) -> Optional[Dict[str, Any]]:
+        """Return the cached claims for a token, or None if it must be verified"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, claims = entry
+            if expires_at <= now:
+                del self._entries[token]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(token)
+            self.hits += 1
+            return claims
+    
+    def put(self, token: str, claims: Dict[str, Any]) -> None:
+        """Remember the verified claims of a token until its expiry"""
+        expires_at = float(claims.get("exp", time.time()))
+        with self._lock:
+            self._entries[token] = (expires_at, claims)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+    
+    def revoke(self, token: str, expires_at: Optional[float] = None) -> None:
+        """
+        Reject a token from now on
+        
+        Args:
+            token: The encoded JWT
+            expires_at: When the token expires anyway; defaults to its cached
+                expiry or ACCESS_TOKEN_EXPIRE_MINUTES from now
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.pop(token, None)
+            if expires_at is None:
+                expires_at = entry[0] if entry else now + ACCESS_TOKEN_EXPIRE_MINUTES * 60
+            self._revoked[token] = expires_at
+            # Forget revocations of tokens that have expired on their own
+            for revoked, revoked_until in list(self._revoked.items()):
+                if revoked_until <= now:
+                    del self._revoked[revoked]
+    
+    def is_revoked(self, token: str) -> bool:
+        """Whether a token has been explicitly revoked"""
+        with self._lock:
+            return token in self._revoked
+    
+    def clear(self) -> None:
+        """Forget all verified tokens (revocations are kept)"""
+        with self._lock:
+            self._entries.clear()
+
+token_cache = VerifiedTokenCache(max_entries=TOKEN_CACHE_SIZE)
+
+def _token_digest(token: str) -> str:
+    """Key of a token in the user store, so raw tokens are never persisted"""
+    return hashlib.sha256(token.encode()).hexdigest()
+
+def _token_expiry(token: str) -> float:
+    """When a token expires on its own; ACCESS_TOKEN_EXPIRE_MINUTES from now if unknown"""
+    try:
+        claims = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        if "exp" in claims:
+            return float(claims["exp"])
+    except JWTError:
+        pass
+    return time.time() + ACCESS_TOKEN_EXPIRE_MINUTES * 60
+
+def revoke_token(token: str) -> None:
+    """Revoke an access token so get_current_user rejects it in every worker"""
+    expires_at = _token_expiry(token)
+    token_cache.revoke(token, expires_at)
+    get_user_store().revoke_token(_token_digest(token), expires_at)
+
+async def revoke_token_async(token: str) -> None:
+    """Async variant of revoke_token"""
+    expires_at = _token_expiry(token)
+    token_cache.revoke(token, expires_at)
+    await get_user_store().arevoke_token(_token_digest(token), expires_at)
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     """Create JWT access token"""
     to_encode = data.copy()
@@ -47,14 +202,26 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
         headers={"WWW-Authenticate": "Bearer"},
     )
     
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
+    if token_cache.is_revoked(token):
+        raise credentials_exception
+    # Revoked by another worker process
+    if await get_user_store().ais_token_revoked(_token_digest(token)):
+        token_cache.revoke(token)
+        raise credentials_exception
+    
+    # Skip signature verification for tokens we have already verified
+    payload = token_cache.get(token)
+    if payload is None:
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        except JWTError:
             raise credentials_exception
-        
-        # In a real app, we'd fetch the user from the database
-        # For this demo, we'll just return the sub claim as the user
-        return {"email": email}
-    except JWTError:
+        token_cache.put(token, payload)
+    
+    email: str = payload.get("sub")
+    if email is None:
         raise credentials_exception
+    
+    # In a real app, we'd fetch the user from the database
+    # For this demo, we'll just return the sub claim as the user
+    return {"email": email}
@@ -1,8 +1,19 @@
-from fastapi import APIRouter, Depends, HTTPException, Body
-from pydantic import BaseModel
-from typing import Optional, List, Dict, Any
-from ..services.enhanced_azure_openai import get_azure_openai_service, AzureOpenAIService
+from fastapi import APIRouter, Depends, HTTPException, Body, Query, Response, status
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+from typing import Optional, List, Dict, Any, Literal, AsyncIterator, Tuple, Union
+import json
+import math
+import asyncio
+from ..services.enhanced_azure_openai import (
+    get_async_azure_openai_service,
+    AsyncAzureOpenAIService,
+    SQL_BATCH_CONCURRENCY
+)
+from ..services.rate_limit import rate_limited_user, get_rate_limiter
 from ..models.auth import get_current_user
+from ..services.resilience import circuit_breaker_stats
+from ..services.job_queue import DEFAULT_PRIORITY, FINISHED_STATES, JobCancelError, get_job_queue
 
 router = APIRouter()
 
@@ -22,6 +33,11 @@ class SQLGenerationRequest(BaseModel):
     metric_calculation: str
     tech_stack: str
 
+class SQLBatchRequest(BaseModel):
+    """Request for SQL generation for several metrics at once"""
+    items: List[SQLGenerationRequest] = Field(..., min_length=1, max_length=50)
+    max_concurrency: Optional[int] = Field(None, ge=1, le=SQL_BATCH_CONCURRENCY)
+
 class AIPromptRequest(BaseModel):
     """Generic AI prompt request"""
     prompt: str
@@ -31,31 +47,143 @@ class AIPromptRequest(BaseModel):
     structured_output: Optional[bool] = False
     output_schema: Optional[Dict[str, Any]] = None
 
+class Usage(BaseModel):
+    """Token usage reported by Azure OpenAI"""
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    total_tokens: int = 0
+
+class KPIMetric(BaseModel):
+    """One metric of a generated KPI system"""
+    category: Optional[str] = None
+    name: Optional[str] = None
+    description: Optional[str] = None
+    calculation: Optional[str] = None
+    importance: Optional[str] = None
+    sql_query: Optional[str] = None
+    visualization: Optional[str] = None
+    benchmark: Optional[str] = None
+
+class DashboardRecommendation(BaseModel):
+    """A dashboard grouping related metrics"""
+    name: Optional[str] = None
+    description: Optional[str] = None
+    included_metrics: List[str] = []
+
+class KPISystem(BaseModel):
+    """Structured KPI system"""
+    metrics: List[KPIMetric] = []
+    dashboard_recommendations: List[DashboardRecommendation] = []
+    summary: Optional[str] = None
+
+class KPISystemResponse(BaseModel):
+    """Generated KPI system; content is text when output_format is not structured"""
+    success: bool
+    content: Union[KPISystem, str]
+    usage: Optional[Usage] = None
+    cached: bool = False
+    degraded: Optional[Literal["cache", "example"]] = None
+    partial: bool = False
+    missing: List[str] = []
+
+class SQLResponse(BaseModel):
+    """Generated SQL for one metric"""
+    success: bool
+    content: Optional[str] = None
+    usage: Optional[Usage] = None
+    error: Optional[str] = None
+
+class SQLBatchResponse(BaseModel):
+    """Generated SQL for several metrics, in request order"""
+    success: bool
+    results: List[SQLResponse]
+
+class CompletionResponse(BaseModel):
+    """Generic completion; content is parsed JSON when structured output was requested"""
+    success: bool
+    content: Any
+    usage: Optional[Usage] = None
+    partial: bool = False
+    missing: List[str] = []
+
+class KPIJobRequest(BaseModel):
+    """Request to generate a KPI system in the background"""
+    company_info: CompanyInfo
+    output_format: Optional[str] = "structured"
+    cache: Literal["use", "bypass", "refresh"] = "use"
+    mode: Optional[Literal["single", "fanout"]] = None
+    priority: int = Field(DEFAULT_PRIORITY, ge=0, le=9, description="Higher runs first")
+
+class JobResponse(BaseModel):
+    """State of a background job; result is set once it has finished"""
+    id: str
+    kind: str
+    status: Literal["queued", "running", "succeeded", "failed", "cancelled"]
+    priority: int
+    attempts: int = 0
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    result: Optional[KPISystemResponse] = None
+    error: Optional[str] = None
+    status_code: Optional[int] = None
+
+# Longest a GET /jobs/{id}?wait= long-poll may block
+JOB_MAX_WAIT = 60
+
+def _retry_after_headers(response: Dict[str, Any]) -> Optional[Dict[str, str]]:
+    """Retry-After header for a failure the client should retry later"""
+    retry_after = response.get("retry_after")
+    if retry_after is None:
+        return None
+    return {"Retry-After": str(math.ceil(retry_after))}
+
 @router.get("/status")
 async def check_ai_status():
     """Check if the Azure OpenAI service is available and configured"""
-    service = get_azure_openai_service()
+    service = get_async_azure_openai_service()
     is_available = service.is_available()
     
     return {
         "service": "Azure OpenAI",
         "available": is_available,
-        "deployment": service.deployment_name if is_available else None
+        "deployment": service.deployment_name if is_available else None,
+        "kpi_cache": service.cache.stats(),
+        "coalescing": service.singleflight.stats(),
+        "rate_limit": get_rate_limiter().stats(),
+        "token_budget": service.budget.stats(),
+        "circuit_breakers": circuit_breaker_stats(),
+        "jobs": await asyncio.to_thread(get_job_queue().stats)
     }
 
-@router.post("/generate-kpi")
+async def start_job_queue():
+    """Start the job workers at app startup, re-queueing jobs left behind by a crashed process"""
+    await get_job_queue().start()
+
+async def stop_job_queue():
+    """Stop the job workers at app shutdown; running jobs are re-queued for the next start"""
+    await get_job_queue().stop()
+
+@router.post("/generate-kpi", response_model=KPISystemResponse)
 async def generate_kpi_system(
     company_info: CompanyInfo,
     output_format: Optional[str] = "structured",
-    current_user: dict = Depends(get_current_user)
+    cache: Literal["use", "bypass", "refresh"] = "use",
+    mode: Optional[Literal["single", "fanout"]] = None,
+    current_user: dict = Depends(rate_limited_user)
 ):
     """
     Generate a KPI system based on company information
     
     This endpoint creates a complete KPI system tailored to the company's profile,
     including metrics, SQL queries, visualizations, and benchmarks.
+    
+    Results are cached per normalized company profile. Pass cache=bypass to skip
+    the cache or cache=refresh to regenerate and replace the cached entry.
+    Pass mode=fanout to generate each metric category concurrently (structured
+    output only); the default comes from KPI_GENERATION_MODE.
     """
-    service = get_azure_openai_service()
+    service = get_async_azure_openai_service()
     
     if not service.is_available():
         raise HTTPException(
@@ -63,30 +191,70 @@ async def generate_kpi_system(
             detail="Azure OpenAI service is not available. Please check your API configuration."
         )
     
-    response = service.generate_kpi_system(
+    response = await service.generate_kpi_system(
         company_info=company_info.dict(),
-        output_format=output_format
+        output_format=output_format,
+        cache_mode=cache,
+        mode=mode
     )
     
     if not response.get("success", False):
         raise HTTPException(
-            status_code=500,
+            status_code=response.get("status_code", 500),
+            headers=_retry_after_headers(response),
             detail=f"Failed to generate KPI system: {response.get('error', 'Unknown error')}"
         )
     
     return response
 
-@router.post("/generate-sql")
+@router.post("/generate-kpi/stream")
+async def stream_kpi_system(
+    company_info: CompanyInfo,
+    cache: Literal["use", "bypass", "refresh"] = "use",
+    current_user: dict = Depends(rate_limited_user)
+):
+    """
+    Stream a KPI system as Server-Sent Events
+    
+    Emits a "metric" event for each metric as soon as the model has finished
+    writing it, then "dashboard_recommendation" events and a "summary" event,
+    followed by a final "done" (or "error") event.
+    """
+    service = get_async_azure_openai_service()
+    
+    if not service.is_available():
+        raise HTTPException(
+            status_code=503,
+            detail="Azure OpenAI service is not available. Please check your API configuration."
+        )
+    
+    events = service.stream_kpi_system(
+        company_info=company_info.dict(),
+        cache_mode=cache
+    )
+    
+    return StreamingResponse(
+        _sse_stream(events),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+async def _sse_stream(events: AsyncIterator[Tuple[str, Any]]) -> AsyncIterator[str]:
+    """Format (event, data) tuples as Server-Sent Events"""
+    async for event, data in events:
+        yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@router.post("/generate-sql", response_model=SQLResponse)
 async def generate_sql(
     request: SQLGenerationRequest,
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(rate_limited_user)
 ):
     """
     Generate SQL for a specific metric
     
     This endpoint creates SQL code tailored to the specific metric and technology stack.
     """
-    service = get_azure_openai_service()
+    service = get_async_azure_openai_service()
     
     if not service.is_available():
         raise HTTPException(
@@ -94,7 +262,7 @@ async def generate_sql(
             detail="Azure OpenAI service is not available. Please check your API configuration."
         )
     
-    response = service.generate_sql_query(
+    response = await service.generate_sql_query(
         metric_name=request.metric_name,
         metric_calculation=request.metric_calculation,
         tech_stack=request.tech_stack
@@ -102,16 +270,47 @@ async def generate_sql(
     
     if not response.get("success", False):
         raise HTTPException(
-            status_code=500,
+            status_code=response.get("status_code", 500),
+            headers=_retry_after_headers(response),
             detail=f"Failed to generate SQL: {response.get('error', 'Unknown error')}"
         )
     
     return response
 
-@router.post("/completion")
+@router.post("/generate-sql/batch", response_model=SQLBatchResponse)
+async def generate_sql_batch(
+    request: SQLBatchRequest,
+    current_user: dict = Depends(rate_limited_user)
+):
+    """
+    Generate SQL for several metrics in one request
+    
+    Items are generated concurrently and duplicates are generated once. Results
+    are returned in input order, each with its own success flag, so one failed
+    metric does not fail the batch.
+    """
+    service = get_async_azure_openai_service()
+    
+    if not service.is_available():
+        raise HTTPException(
+            status_code=503,
+            detail="Azure OpenAI service is not available. Please check your API configuration."
+        )
+    
+    results = await service.generate_sql_queries(
+        items=[item.dict() for item in request.items],
+        max_concurrency=request.max_concurrency
+    )
+    
+    return {
+        "success": all(result.get("success", False) for result in results),
+        "results": results
+    }
+
+@router.post("/completion", response_model=CompletionResponse)
 async def generate_completion(
     request: AIPromptRequest,
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(rate_limited_user)
 ):
     """
     Generate a completion using Azure OpenAI
@@ -119,7 +318,7 @@ async def generate_completion(
     This endpoint provides direct access to the Azure OpenAI completion API
     with additional features like structured output.
     """
-    service = get_azure_openai_service()
+    service = get_async_azure_openai_service()
     
     if not service.is_available():
         raise HTTPException(
@@ -127,7 +326,7 @@ async def generate_completion(
             detail="Azure OpenAI service is not available. Please check your API configuration."
         )
     
-    response = service.generate_completion(
+    response = await service.generate_completion(
         prompt=request.prompt,
         system_message=request.system_message,
         temperature=request.temperature,
@@ -138,8 +337,118 @@ async def generate_completion(
     
     if not response.get("success", False):
         raise HTTPException(
-            status_code=500,
+            status_code=response.get("status_code", 500),
+            headers=_retry_after_headers(response),
             detail=f"Failed to generate completion: {response.get('error', 'Unknown error')}"
         )
     
     return response
+
+async def _owned_job(job_id: str, current_user: dict) -> Dict[str, Any]:
+    """The job with job_id if it belongs to the current user, else 404"""
+    job = await get_job_queue().get(job_id)
+    if job is None or job["owner"] != current_user["email"]:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+def _job_view(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Public fields of a job; failed jobs report error and status_code instead of a result"""
+    view = {field: job[field] for field in JobResponse.model_fields}
+    if job["status"] != "succeeded":
+        view["result"] = None
+    return view
+
+@router.post("/jobs/kpi", response_model=JobResponse, status_code=status.HTTP_202_ACCEPTED)
+async def submit_kpi_job(
+    request: KPIJobRequest,
+    response: Response,
+    current_user: dict = Depends(rate_limited_user)
+):
+    """
+    Queue a KPI system generation and return immediately
+    
+    Poll GET /ai/jobs/{id} (optionally with ?wait= to long-poll) or subscribe
+    to GET /ai/jobs/{id}/events for the result. Jobs survive restarts.
+    """
+    service = get_async_azure_openai_service()
+    
+    if not service.is_available():
+        raise HTTPException(
+            status_code=503,
+            detail="Azure OpenAI service is not available. Please check your API configuration."
+        )
+    
+    job = await get_job_queue().submit(
+        "kpi_system",
+        {
+            "company_info": request.company_info.dict(),
+            "output_format": request.output_format,
+            "cache_mode": request.cache,
+            "mode": request.mode
+        },
+        owner=current_user["email"],
+        priority=request.priority
+    )
+    response.headers["Location"] = f"/ai/jobs/{job['id']}"
+    return _job_view(job)
+
+@router.get("/jobs/{job_id}", response_model=JobResponse)
+async def get_job(
+    job_id: str,
+    wait: float = Query(0, ge=0, le=JOB_MAX_WAIT, description="Seconds to wait for the job to finish"),
+    current_user: dict = Depends(get_current_user)
+):
+    """Get a job's state and, once it has finished, its result (long-polls with ?wait=)"""
+    await _owned_job(job_id, current_user)
+    job = await get_job_queue().wait(job_id, wait)
+    return _job_view(job)
+
+@router.get("/jobs/{job_id}/events")
+async def job_events(job_id: str, current_user: dict = Depends(get_current_user)):
+    """
+    Server-Sent Events for a job
+    
+    Emits a "status" event with the current state, another whenever the state
+    changes, and a final "done" event carrying the finished job.
+    """
+    await _owned_job(job_id, current_user)
+    return StreamingResponse(
+        _sse_stream(_job_event_stream(job_id)),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+async def _job_event_stream(job_id: str) -> AsyncIterator[Tuple[str, Any]]:
+    """(event, data) tuples following a job until it finishes"""
+    queue = get_job_queue()
+    last_status = None
+    while True:
+        # Wake up periodically so a job finished by another process is noticed too
+        job = await queue.wait(job_id, 15)
+        if job is None:
+            yield "error", {"error": "Job not found"}
+            return
+        if job["status"] in FINISHED_STATES:
+            yield "done", _job_view(job)
+            return
+        if job["status"] != last_status:
+            last_status = job["status"]
+            yield "status", {"id": job_id, "status": last_status}
+        else:
+            # Keep-alive so proxies do not drop an idle stream
+            yield "ping", {}
+
+@router.delete("/jobs/{job_id}", response_model=JobResponse)
+async def cancel_job(job_id: str, current_user: dict = Depends(get_current_user)):
+    """
+    Cancel a queued or running job; finished jobs are returned unchanged
+
+    A job running in another worker process cannot be cancelled from here
+    and gets a 409.
+    """
+    await _owned_job(job_id, current_user)
+    try:
+        job = await get_job_queue().cancel(job_id)
+    except JobCancelError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return _job_view(job)
@@ -3,25 +3,35 @@ from fastapi.security import OAuth2PasswordRequestForm
 from pydantic import BaseModel, EmailStr
 from typing import Optional
 from ..models.auth import (
-    get_password_hash,
-    verify_password,
+    pwd_context,
+    get_password_hash_async,
+    verify_and_update_password,
     create_access_token,
-    get_current_user
+    get_current_user,
+    revoke_token_async,
+    oauth2_scheme
 )
+from ..services.user_store import get_user_store
 from datetime import timedelta
+import asyncio
 
 router = APIRouter()
 
-# Mock user database - in a real app, this would be a database
-fake_users_db = {
-    "demo@metrically.ai": {
-        "email": "demo@metrically.ai",
-        "full_name": "Demo User",
-        "hashed_password": get_password_hash("demopassword"),
-        "disabled": False,
-    }
+# Pre-hashed "demopassword" (bcrypt, 12 rounds) so that importing this module does
+# not cost a bcrypt round; it is rehashed on login if BCRYPT_ROUNDS differs
+DEMO_USER_PASSWORD_HASH = "$2b$12$3ZSrcFlM1YjryaWwpSN7CuxoC/Cflt6eJruPcNnN6eyyXvfHFcnEK"
+
+DEMO_USER = {
+    "email": "demo@metrically.ai",
+    "full_name": "Demo User",
+    "hashed_password": DEMO_USER_PASSWORD_HASH,
+    "disabled": False,
 }
 
+async def seed_users():
+    """Seed the demo account at app startup; existing records are left untouched"""
+    await asyncio.to_thread(get_user_store().bulk_import, [DEMO_USER])
+
 class User(BaseModel):
     email: EmailStr
     full_name: Optional[str] = None
@@ -42,18 +52,37 @@ class UserCreate(BaseModel):
     password: str
     full_name: Optional[str] = None
 
+def _to_user(record):
+    return UserInDB(**record) if record is not None else None
+
 def get_user(email: str):
-    if email in fake_users_db:
-        user_dict = fake_users_db[email]
-        return UserInDB(**user_dict)
-    return None
+    return _to_user(get_user_store().get(email))
+
+async def get_user_async(email: str):
+    return _to_user(await get_user_store().aget(email))
 
 def authenticate_user(email: str, password: str):
     user = get_user(email)
     if not user:
         return False
-    if not verify_password(password, user.hashed_password):
+    valid, new_hash = pwd_context.verify_and_update(password, user.hashed_password)
+    if not valid:
         return False
+    if new_hash:
+        # Transparently upgrade hashes made with an outdated cost factor
+        get_user_store().update_password_hash(email, new_hash)
+    return user
+
+async def authenticate_user_async(email: str, password: str):
+    user = await get_user_async(email)
+    if not user:
+        return False
+    valid, new_hash = await verify_and_update_password(password, user.hashed_password)
+    if not valid:
+        return False
+    if new_hash:
+        # Transparently upgrade hashes made with an outdated cost factor
+        await get_user_store().aupdate_password_hash(email, new_hash)
     return user
 
 @router.post("/token", response_model=Token)
@@ -61,7 +90,7 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
     """
     OAuth2 compatible token login, get an access token for future requests
     """
-    user = authenticate_user(form_data.username, form_data.password)
+    user = await authenticate_user_async(form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -80,13 +109,13 @@ async def register_user(user: UserCreate = Body(...)):
     """
     Register a new user
     """
-    if user.email in fake_users_db:
+    if await get_user_store().aget(user.email):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Email already registered"
         )
     
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await get_password_hash_async(user.password)
     db_user = {
         "email": user.email,
         "hashed_password": hashed_password,
@@ -94,8 +123,11 @@ async def register_user(user: UserCreate = Body(...)):
         "disabled": False
     }
     
-    # In a real app, save to database
-    fake_users_db[user.email] = db_user
+    if not await get_user_store().acreate(db_user):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Email already registered"
+        )
     
     return User(
         email=user.email,
@@ -108,10 +140,18 @@ async def read_users_me(current_user: dict = Depends(get_current_user)):
     """
     Get current user
     """
-    user = get_user(current_user["email"])
+    user = await get_user_async(current_user["email"])
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="User not found"
         )
     return user
+
+@router.post("/logout")
+async def logout(token: str = Depends(oauth2_scheme), current_user: dict = Depends(get_current_user)):
+    """
+    Revoke the current access token in every worker process
+    """
+    await revoke_token_async(token)
+    return {"detail": "Logged out"}
@@ -0,0 +1,110 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from pydantic import BaseModel
+from typing import Optional, List, Dict, Literal
+import asyncio
+from ..models.auth import get_current_user
+from ..services.columnar_store import DatasetBusy, IngestError, get_columnar_store
+
+router = APIRouter()
+
+# Size of the pieces an upload is read and handed to the ingester in
+INGEST_CHUNK_BYTES = 1 << 20
+
+class IngestResponse(BaseModel):
+    """Outcome of an upload"""
+    dataset: str
+    table: str
+    rows: int
+    rejected_rows: int
+    bytes: int
+    partitions_touched: int
+    ignored_columns: List[str] = []
+
+class TableSummary(BaseModel):
+    """Stored rows of one table"""
+    rows: int
+    partitions: int
+    columns: Dict[str, str]
+    first: Optional[str] = None
+    last: Optional[str] = None
+
+class DatasetSummary(BaseModel):
+    """Tables stored in a dataset"""
+    dataset: str
+    tables: Dict[str, TableSummary]
+
+def _upload_format(content_type: str) -> str:
+    """Upload format implied by a raw body's content type"""
+    if "ndjson" in content_type or "jsonl" in content_type or "json" in content_type:
+        return "ndjson"
+    return "csv"
+
+@router.post("/ingest", response_model=IngestResponse)
+async def ingest(
+    request: Request,
+    dataset: str = Query(..., description="Dataset to append to"),
+    table: Literal["events", "transactions", "subscriptions", "marketing_spend"] = Query(...),
+    format: Optional[Literal["csv", "ndjson"]] = Query(None, description="Defaults from the Content-Type"),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Append a CSV or NDJSON upload to a table of a dataset
+
+    Send the file either as the raw request body (Content-Type text/csv or
+    application/x-ndjson), which is ingested as it streams in, or as a
+    multipart/form-data "file" field. Either way the file is processed in
+    chunks and never held in memory. CSV uploads need a header row; rows
+    without the table's partition timestamp are counted as rejected.
+    """
+    store = get_columnar_store()
+    content_type = request.headers.get("content-type", "")
+    multipart = content_type.startswith("multipart/form-data")
+    fmt = format or ("csv" if multipart else _upload_format(content_type))
+
+    try:
+        ingestion = store.open_ingest(current_user["email"], dataset, table, fmt)
+    except IngestError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except DatasetBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+    try:
+        if multipart:
+            # python-multipart spools the part to a temporary file; read it back in chunks
+            form = await request.form()
+            upload = form.get("file")
+            if upload is None or isinstance(upload, str):
+                raise IngestError("Multipart uploads need a file field named 'file'")
+            if format is None and upload.filename and upload.filename.endswith((".ndjson", ".jsonl")):
+                ingestion.format = "ndjson"
+            while True:
+                chunk = await upload.read(INGEST_CHUNK_BYTES)
+                if not chunk:
+                    break
+                await asyncio.to_thread(ingestion.feed, chunk)
+        else:
+            buffer = bytearray()
+            async for chunk in request.stream():
+                buffer += chunk
+                if len(buffer) >= INGEST_CHUNK_BYTES:
+                    await asyncio.to_thread(ingestion.feed, bytes(buffer))
+                    buffer.clear()
+            if buffer:
+                await asyncio.to_thread(ingestion.feed, bytes(buffer))
+        summary = await asyncio.to_thread(ingestion.close)
+    except IngestError as e:
+        ingestion.abort()
+        raise HTTPException(status_code=422, detail=str(e))
+    except BaseException:
+        ingestion.abort()
+        raise
+
+    return {"dataset": dataset, **summary}
+
+@router.get("/datasets/{dataset}", response_model=DatasetSummary)
+async def get_dataset(dataset: str, current_user: dict = Depends(get_current_user)):
+    """Describe the tables stored in a dataset"""
+    try:
+        return await asyncio.to_thread(get_columnar_store().summary, current_user["email"], dataset)
+    except IngestError as e:
+        raise HTTPException(status_code=422, detail=str(e))
@@ -1,8 +1,15 @@
-from fastapi import APIRouter, Depends, HTTPException, Body
-from pydantic import BaseModel
-from typing import Optional, List
-from ..services.azure_openai import generate_kpi_system, generate_sql_for_metric
-from ..models.auth import get_current_user
+from fastapi import APIRouter, Depends, HTTPException, Body, Query, Request, Response
+from pydantic import BaseModel, Field
+from typing import Optional, List, Dict, Any, Literal
+import asyncio
+import numpy as np
+from ..services.azure_openai import generate_kpi_system_async, generate_sql_for_metric_async
+from ..services.rate_limit import rate_limited_user
+from ..services.example_catalog import EXAMPLE_CATALOG_MAX_AGE, get_example_catalog
+from ..services.kpi_engine import METRIC_TABLES, KPIComputeError, compute_kpis, period_edges
+from ..services.cohort_engine import compute_cohorts
+from ..services.experiment_engine import experiment_impact, shutdown_bootstrap_pool
+from ..services.columnar_store import IngestError, get_columnar_store
 
 router = APIRouter()
 
@@ -14,17 +21,116 @@ class KPIRequest(BaseModel):
 
 class MetricDetail(BaseModel):
     name: str
+    category: str = ""
     description: str
     calculation: str
     importance: str
+    sql: str = ""
+    visualization: str = ""
+    benchmark: str = ""
+
+class KPIGenerationResponse(BaseModel):
+    raw_response: str
+    tech_stack: str
+    metrics: List[MetricDetail] = []
+    metrics_count: int
+    has_sql: bool
+    has_visualizations: bool
+    has_benchmarks: bool
+
+class SQLResponse(BaseModel):
+    sql: str
 
 class SQLRequest(BaseModel):
     metric_name: str
     metric_calculation: str
     tech_stack: str
 
-@router.post("/generate")
-async def generate_kpi(request: KPIRequest, current_user: dict = Depends(get_current_user)):
+class KPIComputeRequest(BaseModel):
+    """Metrics to compute over columnar tables"""
+    metrics: List[str] = Field(..., min_length=1)
+    tables: Optional[Dict[str, Dict[str, List[Any]]]] = Field(
+        None,
+        description="Table name (subscriptions, transactions, events, marketing_spend) -> column name -> values"
+    )
+    dataset: Optional[str] = Field(None, description="Dataset uploaded through /data/ingest, instead of tables")
+    period: Literal["day", "week", "month", "quarter", "year"] = "month"
+    start: Optional[str] = None
+    end: Optional[str] = None
+    conversion_event: str = "purchase"
+
+class KPIComputeResponse(BaseModel):
+    """Metric values per period; null where a metric is undefined"""
+    period: str
+    periods: List[str]
+    metrics: Dict[str, List[Optional[float]]]
+
+class CohortRequest(BaseModel):
+    """Signup cohorts to compute retention for"""
+    events: Optional[Dict[str, List[Any]]] = Field(None, description="Column name (user_id, timestamp, event) -> values")
+    dataset: Optional[str] = Field(None, description="Dataset uploaded through /data/ingest, instead of events")
+    period: Literal["day", "week", "month"] = "week"
+    horizon: int = Field(12, ge=1, le=400, description="Periods after signup to report")
+    retention: Literal["n_day", "unbounded"] = "n_day"
+    start: Optional[str] = Field(None, description="Earliest signup to include")
+    end: Optional[str] = Field(None, description="Latest signup to include")
+    signup_event: Optional[str] = Field(None, description="Event that defines signup; defaults to the first event")
+    activity_event: Optional[str] = Field(None, description="Event that counts as returning; defaults to any event")
+
+class CohortResponse(BaseModel):
+    """Cohort x period retention; null for periods not observed yet"""
+    period: str
+    retention: str
+    horizon: int
+    cohorts: List[str]
+    sizes: List[int]
+    counts: List[List[Optional[int]]]
+    percentages: List[List[Optional[float]]]
+    average: List[Optional[float]]
+
+class ExperimentImpactRequest(BaseModel):
+    """Flag exposures and outcomes to compare variants on"""
+    exposures: Dict[str, List[Any]] = Field(
+        ..., description="Column name (user_id, variant, optional timestamp and covariate) -> values"
+    )
+    outcomes: Dict[str, List[Any]] = Field(
+        ..., description="Column name (user_id, optional value, timestamp and event) -> values"
+    )
+    control: str = "control"
+    metric: Literal["sum", "count", "conversion"] = "sum"
+    outcome_event: Optional[str] = None
+    confidence: float = Field(0.95, gt=0, lt=1)
+    cuped: bool = True
+    resamples: int = Field(10000, ge=0, le=100000, description="Bootstrap resamples; 0 skips the bootstrap")
+    seed: Optional[int] = Field(None, ge=0, description="Bootstrap seed for reproducible intervals")
+
+class VariantSummary(BaseModel):
+    """Outcome metric of one variant's users"""
+    variant: str
+    users: int
+    mean: Optional[float] = None
+    std: Optional[float] = None
+
+class VariantComparison(BaseModel):
+    """A variant against control: Welch, CUPED-adjusted and bootstrap estimates"""
+    variant: str
+    welch: Dict[str, Any]
+    cuped: Optional[Dict[str, Any]] = None
+    bootstrap: Optional[Dict[str, Any]] = None
+
+class ExperimentImpactResponse(BaseModel):
+    """Impact of each variant on the outcome metric"""
+    control: str
+    metric: str
+    confidence: float
+    resamples: int
+    seed: Optional[int] = None
+    excluded_users: int
+    variants: List[VariantSummary]
+    comparisons: List[VariantComparison]
+
+@router.post("/generate", response_model=KPIGenerationResponse)
+async def generate_kpi(request: KPIRequest, current_user: dict = Depends(rate_limited_user)):
     """
     Generate a KPI system based on the provided parameters.
     
@@ -34,7 +140,7 @@ async def generate_kpi(request: KPIRequest, current_user: dict = Depends(get_cur
     if not request.product_type or not request.company_stage or not request.tech_stack:
         raise HTTPException(status_code=400, detail="Missing required parameters")
     
-    response = generate_kpi_system(
+    response = await generate_kpi_system_async(
         product_type=request.product_type,
         company_stage=request.company_stage,
         tech_stack=request.tech_stack,
@@ -46,14 +152,14 @@ async def generate_kpi(request: KPIRequest, current_user: dict = Depends(get_cur
     
     return response
 
-@router.post("/generate-sql")
-async def generate_sql(request: SQLRequest, current_user: dict = Depends(get_current_user)):
+@router.post("/generate-sql", response_model=SQLResponse)
+async def generate_sql(request: SQLRequest, current_user: dict = Depends(rate_limited_user)):
     """
     Generate SQL for a specific metric.
     
     This endpoint creates SQL code tailored to the specific metric and technology stack.
     """
-    sql = generate_sql_for_metric(
+    sql = await generate_sql_for_metric_async(
         metric_name=request.metric_name,
         metric_calculation=request.metric_calculation,
         tech_stack=request.tech_stack
@@ -61,53 +167,174 @@ async def generate_sql(request: SQLRequest, current_user: dict = Depends(get_cur
     
     return {"sql": sql}
 
+def load_example_catalog():
+    """Load and pre-serialize the example systems catalog once (run at app startup)"""
+    get_example_catalog().load()
+
+def stop_bootstrap_pool():
+    """Stop the bootstrap worker processes (run at app shutdown)"""
+    shutdown_bootstrap_pool()
+
 @router.get("/example-systems")
-async def get_example_systems():
+async def get_example_systems(
+    request: Request,
+    product_type: Optional[str] = Query(None, description="Only examples for this product type"),
+    company_stage: Optional[str] = Query(None, description="Only examples for this company stage")
+):
     """
     Get example KPI systems for different types of products.
     
     This endpoint returns pre-generated examples to showcase the capabilities.
+    Responses are served from a pre-serialized catalog with a strong ETag, so
+    clients revalidating with If-None-Match get an empty 304.
+    """
+    entry = get_example_catalog().lookup(product_type, company_stage)
+    headers = {
+        "ETag": entry.etag,
+        "Cache-Control": f"public, max-age={EXAMPLE_CATALOG_MAX_AGE}"
+    }
+    
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        tags = {tag.strip() for tag in if_none_match.split(",")}
+        if "*" in tags or entry.etag in tags:
+            return Response(status_code=304, headers=headers)
+    
+    return Response(content=entry.body, media_type="application/json", headers=headers)
+
+@router.post("/compute", response_model=KPIComputeResponse)
+async def compute_metrics(request: KPIComputeRequest, current_user: dict = Depends(rate_limited_user)):
+    """
+    Compute standard metrics over uploaded tables.
+    
+    Supports mrr, active_subscriptions, new_customers, churn_rate, arpu, ltv
+    and cac from subscriptions (customer_id, amount, start, optional end and
+    interval) and marketing_spend (amount, timestamp); revenue, orders and aov
+    from transactions (amount, timestamp); and active_users, conversion_rate
+    and dau_mau from events (user_id, timestamp, event).
+    
+    Pass the tables inline, or name a dataset ingested through /data/ingest;
+    stored partitions outside start/end are not read.
+    """
+    if (request.tables is None) == (request.dataset is None):
+        raise HTTPException(status_code=422, detail="Provide exactly one of tables or dataset")
+    
+    try:
+        tables = request.tables
+        if tables is None:
+            tables = await asyncio.to_thread(
+                _load_dataset, current_user["email"], request.dataset, request.metrics,
+                request.period, request.start, request.end
+            )
+        return await asyncio.to_thread(
+            compute_kpis,
+            tables,
+            request.metrics,
+            request.period,
+            request.start,
+            request.end,
+            request.conversion_event
+        )
+    except (KPIComputeError, IngestError) as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+@router.post("/cohorts", response_model=CohortResponse)
+async def compute_cohort_retention(request: CohortRequest, current_user: dict = Depends(rate_limited_user)):
+    """
+    Compute a signup-cohort retention matrix from events.
+    
+    Users are grouped by the period of their first signup event; column k
+    counts those active k periods later ("n_day") or k or more periods later
+    ("unbounded"), as counts and as percentages of the cohort.
+    
+    Pass the events inline, or name a dataset ingested through /data/ingest.
+    """
+    if (request.events is None) == (request.dataset is None):
+        raise HTTPException(status_code=422, detail="Provide exactly one of events or dataset")
+    
+    try:
+        events = request.events
+        if events is None:
+            # Signups before start still decide cohorts, so the whole table is read
+            events = await asyncio.to_thread(
+                get_columnar_store().load_table, current_user["email"], request.dataset, "events"
+            )
+            if events is None:
+                raise KPIComputeError(f"Dataset {request.dataset} has no events")
+        return await asyncio.to_thread(
+            compute_cohorts,
+            events,
+            request.period,
+            request.horizon,
+            request.retention,
+            request.start,
+            request.end,
+            request.signup_event,
+            request.activity_event
+        )
+    except (KPIComputeError, IngestError) as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+@router.post("/experiments/impact", response_model=ExperimentImpactResponse)
+async def compute_experiment_impact(request: ExperimentImpactRequest, current_user: dict = Depends(rate_limited_user)):
+    """
+    Measure the impact of feature-flag variants on an outcome metric.
+    
+    Each variant is compared with control by Welch's t-test, by the same
+    test on CUPED-adjusted outcomes (using a covariate column on exposures,
+    or the metric before first exposure when both tables have timestamps),
+    and by a percentile bootstrap. Pass a seed to make the bootstrap
+    intervals reproducible; the seed used is always returned.
+    """
+    try:
+        return await asyncio.to_thread(
+            experiment_impact,
+            request.exposures,
+            request.outcomes,
+            request.control,
+            request.metric,
+            request.outcome_event,
+            request.confidence,
+            request.cuped,
+            request.resamples,
+            request.seed
+        )
+    except KPIComputeError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+def _load_dataset(
+    owner: str,
+    dataset: str,
+    metrics: List[str],
+    period: str,
+    start: Optional[str],
+    end: Optional[str]
+) -> Dict[str, Any]:
+    """
+    Tables of a stored dataset needed by metrics, limited to partitions that can affect [start, end]
+
+    The bounds are first widened to the calendar periods compute_kpis will
+    report, so pruning never drops rows that fall in a reported period.
+    Subscriptions are not pruned from below for new_customers and cac,
+    which need every customer's first subscription, however old.
     """
-    examples = [
-        {
-            "name": "SaaS Starter Pack",
-            "product_type": "SaaS",
-            "company_stage": "Seed",
-            "metrics": [
-                "MRR (Monthly Recurring Revenue)",
-                "CAC (Customer Acquisition Cost)",
-                "LTV (Lifetime Value)",
-                "Churn Rate",
-                "Activation Rate",
-                "Feature Adoption"
-            ]
-        },
-        {
-            "name": "E-commerce Growth Kit",
-            "product_type": "E-commerce",
-            "company_stage": "Series A",
-            "metrics": [
-                "Average Order Value",
-                "Conversion Rate",
-                "Customer Retention Rate",
-                "Return Rate",
-                "Cart Abandonment Rate",
-                "Revenue per Visitor"
-            ]
-        },
-        {
-            "name": "Mobile App Traction",
-            "product_type": "Mobile App",
-            "company_stage": "Pre-seed",
-            "metrics": [
-                "DAU/MAU Ratio",
-                "Session Duration",
-                "Retention D1/D7/D30",
-                "Install to Sign-up Rate",
-                "Push Notification Opt-in Rate",
-                "Feature Engagement Depth"
-            ]
-        }
-    ]
-    
-    return examples
+    store = get_columnar_store()
+    try:
+        bounds = [np.datetime64(value, "s") if value else None for value in (start, end)]
+    except ValueError as e:
+        raise KPIComputeError(f"Invalid start or end: {str(e)}")
+    low, high = bounds
+    if low is not None and high is not None and high < low:
+        raise KPIComputeError("end is before start")
+    if low is not None or high is not None:
+        edges = period_edges(low if low is not None else high, high if high is not None else low, period)
+        low = edges[0] if low is not None else None
+        high = edges[-1] - np.timedelta64(1, "s") if high is not None else None
+    first_subscriptions = any(metric in ("new_customers", "cac") for metric in metrics)
+    tables = {}
+    for table in {table for metric in metrics for table in METRIC_TABLES.get(metric, ())}:
+        table_low = None if table == "subscriptions" and first_subscriptions else low
+        columns = store.load_table(owner, dataset, table, table_low, high)
+        if columns is not None:
+            tables[table] = columns
+    return tables
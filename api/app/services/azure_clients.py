@@ -0,0 +1,121 @@
+import os
+import logging
+import threading
+from typing import Dict, Optional, Tuple
+
+import httpx
+from openai import AzureOpenAI, AsyncAzureOpenAI
+from dotenv import load_dotenv
+
+# Configure logger
+logger = logging.getLogger(__name__)
+
+# Load environment variables
+load_dotenv()
+
+# Connection pool and timeout settings shared by every Azure OpenAI client
+MAX_CONNECTIONS = int(os.getenv("AZURE_OPENAI_MAX_CONNECTIONS", "100"))
+MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("AZURE_OPENAI_MAX_KEEPALIVE_CONNECTIONS", "20"))
+KEEPALIVE_EXPIRY = float(os.getenv("AZURE_OPENAI_KEEPALIVE_EXPIRY", "30"))
+CONNECT_TIMEOUT = float(os.getenv("AZURE_OPENAI_CONNECT_TIMEOUT", "5"))
+REQUEST_TIMEOUT = float(os.getenv("AZURE_OPENAI_TIMEOUT", "60"))
+
+_lock = threading.RLock()
+_http_client: Optional[httpx.Client] = None
+_async_http_client: Optional[httpx.AsyncClient] = None
+_clients: Dict[Tuple[str, str, str], AzureOpenAI] = {}
+_async_clients: Dict[Tuple[str, str, str], AsyncAzureOpenAI] = {}
+
+def _limits() -> httpx.Limits:
+    """Connection pool limits from the environment"""
+    return httpx.Limits(
+        max_connections=MAX_CONNECTIONS,
+        max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=KEEPALIVE_EXPIRY
+    )
+
+def _timeout() -> httpx.Timeout:
+    """Request timeouts from the environment"""
+    return httpx.Timeout(REQUEST_TIMEOUT, connect=CONNECT_TIMEOUT)
+
+def get_http_client() -> httpx.Client:
+    """
+    Get the process-wide pooled HTTP client for synchronous Azure calls
+
+    Returns:
+        httpx.Client: A keep-alive client shared by all sync Azure OpenAI clients
+    """
+    global _http_client
+    with _lock:
+        if _http_client is None or _http_client.is_closed:
+            _http_client = httpx.Client(limits=_limits(), timeout=_timeout())
+        return _http_client
+
+def get_async_http_client() -> httpx.AsyncClient:
+    """
+    Get the process-wide pooled HTTP client for async Azure calls
+
+    Returns:
+        httpx.AsyncClient: A keep-alive client shared by all async Azure OpenAI clients
+    """
+    global _async_http_client
+    with _lock:
+        if _async_http_client is None or _async_http_client.is_closed:
+            _async_http_client = httpx.AsyncClient(limits=_limits(), timeout=_timeout())
+        return _async_http_client
+
+def get_shared_client(api_key: str, endpoint: str, api_version: str) -> AzureOpenAI:
+    """
+    Get a long-lived AzureOpenAI client for the given credentials
+
+    Clients are created once per (endpoint, key, API version) and all of
+    them send requests through the shared connection pool.
+
+    Returns:
+        AzureOpenAI: A configured Azure OpenAI client
+    """
+    key = (endpoint, api_key, api_version)
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            client = AzureOpenAI(
+                api_key=api_key,
+                api_version=api_version,
+                azure_endpoint=endpoint,
+                http_client=get_http_client()
+            )
+            _clients[key] = client
+        return client
+
+def get_shared_async_client(api_key: str, endpoint: str, api_version: str) -> AsyncAzureOpenAI:
+    """
+    Get a long-lived AsyncAzureOpenAI client for the given credentials
+
+    Returns:
+        AsyncAzureOpenAI: A configured async Azure OpenAI client
+    """
+    key = (endpoint, api_key, api_version)
+    with _lock:
+        client = _async_clients.get(key)
+        if client is None:
+            client = AsyncAzureOpenAI(
+                api_key=api_key,
+                api_version=api_version,
+                azure_endpoint=endpoint,
+                http_client=get_async_http_client()
+            )
+            _async_clients[key] = client
+        return client
+
+async def close_clients() -> None:
+    """Close the shared connection pools, e.g. on application shutdown"""
+    global _http_client, _async_http_client
+    with _lock:
+        http_client, _http_client = _http_client, None
+        async_http_client, _async_http_client = _async_http_client, None
+        _clients.clear()
+        _async_clients.clear()
+    if http_client is not None:
+        http_client.close()
+    if async_http_client is not None:
+        await async_http_client.aclose()
@@ -1,5 +1,10 @@
 import os
-from openai import AzureOpenAI
+import time
+from openai import AzureOpenAI, AsyncAzureOpenAI
+from .azure_clients import get_shared_client, get_shared_async_client
+from .rate_limit import record_usage
+from .metrics import observe_upstream
+from .kpi_text_parser import parse_kpi_sections
 from dotenv import load_dotenv
 import logging
 
@@ -12,25 +17,44 @@ load_dotenv()
 
 def get_azure_client():
     """
-    Create and return an Azure OpenAI client instance.
+    Return the shared Azure OpenAI client instance.
     
-    This function sets up the connection to Azure OpenAI API
-    using environment variables.
+    The client is created once from environment variables and reuses a
+    pooled keep-alive connection for every request.
     
     Returns:
         AzureOpenAI: A configured Azure OpenAI client
     """
     try:
-        client = AzureOpenAI(
-            api_key=os.getenv("AZURE_OPENAI_API_KEY"),  
-            api_version=os.getenv("AZURE_OPENAI_API_VERSION", "2023-05-15"),
-            azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT")
+        return get_shared_client(
+            api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+            endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+            api_version=os.getenv("AZURE_OPENAI_API_VERSION", "2023-05-15")
         )
-        return client
     except Exception as e:
         logger.error(f"Failed to initialize Azure OpenAI client: {str(e)}")
         return None
 
+def get_async_azure_client():
+    """
+    Return the shared async Azure OpenAI client instance.
+    
+    Used by the async variants below so that the /kpi endpoints do not
+    block the event loop while waiting on the model.
+    
+    Returns:
+        AsyncAzureOpenAI: A configured async Azure OpenAI client
+    """
+    try:
+        return get_shared_async_client(
+            api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+            endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+            api_version=os.getenv("AZURE_OPENAI_API_VERSION", "2023-05-15")
+        )
+    except Exception as e:
+        logger.error(f"Failed to initialize async Azure OpenAI client: {str(e)}")
+        return None
+
 def verify_api_key():
     """
     Verify that the Azure OpenAI API key is configured and valid.
@@ -67,22 +91,17 @@ def generate_kpi_system(product_type, company_stage, tech_stack, industry=None):
         logger.error("Failed to get Azure OpenAI client")
         return None
     
-    deployment_name = os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME", "gpt-4")
-    
     try:
-        prompt = create_kpi_prompt(product_type, company_stage, tech_stack, industry)
-        
         # Call Azure OpenAI API
-        response = client.chat.completions.create(
-            model=deployment_name,
-            messages=[
-                {"role": "system", "content": "You are an expert KPI architect and data analyst for startups."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.5,
-            max_tokens=2000,
-            top_p=0.95
-        )
+        request = kpi_request(product_type, company_stage, tech_stack, industry)
+        started = time.perf_counter()
+        try:
+            response = client.chat.completions.create(**request)
+        except Exception:
+            observe_upstream(request["model"], "kpi_system", started, "error")
+            raise
+        observe_upstream(request["model"], "kpi_system", started, "success", response.usage)
+        record_usage(response.usage)
         
         # Process and structure the response
         raw_response = response.choices[0].message.content
@@ -94,6 +113,55 @@ def generate_kpi_system(product_type, company_stage, tech_stack, industry=None):
         logger.error(f"Error generating KPI system: {str(e)}")
         return None
 
+async def generate_kpi_system_async(product_type, company_stage, tech_stack, industry=None):
+    """
+    Async variant of generate_kpi_system.
+    
+    Takes the same arguments and returns the same structure, but awaits the
+    model instead of blocking the calling thread.
+    """
+    client = get_async_azure_client()
+    if not client:
+        logger.error("Failed to get async Azure OpenAI client")
+        return None
+    
+    try:
+        request = kpi_request(product_type, company_stage, tech_stack, industry)
+        started = time.perf_counter()
+        try:
+            response = await client.chat.completions.create(**request)
+        except Exception:
+            observe_upstream(request["model"], "kpi_system", started, "error")
+            raise
+        observe_upstream(request["model"], "kpi_system", started, "success", response.usage)
+        record_usage(response.usage)
+        raw_response = response.choices[0].message.content
+        return parse_kpi_response(raw_response, tech_stack)
+        
+    except Exception as e:
+        logger.error(f"Error generating KPI system: {str(e)}")
+        return None
+
+def kpi_request(product_type, company_stage, tech_stack, industry=None):
+    """
+    Build the chat completions arguments for a KPI system request.
+    
+    Returns:
+        dict: Keyword arguments for client.chat.completions.create
+    """
+    prompt = create_kpi_prompt(product_type, company_stage, tech_stack, industry)
+    
+    return {
+        "model": os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME", "gpt-4"),
+        "messages": [
+            {"role": "system", "content": "You are an expert KPI architect and data analyst for startups."},
+            {"role": "user", "content": prompt}
+        ],
+        "temperature": 0.5,
+        "max_tokens": 2000,
+        "top_p": 0.95
+    }
+
 def create_kpi_prompt(product_type, company_stage, tech_stack, industry=None):
     """
     Create a prompt for the KPI system generation.
@@ -139,7 +207,8 @@ def parse_kpi_response(raw_response, tech_stack):
     """
     Parse the raw response from OpenAI into a structured format.
     
-    In a real application, this would be more sophisticated with regex or LLM-based parsing.
+    The METRICS / SQL QUERIES / DASHBOARD VISUALIZATION / BENCHMARKS sections
+    are read in a single pass into one record per metric.
     
     Args:
         raw_response (str): Raw text response from OpenAI
@@ -148,18 +217,16 @@ def parse_kpi_response(raw_response, tech_stack):
     Returns:
         dict: Structured KPI response
     """
-    # This is a simplified parsing - in production this would be more robust
-    categories = ["METRICS", "SQL QUERIES", "DASHBOARD VISUALIZATION", "BENCHMARKS"]
+    metrics = parse_kpi_sections(raw_response or "")
     
-    # For now, we're just returning the raw response with some minimal structure
-    # In a real app, this would parse the text into distinct metrics with their properties
     return {
         "raw_response": raw_response,
         "tech_stack": tech_stack,
-        "metrics_count": raw_response.lower().count("metric"),
-        "has_sql": "sql" in raw_response.lower(),
-        "has_visualizations": "visualization" in raw_response.lower() or "chart" in raw_response.lower(),
-        "has_benchmarks": "benchmark" in raw_response.lower() or "target" in raw_response.lower()
+        "metrics": metrics,
+        "metrics_count": len(metrics),
+        "has_sql": any(metric["sql"] for metric in metrics),
+        "has_visualizations": any(metric["visualization"] for metric in metrics),
+        "has_benchmarks": any(metric["benchmark"] for metric in metrics)
     }
 
 def generate_sql_for_metric(metric_name, metric_calculation, tech_stack):
@@ -178,8 +245,56 @@ def generate_sql_for_metric(metric_name, metric_calculation, tech_stack):
     if not client:
         return "-- Failed to generate SQL query - API connection error"
     
-    deployment_name = os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME", "gpt-4")
+    try:
+        request = sql_request(metric_name, metric_calculation, tech_stack)
+        started = time.perf_counter()
+        try:
+            response = client.chat.completions.create(**request)
+        except Exception:
+            observe_upstream(request["model"], "sql", started, "error")
+            raise
+        observe_upstream(request["model"], "sql", started, "success", response.usage)
+        record_usage(response.usage)
+        
+        return response.choices[0].message.content.strip()
+    except Exception as e:
+        logger.error(f"Error generating SQL: {str(e)}")
+        return "-- Failed to generate SQL query due to an error"
+
+async def generate_sql_for_metric_async(metric_name, metric_calculation, tech_stack):
+    """
+    Async variant of generate_sql_for_metric.
+    
+    Returns:
+        str: Generated SQL query
+    """
+    client = get_async_azure_client()
+    if not client:
+        return "-- Failed to generate SQL query - API connection error"
+    
+    try:
+        request = sql_request(metric_name, metric_calculation, tech_stack)
+        started = time.perf_counter()
+        try:
+            response = await client.chat.completions.create(**request)
+        except Exception:
+            observe_upstream(request["model"], "sql", started, "error")
+            raise
+        observe_upstream(request["model"], "sql", started, "success", response.usage)
+        record_usage(response.usage)
+        
+        return response.choices[0].message.content.strip()
+    except Exception as e:
+        logger.error(f"Error generating SQL: {str(e)}")
+        return "-- Failed to generate SQL query due to an error"
+
+def sql_request(metric_name, metric_calculation, tech_stack):
+    """
+    Build the chat completions arguments for a SQL generation request.
     
+    Returns:
+        dict: Keyword arguments for client.chat.completions.create
+    """
     prompt = f"""
     Create a SQL query for {tech_stack} that calculates the '{metric_name}' metric.
     
@@ -191,18 +306,12 @@ def generate_sql_for_metric(metric_name, metric_calculation, tech_stack):
     Only return the SQL query, nothing else.
     """
     
-    try:
-        response = client.chat.completions.create(
-            model=deployment_name,
-            messages=[
-                {"role": "system", "content": "You are a SQL expert that creates clean, efficient queries."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.3,
-            max_tokens=500
-        )
-        
-        return response.choices[0].message.content.strip()
-    except Exception as e:
-        logger.error(f"Error generating SQL: {str(e)}")
-        return "-- Failed to generate SQL query due to an error"
+    return {
+        "model": os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME", "gpt-4"),
+        "messages": [
+            {"role": "system", "content": "You are a SQL expert that creates clean, efficient queries."},
+            {"role": "user", "content": prompt}
+        ],
+        "temperature": 0.3,
+        "max_tokens": 500
+    }
@@ -0,0 +1,197 @@
+import logging
+from typing import Any, Dict, List, Mapping, Optional
+
+import numpy as np
+
+from .kpi_engine import NAT, KPIComputeError, bucket, encode_ids, json_floats, period_edges, to_seconds
+
+# Configure logger
+logger = logging.getLogger(__name__)
+
+RETENTION_MODES = ("n_day", "unbounded")
+
+# Largest users x horizon grid marked in a bitmap (one byte per cell); larger
+# inputs fall back to sorting the (user, offset) keys
+BITMAP_MAX_CELLS = 1 << 27
+
+def _period_index(seconds: np.ndarray, edges: np.ndarray) -> np.ndarray:
+    """
+    Same as bucket for edges that fall on midnights (epoch seconds)
+
+    Looks each row's day up in a table of day -> period rather than
+    binary-searching the edges, which is several times faster on tens of
+    millions of rows.
+    """
+    first_day = int(edges[0]) // 86400
+    days = int(edges[-1]) // 86400 - first_day
+    lookup = bucket(np.arange(first_day, first_day + days, dtype=np.int64) * 86400, edges)
+    day = seconds // 86400 - first_day
+    inside = (day >= 0) & (day < days)
+    return np.where(inside, lookup[np.where(inside, day, 0)], -1)
+
+def _active_cells(users: np.ndarray, offsets: np.ndarray, user_count: int, horizon: int) -> np.ndarray:
+    """Distinct user * horizon + offset keys, from a bitmap when it fits in BITMAP_MAX_CELLS"""
+    keys = users * horizon + offsets
+    if user_count * horizon <= BITMAP_MAX_CELLS:
+        seen = np.zeros(user_count * horizon, dtype=bool)
+        seen[keys] = True
+        return np.flatnonzero(seen)
+    return np.unique(keys)
+
+def cohort_retention(
+    events: Mapping[str, Any],
+    period: str = "week",
+    horizon: int = 12,
+    retention: str = "n_day",
+    start: Optional[np.datetime64] = None,
+    end: Optional[np.datetime64] = None,
+    signup_event: Optional[str] = None,
+    activity_event: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Signup-cohort x period retention matrix
+
+    A user's cohort is the calendar period of their first signup_event (or
+    first event of any kind). In "n_day" mode a user counts in column k if
+    they had an activity_event (or any event) in the k-th period after
+    their cohort's; in "unbounded" mode if they had one in that period or
+    any later one. Column 0 is the signup period itself.
+
+    Everything is done with whole-column operations: first-seen times come
+    from np.minimum.at, periods from a per-day lookup table, distinct
+    (user, offset) pairs from a bitmap over the users x horizon grid (or a
+    sort of the combined keys when that grid is too large), and the matrix
+    from one bincount.
+
+    Args:
+        events: Column name -> values with user_id, timestamp and optional event
+        period: Calendar period of cohorts and columns
+        horizon: Number of periods after signup to report
+        retention: One of RETENTION_MODES
+        start: Earliest signup to include (defaults to the first one)
+        end: Latest signup to include (defaults to the last one)
+        signup_event: Event that defines signup
+        activity_event: Event that counts as returning
+
+    Returns:
+        {"cohorts": period starts, "sizes": users per cohort, "counts":
+        cohorts x horizon, "observed": cohorts x horizon bool}; cells after
+        the last event are not observed yet
+
+    Raises:
+        KPIComputeError: If the events cannot produce a matrix
+    """
+    if retention not in RETENTION_MODES:
+        raise KPIComputeError(f"Unknown retention {retention!r}; expected one of {', '.join(RETENTION_MODES)}")
+    if horizon < 1:
+        raise KPIComputeError("horizon must be at least 1")
+    missing = [c for c in ("user_id", "timestamp") if c not in events]
+    if (signup_event or activity_event) and "event" not in events:
+        missing.append("event")
+    if missing:
+        raise KPIComputeError(f"Table events is missing columns: {', '.join(missing)}")
+    if len({len(values) for values in events.values()}) > 1:
+        raise KPIComputeError("Columns of table events have different lengths")
+
+    seconds = to_seconds(events["timestamp"])
+    valid = seconds != NAT
+    users = encode_ids(events["user_id"])
+    names = np.asarray(events["event"]) if "event" in events else None
+    user_count = int(users.max()) + 1 if users.size else 0
+
+    signups = valid if signup_event is None else valid & (names == signup_event)
+    if not signups.any():
+        raise KPIComputeError("The events contain no signups")
+    first_seen = np.full(user_count, np.iinfo(np.int64).max, dtype=np.int64)
+    np.minimum.at(first_seen, users[signups], seconds[signups])
+    signed_up = first_seen[first_seen != np.iinfo(np.int64).max]
+
+    low = np.datetime64(int(signed_up.min()), "s") if start is None else np.datetime64(start, "s")
+    high = np.datetime64(int(signed_up.max()), "s") if end is None else np.datetime64(end, "s")
+    if high < low:
+        raise KPIComputeError("end is before start")
+    last_event = np.datetime64(int(seconds[valid].max()), "s")
+    edges = period_edges(low, max(high, last_event), period)
+    edge_seconds = edges.astype(np.int64)
+    cohort_count = int(bucket(np.array([high.astype(np.int64)]), edge_seconds)[0]) + 1
+    last_period = int(bucket(np.array([last_event.astype(np.int64)]), edge_seconds)[0])
+    if last_event < low:
+        last_period = -1
+
+    # Cohort of every user; -1 for users who signed up outside [start, end]
+    cohort = _period_index(first_seen, edge_seconds)
+    cohort[(first_seen < low.astype(np.int64)) | (first_seen > high.astype(np.int64)) | (cohort >= cohort_count)] = -1
+    sizes = np.bincount(cohort[cohort >= 0], minlength=cohort_count)[:cohort_count]
+
+    active = valid if activity_event is None else valid & (names == activity_event)
+    active_users = users[active]
+    active_cohort = cohort[active_users]
+    offsets = _period_index(seconds[active], edge_seconds) - active_cohort
+    keep = (active_cohort >= 0) & (offsets >= 0)
+    active_users, offsets = active_users[keep], offsets[keep]
+
+    if retention == "n_day":
+        in_horizon = offsets < horizon
+        cells = _active_cells(active_users[in_horizon], offsets[in_horizon], user_count, horizon)
+        counts = np.bincount(cohort[cells // horizon] * horizon + cells % horizon, minlength=cohort_count * horizon)
+    else:
+        # Unbounded: active in column k or later, i.e. last active offset >= k
+        last_offset = np.full(user_count, -1, dtype=np.int64)
+        np.maximum.at(last_offset, active_users, offsets)
+        returned = np.flatnonzero(last_offset >= 0)
+        last = np.minimum(last_offset[returned], horizon - 1)
+        latest = np.bincount(cohort[returned] * horizon + last, minlength=cohort_count * horizon)
+        counts = np.cumsum(latest.reshape(cohort_count, horizon)[:, ::-1], axis=1)[:, ::-1].reshape(-1)
+    counts = counts[:cohort_count * horizon].reshape(cohort_count, horizon)
+
+    observed = (np.arange(cohort_count)[:, None] + np.arange(horizon)[None, :]) <= last_period
+    return {"cohorts": edges[:cohort_count], "sizes": sizes, "counts": counts, "observed": observed}
+
+def compute_cohorts(
+    events: Mapping[str, Any],
+    period: str = "week",
+    horizon: int = 12,
+    retention: str = "n_day",
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    signup_event: Optional[str] = None,
+    activity_event: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Retention matrix as JSON-ready lists
+
+    Counts and percentages (of the cohort size) are null for periods that
+    have not been observed yet; "average" is the retention per column over
+    the cohorts that have reached it, weighted by cohort size.
+
+    Raises:
+        KPIComputeError: If the events cannot produce a matrix
+    """
+    try:
+        bounds = [np.datetime64(value, "s") if value else None for value in (start, end)]
+    except ValueError as e:
+        raise KPIComputeError(f"Invalid start or end: {str(e)}")
+    if bounds[1] is not None and len(end) <= 10:
+        # A date-only end includes signups during that day
+        bounds[1] = bounds[1] + np.timedelta64(86399, "s")
+    result = cohort_retention(events, period, horizon, retention, bounds[0], bounds[1], signup_event, activity_event)
+    sizes, counts, observed = result["sizes"], result["counts"].astype(float), result["observed"]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        percentages = 100 * counts / sizes[:, None]
+        average = 100 * (counts * observed).sum(axis=0) / (sizes[:, None] * observed).sum(axis=0)
+    counts[~observed] = np.nan
+    percentages[~observed] = np.nan
+    return {
+        "period": period,
+        "retention": retention,
+        "horizon": horizon,
+        "cohorts": [str(day) for day in result["cohorts"].astype("datetime64[D]")],
+        "sizes": sizes.tolist(),
+        "counts": [_json_counts(row) for row in counts],
+        "percentages": [json_floats(row) for row in percentages],
+        "average": json_floats(average),
+    }
+
+def _json_counts(values: np.ndarray) -> List[Optional[int]]:
+    return [None if np.isnan(value) else int(value) for value in values.tolist()]
@@ -0,0 +1,465 @@
+import io
+import os
+import re
+import csv
+import hashlib
+import itertools
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import orjson
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on Windows
+    fcntl = None
+from dotenv import load_dotenv
+
+from .kpi_engine import NAT, KPIComputeError, to_seconds
+
+# Configure logger
+logger = logging.getLogger(__name__)
+
+# Load environment variables
+load_dotenv()
+
+DATA_STORE_PATH = os.getenv("DATA_STORE_PATH", "metrically_data")
+# Rows parsed and appended per batch while ingesting
+INGEST_BATCH_ROWS = int(os.getenv("INGEST_BATCH_ROWS", "65536"))
+
+# Column types: "time" (int64 epoch seconds), "float" (float64), "id" (int32
+# dictionary codes, read back as codes) and "category" (int32 dictionary
+# codes, read back as labels)
+COLUMN_DTYPES = {"time": np.int64, "float": np.float64, "id": np.int32, "category": np.int32}
+
+TABLE_SCHEMAS = {
+    "events": {"user_id": "id", "timestamp": "time", "event": "category"},
+    "transactions": {"customer_id": "id", "amount": "float", "timestamp": "time"},
+    "subscriptions": {"customer_id": "id", "amount": "float", "start": "time", "end": "time", "interval": "category"},
+    "marketing_spend": {"amount": "float", "timestamp": "time", "channel": "category"},
+}
+
+# Column whose day each row is partitioned by
+PARTITION_COLUMNS = {"events": "timestamp", "transactions": "timestamp", "subscriptions": "start", "marketing_spend": "timestamp"}
+
+MANIFEST_VERSION = 1
+_DATASET_NAME = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+class IngestError(ValueError):
+    """Raised when an upload cannot be ingested"""
+
+class DatasetBusy(RuntimeError):
+    """Raised when another ingest into the same dataset is still running"""
+
+def _day(seconds: np.ndarray) -> np.ndarray:
+    """Day number (days since the epoch) of epoch seconds"""
+    return np.floor_divide(seconds, 86400)
+
+def _day_name(day: int) -> str:
+    return str(np.datetime64(int(day), "D"))
+
+def _write_json(path: str, value: Any) -> None:
+    """Replace a JSON file atomically"""
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(orjson.dumps(value))
+    os.replace(tmp, path)
+
+class ColumnarStore:
+    """
+    Append-only columnar store of the tables the KPI engine reads
+
+    Each dataset is a directory holding one sub-directory per table, with
+    one directory per day partition containing a raw little-endian file per
+    column. Categorical columns are dictionary-encoded into int32 codes,
+    with the dictionary kept next to the partitions. A manifest records
+    the row count and the min/max of every numeric and time column per
+    partition; it is rewritten atomically after each ingest. Only rows it
+    counts are ever read, so an interrupted ingest never exposes partial
+    data.
+
+    Reads memory-map the column files, so a single partition is used in
+    place without copying, and partitions whose min/max rule them out of
+    the requested time range are never opened.
+    """
+
+    def __init__(self, root: str = DATA_STORE_PATH):
+        self.root = root
+        self._locks: Dict[str, threading.Lock] = {}
+        self._locks_lock = threading.Lock()
+
+    def dataset_path(self, owner: str, dataset: str) -> str:
+        """
+        Directory of a user's dataset
+
+        Raises:
+            IngestError: If the dataset name is invalid
+        """
+        if not _DATASET_NAME.match(dataset):
+            raise IngestError("Dataset names may only contain letters, digits, '-' and '_' (at most 64)")
+        owner_key = hashlib.sha256(owner.encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.root, owner_key, dataset)
+
+    def _lock(self, path: str) -> threading.Lock:
+        with self._locks_lock:
+            return self._locks.setdefault(path, threading.Lock())
+
+    def manifest(self, path: str) -> Dict[str, Any]:
+        """The dataset's manifest; empty if nothing was ingested yet"""
+        try:
+            with open(os.path.join(path, "manifest.json"), "rb") as f:
+                return orjson.loads(f.read())
+        except FileNotFoundError:
+            return {"version": MANIFEST_VERSION, "tables": {}}
+
+    def open_ingest(self, owner: str, dataset: str, table: str, fmt: str) -> "Ingest":
+        """
+        Start an ingest into one table of a dataset
+
+        Raises:
+            IngestError: If the table or format is unknown
+            DatasetBusy: If the dataset is already being ingested into
+        """
+        if table not in TABLE_SCHEMAS:
+            raise IngestError(f"Unknown table {table!r}; expected one of {', '.join(TABLE_SCHEMAS)}")
+        if fmt not in ("csv", "ndjson"):
+            raise IngestError("Format must be csv or ndjson")
+        path = self.dataset_path(owner, dataset)
+        lock = self._lock(path)
+        if not lock.acquire(blocking=False):
+            raise DatasetBusy(f"Dataset {dataset} is already being ingested into")
+        lock_file = None
+        try:
+            os.makedirs(path, exist_ok=True)
+            if fcntl is not None:
+                # Also exclude ingests running in other worker processes
+                lock_file = open(os.path.join(path, ".lock"), "w")
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    raise DatasetBusy(f"Dataset {dataset} is already being ingested into")
+            return Ingest(self, path, table, fmt, lock, lock_file)
+        except BaseException:
+            if lock_file is not None:
+                lock_file.close()
+            lock.release()
+            raise
+
+    def load_table(
+        self,
+        owner: str,
+        dataset: str,
+        table: str,
+        start: Optional[np.datetime64] = None,
+        end: Optional[np.datetime64] = None
+    ) -> Optional[Dict[str, np.ndarray]]:
+        """
+        Read the partitions of a table that can matter for [start, end]
+
+        Time columns come back as epoch seconds, id columns as dictionary
+        codes and category columns as labels. With a single matching
+        partition the arrays are memory maps of the files themselves.
+
+        Returns:
+            Column name -> array, or None if the table has no data
+        """
+        path = self.dataset_path(owner, dataset)
+        info = self.manifest(path)["tables"].get(table)
+        if not info or not info["rows"]:
+            return None
+
+        low = None if start is None else int(np.datetime64(start, "s").astype(np.int64))
+        high = None if end is None else int(np.datetime64(end, "s").astype(np.int64))
+        partitions = [name for name, stats in sorted(info["partitions"].items()) if _overlaps(table, stats, low, high)]
+
+        columns = {}
+        for column, kind in info["columns"].items():
+            parts = [
+                _map_column(os.path.join(path, table, name, f"{column}.bin"), kind, info["partitions"][name]["rows"])
+                for name in partitions
+            ]
+            if not parts:
+                array = np.empty(0, dtype=COLUMN_DTYPES[kind])
+            elif len(parts) == 1:
+                array = parts[0]
+            else:
+                array = np.concatenate(parts)
+            if kind == "category":
+                labels = np.asarray(self._dictionary(path, table, column) or [""], dtype=object)
+                array = labels[array]
+            columns[column] = array
+        return columns
+
+    def _dictionary(self, path: str, table: str, column: str) -> List[str]:
+        try:
+            with open(os.path.join(path, table, "dictionaries", f"{column}.json"), "rb") as f:
+                return orjson.loads(f.read())
+        except FileNotFoundError:
+            return []
+
+    def summary(self, owner: str, dataset: str) -> Dict[str, Any]:
+        """Rows, partitions and time span of every table of a dataset"""
+        manifest = self.manifest(self.dataset_path(owner, dataset))
+        tables = {}
+        for table, info in manifest["tables"].items():
+            partition_by = PARTITION_COLUMNS[table]
+            stats = info["partitions"].values()
+            lows = [p["min"][partition_by] for p in stats if partition_by in p["min"]]
+            highs = [p["max"][partition_by] for p in stats if partition_by in p["max"]]
+            tables[table] = {
+                "rows": info["rows"],
+                "partitions": len(info["partitions"]),
+                "columns": info["columns"],
+                "first": str(np.datetime64(min(lows), "s")) if lows else None,
+                "last": str(np.datetime64(max(highs), "s")) if highs else None,
+            }
+        return {"dataset": dataset, "tables": tables}
+
+def _overlaps(table: str, stats: Dict[str, Any], low: Optional[int], high: Optional[int]) -> bool:
+    """Whether a partition may hold rows relevant to [low, high] (epoch seconds)"""
+    partition_by = PARTITION_COLUMNS[table]
+    if high is not None and stats["min"].get(partition_by, high) > high:
+        return False
+    if low is None:
+        return True
+    if table == "subscriptions":
+        # Subscriptions that started earlier still count while active; only
+        # a partition whose subscriptions all ended before low can be skipped
+        return stats["max"].get("end", low) >= low
+    return stats["max"].get(partition_by, low) >= low
+
+def _map_column(path: str, kind: str, rows: int) -> np.ndarray:
+    """Memory-map the first rows values of a column file"""
+    if rows == 0:
+        return np.empty(0, dtype=COLUMN_DTYPES[kind])
+    return np.memmap(path, dtype=COLUMN_DTYPES[kind], mode="r", shape=(rows,))
+
+class Ingest:
+    """
+    One streaming upload into a table
+
+    Bytes are fed in chunks of any size and buffered until they hold
+    INGEST_BATCH_ROWS complete lines; each batch is then decoded and parsed
+    in one pass, converted column by column and appended to the day
+    partitions. Memory use is bounded by one batch
+    whatever the size of the upload. Records may not contain newlines, so
+    quoted CSV fields spanning lines are not supported.
+    """
+
+    def __init__(
+        self,
+        store: ColumnarStore,
+        path: str,
+        table: str,
+        fmt: str,
+        lock: threading.Lock,
+        lock_file: Optional[Any] = None
+    ):
+        self.store = store
+        self.path = path
+        self.table = table
+        self.format = fmt
+        self._lock = lock
+        self._lock_file = lock_file
+        self.schema = TABLE_SCHEMAS[table]
+        self.partition_by = PARTITION_COLUMNS[table]
+
+        self.manifest = store.manifest(path)
+        self.info = self.manifest["tables"].setdefault(
+            table, {"rows": 0, "partition_by": self.partition_by, "columns": dict(self.schema), "partitions": {}}
+        )
+        self.dictionaries: Dict[str, Dict[str, int]] = {
+            column: {label: code for code, label in enumerate(store._dictionary(path, table, column))}
+            for column, kind in self.schema.items() if kind in ("id", "category")
+        }
+        self._buffer = bytearray()
+        self._buffered_lines = 0
+        self._header: Optional[List[str]] = None
+        self._truncated: set = set()
+        self.rows = 0
+        self.rejected = 0
+        self.bytes = 0
+        self.ignored_columns: set = set()
+        self.partitions_touched: set = set()
+        self._closed = False
+
+    def feed(self, chunk: bytes) -> None:
+        """Consume the next piece of the upload"""
+        self.bytes += len(chunk)
+        self._buffer += chunk
+        self._buffered_lines += chunk.count(b"\n")
+        if self._buffered_lines >= INGEST_BATCH_ROWS:
+            cut = self._buffer.rindex(b"\n") + 1
+            batch = bytes(self._buffer[:cut])
+            del self._buffer[:cut]
+            self._buffered_lines = 0
+            self._flush(batch)
+
+    def close(self) -> Dict[str, Any]:
+        """
+        Finish the upload, persist dictionaries and manifest, and release the dataset
+
+        Returns:
+            Summary of what was ingested
+        """
+        try:
+            batch, self._buffer = bytes(self._buffer), bytearray()
+            self._flush(batch)
+            self._persist()
+        finally:
+            self._release()
+        return {
+            "table": self.table,
+            "rows": self.rows,
+            "rejected_rows": self.rejected,
+            "bytes": self.bytes,
+            "partitions_touched": len(self.partitions_touched),
+            "ignored_columns": sorted(self.ignored_columns),
+        }
+
+    def abort(self) -> None:
+        """Give up the upload; rows appended so far stay invisible"""
+        self._release()
+
+    def _release(self) -> None:
+        if not self._closed:
+            self._closed = True
+            if self._lock_file is not None:
+                # Closing the file drops the flock
+                self._lock_file.close()
+            self._lock.release()
+
+    def _flush(self, batch: bytes) -> None:
+        if not batch.strip():
+            return
+        columns = self._parse(batch)
+        if columns:
+            self._append(columns)
+
+    def _parse(self, batch: bytes) -> Dict[str, List[Any]]:
+        """Raw values per known column for a batch of complete lines"""
+        try:
+            if self.format == "csv":
+                rows = [row for row in csv.reader(io.StringIO(batch.decode("utf-8-sig"))) if row]
+                if self._header is None:
+                    self._header = [name.strip() for name in rows.pop(0)]
+                    self.ignored_columns.update(name for name in self._header if name not in self.schema)
+                    if self.partition_by not in self._header:
+                        raise IngestError(f"The {self.table} table needs a {self.partition_by} column")
+                if not rows:
+                    return {}
+                # Transpose; short rows are padded with empty values
+                values = list(itertools.zip_longest(*rows, fillvalue=""))
+                return {name: list(values[i]) for i, name in enumerate(self._header) if name in self.schema}
+
+            records = orjson.loads(b"[" + b",".join(line for line in batch.split(b"\n") if line.strip()) + b"]")
+        except (UnicodeDecodeError, csv.Error, orjson.JSONDecodeError) as e:
+            raise IngestError(f"Malformed {self.format} after row {self.rows + self.rejected}: {str(e)}")
+        if not all(isinstance(record, dict) for record in records):
+            raise IngestError("Every NDJSON line must be an object")
+        for record in records[:1]:
+            self.ignored_columns.update(key for key in record if key not in self.schema)
+        return {column: [record.get(column) for record in records] for column in self.schema}
+
+    def _convert(self, column: str, values: List[Any]) -> np.ndarray:
+        """Typed array for one column of a batch"""
+        kind = self.schema[column]
+        if kind == "time":
+            try:
+                return to_seconds(np.asarray(values, dtype=object))
+            except KPIComputeError as e:
+                raise IngestError(f"Column {column}: {str(e)}")
+        if kind == "float":
+            array = np.asarray(values, dtype=object)
+            array[(array == "") | (array == None)] = np.nan  # noqa: E711 - elementwise comparison
+            try:
+                return array.astype(np.float64)
+            except ValueError as e:
+                raise IngestError(f"Column {column}: {str(e)}")
+
+        # Dictionary-encode: look up each distinct value of the batch once
+        if self.format != "csv":
+            values = ["" if value is None else str(value) for value in values]
+        uniques, inverse = np.unique(np.asarray(values, dtype=str), return_inverse=True)
+        dictionary = self.dictionaries[column]
+        codes = np.fromiter((dictionary.setdefault(label, len(dictionary)) for label in uniques.tolist()),
+                            dtype=np.int32, count=len(uniques))
+        return codes[inverse.reshape(-1)]
+
+    def _append(self, raw: Dict[str, List[Any]]) -> None:
+        """Convert a parsed batch and append it to its day partitions"""
+        count = len(next(iter(raw.values())))
+        columns = {}
+        for column, kind in self.schema.items():
+            if column in raw:
+                columns[column] = self._convert(column, raw[column])
+            elif kind == "time":
+                columns[column] = np.full(count, NAT, dtype=np.int64)
+            elif kind == "float":
+                columns[column] = np.full(count, np.nan)
+            else:
+                columns[column] = self._convert(column, [""] * count)
+
+        keys = columns[self.partition_by]
+        valid = keys != NAT
+        self.rejected += int(count - valid.sum())
+        days = _day(keys[valid])
+        order = np.argsort(days, kind="stable")
+        days = days[order]
+        columns = {name: values[valid][order] for name, values in columns.items()}
+        if not len(days):
+            return
+        boundaries = np.flatnonzero(np.diff(days)) + 1
+        for lo, hi in zip(np.concatenate(([0], boundaries)), np.concatenate((boundaries, [len(days)]))):
+            self._append_partition(_day_name(days[lo]), {name: values[lo:hi] for name, values in columns.items()})
+        self.rows += len(days)
+
+    def _append_partition(self, name: str, columns: Dict[str, np.ndarray]) -> None:
+        directory = os.path.join(self.path, self.table, name)
+        os.makedirs(directory, exist_ok=True)
+        stats = self.info["partitions"].setdefault(name, {"rows": 0, "min": {}, "max": {}})
+        for column, values in columns.items():
+            kind = self.schema[column]
+            file_path = os.path.join(directory, f"{column}.bin")
+            if name not in self._truncated and os.path.exists(file_path):
+                # Drop rows a previous, interrupted ingest appended past the manifest
+                expected = stats["rows"] * np.dtype(COLUMN_DTYPES[kind]).itemsize
+                if os.path.getsize(file_path) != expected:
+                    os.truncate(file_path, expected)
+            with open(file_path, "ab") as f:
+                f.write(np.ascontiguousarray(values, dtype=COLUMN_DTYPES[kind]).tobytes())
+            if kind in ("time", "float"):
+                self._update_stats(stats, column, kind, values)
+        self._truncated.add(name)
+        stats["rows"] += len(next(iter(columns.values())))
+        self.partitions_touched.add(name)
+
+    def _update_stats(self, stats: Dict[str, Any], column: str, kind: str, values: np.ndarray) -> None:
+        if kind == "time":
+            present = values[values != NAT]
+            if column == "end" and present.size < values.size:
+                # Open-ended subscriptions are active forever
+                present = np.append(present, np.iinfo(np.int64).max)
+        else:
+            present = values[~np.isnan(values)]
+        if not present.size:
+            return
+        low, high = present.min().item(), present.max().item()
+        stats["min"][column] = low if column not in stats["min"] else min(stats["min"][column], low)
+        stats["max"][column] = high if column not in stats["max"] else max(stats["max"][column], high)
+
+    def _persist(self) -> None:
+        directory = os.path.join(self.path, self.table, "dictionaries")
+        os.makedirs(directory, exist_ok=True)
+        for column, dictionary in self.dictionaries.items():
+            _write_json(os.path.join(directory, f"{column}.json"), list(dictionary))
+        self.info["rows"] = sum(p["rows"] for p in self.info["partitions"].values())
+        self.manifest["version"] = MANIFEST_VERSION
+        _write_json(os.path.join(self.path, "manifest.json"), self.manifest)
+
+columnar_store = ColumnarStore()
+
+def get_columnar_store() -> ColumnarStore:
+    """Get the columnar store instance"""
+    return columnar_store
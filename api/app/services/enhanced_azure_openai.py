@@ -1,9 +1,38 @@
 import os
 import json
-from openai import AzureOpenAI
+import time
+import asyncio
+import openai
+from openai import AzureOpenAI, AsyncAzureOpenAI
 from dotenv import load_dotenv
 import logging
-from typing import Dict, List, Any, Optional, Union
+from typing import Dict, List, Any, Optional, Union, AsyncIterator, Sequence, Tuple
+from .kpi_cache import KPICache, get_kpi_cache, make_cache_key
+from .json_stream import IncrementalJSONObjectParser, DEFAULT_ARRAY_EVENTS
+from .singleflight import SingleFlight, request_key
+from .rate_limit import record_usage
+from .metrics import (
+    observe_upstream,
+    structured_output_failures,
+    structured_output_repairs,
+    upstream_hedges,
+    upstream_in_flight,
+    upstream_retries
+)
+from .resilience import (
+    HEDGE_DELAY,
+    HEDGE_OPERATIONS,
+    CircuitOpenError,
+    RetryPolicy,
+    deadline_for,
+    is_retryable,
+    retry_after_seconds,
+    status_code_of
+)
+from .example_catalog import get_example_catalog
+from .upstreams import Upstream, get_upstream_pool
+from .json_repair import conform_to_schema, missing_parts, repair_json
+from .token_budget import TokenBudgetExceeded, get_token_budget_planner
 
 # Configure logger
 logging.basicConfig(level=logging.INFO)
@@ -12,6 +41,76 @@ logger = logging.getLogger(__name__)
 # Load environment variables
 load_dotenv()
 
+# Default number of SQL generations a batch request runs concurrently
+SQL_BATCH_CONCURRENCY = int(os.getenv("SQL_BATCH_CONCURRENCY", "8"))
+
+# Serve a stale cached system or the nearest example pack when the upstream is down
+DEGRADED_FALLBACK = os.getenv("KPI_DEGRADED_FALLBACK", "true").lower() in ("1", "true", "yes")
+
+# Status codes of upstream failures that a degraded answer may stand in for
+DEGRADABLE_STATUS_CODES = (429, 502, 503, 504)
+
+# "single" generates a KPI system in one completion; "fanout" generates each
+# category concurrently and assembles dashboards and summary in a final call
+KPI_GENERATION_MODE = os.getenv("KPI_GENERATION_MODE", "single")
+
+# Metric categories generated separately in fan-out mode
+KPI_CATEGORIES = ("Acquisition", "Activation", "Retention", "Revenue")
+
+# Bump whenever _create_kpi_prompt or KPI_SCHEMA changes so cached systems are not reused
+KPI_PROMPT_VERSION = "1"
+
+KPI_SYSTEM_MESSAGE = "You are an expert KPI architect and data analyst for startups."
+SQL_SYSTEM_MESSAGE = "You are a SQL expert that creates clean, efficient queries."
+
+# Output schema for structured KPI system responses
+KPI_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "metrics": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "category": {"type": "string"},
+                    "name": {"type": "string"},
+                    "description": {"type": "string"},
+                    "calculation": {"type": "string"},
+                    "importance": {"type": "string"},
+                    "sql_query": {"type": "string"},
+                    "visualization": {"type": "string"},
+                    "benchmark": {"type": "string"}
+                }
+            }
+        },
+        "dashboard_recommendations": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "name": {"type": "string"},
+                    "description": {"type": "string"},
+                    "included_metrics": {"type": "array", "items": {"type": "string"}}
+                }
+            }
+        },
+        "summary": {"type": "string"}
+    }
+}
+
+# Fan-out pieces of KPI_SCHEMA: one category's metrics, then what is assembled from them
+KPI_CATEGORY_SCHEMA = {
+    "type": "object",
+    "properties": {"metrics": KPI_SCHEMA["properties"]["metrics"]}
+}
+KPI_ASSEMBLY_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "dashboard_recommendations": KPI_SCHEMA["properties"]["dashboard_recommendations"],
+        "summary": KPI_SCHEMA["properties"]["summary"]
+    }
+}
+
 class AzureOpenAIService:
     """
     Enhanced Azure OpenAI Service for Metrically
@@ -30,25 +129,27 @@ class AzureOpenAIService:
         self.api_version = os.getenv("AZURE_OPENAI_API_VERSION", "2023-05-15")
         self.endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
         self.deployment_name = os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME", "gpt-4")
+        self.budget = get_token_budget_planner()
+        self.retry_policy = RetryPolicy()
+        self.pool = get_upstream_pool()
         self.client = self._initialize_client()
         
     def _initialize_client(self) -> Optional[AzureOpenAI]:
-        """Initialize and return the Azure OpenAI client"""
-        if not self.api_key or not self.endpoint:
+        """Initialize and return the Azure OpenAI client of the first upstream"""
+        if not self.pool.upstreams:
             logger.warning("Azure OpenAI API key or endpoint not configured")
             return None
             
         try:
-            client = AzureOpenAI(
-                api_key=self.api_key,
-                api_version=self.api_version,
-                azure_endpoint=self.endpoint
-            )
-            return client
+            return self._client_for(self.pool.upstreams[0])
         except Exception as e:
             logger.error(f"Failed to initialize Azure OpenAI client: {str(e)}")
             return None
     
+    def _client_for(self, upstream: Upstream) -> AzureOpenAI:
+        """Client used to call upstream"""
+        return upstream.client
+    
     def is_available(self) -> bool:
         """Check if the Azure OpenAI service is available and configured"""
         return self.client is not None
@@ -61,7 +162,8 @@ class AzureOpenAIService:
         max_tokens: int = 1000,
         model: Optional[str] = None,
         structured_output: bool = False,
-        output_schema: Optional[Dict] = None
+        output_schema: Optional[Dict] = None,
+        operation: str = "completion"
     ) -> Dict[str, Any]:
         """
         Generate a completion using Azure OpenAI
@@ -74,6 +176,7 @@ class AzureOpenAIService:
             model: Override the default model
             structured_output: Whether to request structured JSON output
             output_schema: Schema definition for structured output
+            operation: Name of the calling operation, used to label metrics
             
         Returns:
             Dictionary containing the response and metadata
@@ -81,68 +184,27 @@ class AzureOpenAIService:
         if not self.client:
             return {"success": False, "error": "Azure OpenAI client not initialized"}
         
-        deployment = model or self.deployment_name
-        
-        # Prepare messages
-        messages = [
-            {"role": "system", "content": system_message}
-        ]
-        
-        # Add structured output instructions if requested
-        if structured_output and output_schema:
-            schema_str = json.dumps(output_schema, indent=2)
-            structured_system_message = f"{system_message}\n\nYou MUST format your response as a JSON object that conforms to the following schema:\n{schema_str}\n\nDo not include any explanatory text outside the JSON structure."
-            messages[0]["content"] = structured_system_message
-        
-        # Add user prompt
-        messages.append({"role": "user", "content": prompt})
-        
         try:
-            response = self.client.chat.completions.create(
-                model=deployment,
-                messages=messages,
+            request = self._build_request(
+                prompt=prompt,
+                system_message=system_message,
                 temperature=temperature,
                 max_tokens=max_tokens,
-                response_format={"type": "json_object"} if structured_output else None
+                model=model,
+                structured_output=structured_output,
+                output_schema=output_schema,
+                operation=operation
             )
-            
-            content = response.choices[0].message.content
-            
-            # Parse JSON if structured output was requested
-            if structured_output:
-                try:
-                    parsed_content = json.loads(content)
-                    return {
-                        "success": True,
-                        "content": parsed_content,
-                        "usage": {
-                            "prompt_tokens": response.usage.prompt_tokens,
-                            "completion_tokens": response.usage.completion_tokens,
-                            "total_tokens": response.usage.total_tokens
-                        }
-                    }
-                except json.JSONDecodeError as e:
-                    logger.error(f"Failed to parse JSON response: {str(e)}")
-                    return {
-                        "success": False,
-                        "error": "Failed to parse structured output",
-                        "raw_content": content
-                    }
-            
-            # Return raw content for non-structured responses
-            return {
-                "success": True,
-                "content": content,
-                "usage": {
-                    "prompt_tokens": response.usage.prompt_tokens,
-                    "completion_tokens": response.usage.completion_tokens,
-                    "total_tokens": response.usage.total_tokens
-                }
-            }
-            
+        except TokenBudgetExceeded as e:
+            return {"success": False, "error": str(e), "status_code": 413}
+        try:
+            response = self._create_completion(request, operation)
         except Exception as e:
             logger.error(f"Error generating completion: {str(e)}")
-            return {"success": False, "error": str(e)}
+            return self._upstream_failure(e)
+        
+        self._record_completion(operation, request, response)
+        return self._process_response(response, structured_output, operation, output_schema)
     
     def generate_kpi_system(
         self,
@@ -166,78 +228,11 @@ class AzureOpenAIService:
         Returns:
             Dictionary containing the KPI system
         """
-        # Extract company information
-        product_type = company_info.get("product_type", "")
-        company_stage = company_info.get("company_stage", "")
-        tech_stack = company_info.get("tech_stack", "")
-        industry = company_info.get("industry", "")
-        business_model = company_info.get("business_model", "")
-        strategic_focus = company_info.get("strategic_focus", [])
-        custom_prompt = company_info.get("custom_prompt", "")
-        
-        # Create prompt
-        prompt = self._create_kpi_prompt(
-            product_type=product_type,
-            company_stage=company_stage,
-            tech_stack=tech_stack,
-            industry=industry,
-            business_model=business_model,
-            strategic_focus=strategic_focus,
-            custom_prompt=custom_prompt
-        )
-        
-        # Define output schema for structured responses
-        kpi_schema = {
-            "type": "object",
-            "properties": {
-                "metrics": {
-                    "type": "array",
-                    "items": {
-                        "type": "object",
-                        "properties": {
-                            "category": {"type": "string"},
-                            "name": {"type": "string"},
-                            "description": {"type": "string"},
-                            "calculation": {"type": "string"},
-                            "importance": {"type": "string"},
-                            "sql_query": {"type": "string"},
-                            "visualization": {"type": "string"},
-                            "benchmark": {"type": "string"}
-                        }
-                    }
-                },
-                "dashboard_recommendations": {
-                    "type": "array",
-                    "items": {
-                        "type": "object",
-                        "properties": {
-                            "name": {"type": "string"},
-                            "description": {"type": "string"},
-                            "included_metrics": {"type": "array", "items": {"type": "string"}}
-                        }
-                    }
-                },
-                "summary": {"type": "string"}
-            }
-        }
-        
-        # Generate response
-        if output_format == "structured":
-            return self.generate_completion(
-                prompt=prompt,
-                system_message="You are an expert KPI architect and data analyst for startups.",
-                temperature=0.5,
-                max_tokens=2500,
-                structured_output=True,
-                output_schema=kpi_schema
-            )
-        else:
-            return self.generate_completion(
-                prompt=prompt,
-                system_message="You are an expert KPI architect and data analyst for startups.",
-                temperature=0.5,
-                max_tokens=2500
-            )
+        response = self.generate_completion(**self._kpi_system_kwargs(company_info, output_format))
+        if response.get("partial"):
+            continuation = self.generate_completion(**self._kpi_continuation_kwargs(company_info, response))
+            response = _merge_continuation(response, continuation)
+        return _conform_kpi_system(response, output_format)
     
     def generate_sql_query(
         self,
@@ -256,6 +251,350 @@ class AzureOpenAIService:
         Returns:
             Dictionary containing the SQL query
         """
+        return self.generate_completion(
+            **self._sql_query_kwargs(metric_name, metric_calculation, tech_stack)
+        )
+    
+    def _create_completion(self, request: Dict[str, Any], operation: str) -> Any:
+        """
+        Call chat completions under the operation's deadline, retry policy and circuit breakers
+        
+        Each attempt is routed to an upstream by the pool. A retryable failure
+        (429, 5xx, timeouts) fails over at once when another upstream is
+        available, and is otherwise retried with jittered exponential backoff,
+        waiting at least as long as Retry-After asks, until the attempts or
+        the deadline run out.
+        
+        Raises:
+            CircuitOpenError: If no upstream is available
+            Exception: The last error from the OpenAI client
+        """
+        deadline = time.monotonic() + deadline_for(operation)
+        tried: List[str] = []
+        attempt = 0
+        while True:
+            attempt += 1
+            upstream = self.pool.acquire(request["model"], exclude=tried)
+            started = time.perf_counter()
+            upstream_in_flight.inc(upstream.name)
+            try:
+                response = self._client_for(upstream).chat.completions.create(
+                    **_for_upstream(request, upstream), timeout=max(deadline - time.monotonic(), 1.0)
+                )
+            except Exception as e:
+                observe_upstream(upstream.name, operation, started, "error")
+                self.pool.record_failure(upstream, e)
+                tried.append(upstream.name)
+                delay = self._retry_delay(attempt, e, deadline, request["model"], tried)
+                if delay is None:
+                    raise
+                upstream_retries.inc(upstream.name, operation)
+                logger.warning(f"Retrying {operation} in {delay:.2f}s after {upstream.name} failed: {str(e)}")
+                time.sleep(delay)
+                continue
+            except BaseException:
+                upstream.breaker.release()
+                raise
+            finally:
+                upstream_in_flight.dec(upstream.name)
+                self.pool.release(upstream)
+            
+            self.pool.record_success(upstream, time.perf_counter() - started, response.usage)
+            observe_upstream(upstream.name, operation, started, "success", response.usage)
+            return response
+    
+    def _retry_delay(
+        self,
+        attempt: int,
+        error: Exception,
+        deadline: float,
+        deployment: Optional[str] = None,
+        tried: Sequence[str] = ()
+    ) -> Optional[float]:
+        """Seconds to wait before retrying, or None if the call should not be retried"""
+        if not is_retryable(error) or attempt >= self.retry_policy.max_attempts:
+            return None
+        if self.pool.has_alternative(deployment, tried):
+            return 0.0
+        delay = self.retry_policy.delay(attempt, error)
+        if time.monotonic() + delay >= deadline:
+            return None
+        return delay
+    
+    def _upstream_failure(self, error: Exception) -> Dict[str, Any]:
+        """Result dictionary for a call that failed upstream"""
+        failure: Dict[str, Any] = {"success": False, "error": str(error)}
+        if isinstance(error, CircuitOpenError):
+            failure["status_code"] = 503
+            failure["retry_after"] = error.retry_after
+        elif status_code_of(error) == 429:
+            failure["status_code"] = 429
+            failure["retry_after"] = retry_after_seconds(error)
+        elif isinstance(error, openai.APITimeoutError):
+            failure["status_code"] = 504
+        elif isinstance(error, openai.APIConnectionError) or (status_code_of(error) or 0) >= 500:
+            failure["status_code"] = 502
+        return failure
+    
+    def _build_request(
+        self,
+        prompt: str,
+        system_message: str,
+        temperature: float,
+        max_tokens: int,
+        model: Optional[str],
+        structured_output: bool,
+        output_schema: Optional[Dict],
+        operation: str = "completion"
+    ) -> Dict[str, Any]:
+        """
+        Build the keyword arguments for a chat completions call
+        
+        max_tokens is treated as an upper bound: the token budget planner may
+        lower it based on the operation's recent completion sizes and the
+        room left in the context window.
+        
+        Returns:
+            Dictionary of arguments for client.chat.completions.create
+            
+        Raises:
+            TokenBudgetExceeded: If the prompt leaves no room for a reply
+        """
+        deployment = model or self.deployment_name
+        
+        # Prepare messages
+        messages = [
+            {"role": "system", "content": system_message}
+        ]
+        
+        # Add structured output instructions if requested
+        if structured_output and output_schema:
+            schema_str = json.dumps(output_schema, indent=2)
+            structured_system_message = f"{system_message}\n\nYou MUST format your response as a JSON object that conforms to the following schema:\n{schema_str}\n\nDo not include any explanatory text outside the JSON structure."
+            messages[0]["content"] = structured_system_message
+        
+        # Add user prompt
+        messages.append({"role": "user", "content": prompt})
+        
+        return {
+            "model": deployment,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": self.budget.plan_max_tokens(messages, operation, max_tokens),
+            "response_format": {"type": "json_object"} if structured_output else None
+        }
+    
+    def _record_completion(self, operation: str, request: Dict[str, Any], response: Any) -> None:
+        """Feed the completion size back into the token budget planner"""
+        try:
+            self.budget.record(
+                operation,
+                response.usage.completion_tokens,
+                truncated=response.choices[0].finish_reason == "length",
+                limit=request["max_tokens"]
+            )
+        except (AttributeError, IndexError):
+            pass
+    
+    def _process_response(
+        self,
+        response: Any,
+        structured_output: bool,
+        operation: str = "completion",
+        output_schema: Optional[Dict] = None
+    ) -> Dict[str, Any]:
+        """
+        Convert a chat completions response into the service result dictionary
+        
+        Structured output that is not valid JSON (code fences, trailing commas,
+        a max_tokens cut-off) is repaired rather than rejected. Whatever can be
+        recovered is validated against output_schema; if the output was cut
+        off, the result is flagged "partial" and lists the "missing" top-level
+        properties so the caller can request just those.
+        
+        Args:
+            response: Response object returned by the OpenAI client
+            structured_output: Whether the content should be parsed as JSON
+            operation: Name of the calling operation, used to label metrics
+            output_schema: Schema the parsed content is validated against
+            
+        Returns:
+            Dictionary containing the content and token usage
+        """
+        content = response.choices[0].message.content
+        usage = {
+            "prompt_tokens": response.usage.prompt_tokens,
+            "completion_tokens": response.usage.completion_tokens,
+            "total_tokens": response.usage.total_tokens
+        }
+        record_usage(usage)
+        
+        # Return raw content for non-structured responses
+        if not structured_output:
+            return {"success": True, "content": content, "usage": usage}
+        
+        result = self._parse_structured(content, operation, output_schema)
+        result["usage"] = usage
+        return result
+    
+    def _parse_structured(
+        self,
+        content: str,
+        operation: str,
+        output_schema: Optional[Dict]
+    ) -> Dict[str, Any]:
+        """Parse structured output content, repairing and pruning it only if it is not valid JSON"""
+        try:
+            return {"success": True, "content": json.loads(content or "")}
+        except json.JSONDecodeError:
+            pass
+        
+        try:
+            parsed_content, open_depth = repair_json(content or "")
+        except json.JSONDecodeError as e:
+            structured_output_failures.inc(operation)
+            logger.error(f"Failed to parse JSON response: {str(e)}")
+            return {
+                "success": False,
+                "error": "Failed to parse structured output",
+                "raw_content": content
+            }
+        
+        dropped: List[str] = []
+        if output_schema:
+            parsed_content, dropped = conform_to_schema(parsed_content, output_schema)
+            if parsed_content is None:
+                structured_output_failures.inc(operation)
+                logger.error(f"Structured output does not match the schema: {dropped}")
+                return {
+                    "success": False,
+                    "error": "Structured output does not match the schema",
+                    "raw_content": content
+                }
+        
+        result = {"success": True, "content": parsed_content}
+        if open_depth or dropped:
+            missing = missing_parts(parsed_content, output_schema or {}, open_depth)
+            structured_output_repairs.inc(operation, "partial" if missing else "repaired")
+            logger.warning(f"Repaired structured output: open_depth={open_depth}, dropped={dropped}, missing={missing}")
+            if missing:
+                result["partial"] = True
+                result["missing"] = missing
+        return result
+    
+    def _kpi_system_kwargs(
+        self,
+        company_info: Dict[str, Any],
+        output_format: str
+    ) -> Dict[str, Any]:
+        """Build the generate_completion arguments for a KPI system request"""
+        # Create prompt
+        prompt = self._create_kpi_prompt(
+            product_type=company_info.get("product_type", ""),
+            company_stage=company_info.get("company_stage", ""),
+            tech_stack=company_info.get("tech_stack", ""),
+            industry=company_info.get("industry", ""),
+            business_model=company_info.get("business_model", ""),
+            strategic_focus=company_info.get("strategic_focus", []),
+            custom_prompt=company_info.get("custom_prompt", "")
+        )
+        
+        kwargs = {
+            "prompt": prompt,
+            "system_message": KPI_SYSTEM_MESSAGE,
+            "temperature": 0.5,
+            "max_tokens": 2500,
+            "operation": "kpi_system"
+        }
+        if output_format == "structured":
+            kwargs["structured_output"] = True
+            kwargs["output_schema"] = KPI_SCHEMA
+        return kwargs
+    
+    def _kpi_continuation_kwargs(
+        self,
+        company_info: Dict[str, Any],
+        partial: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        """
+        Build the generate_completion arguments that complete a partial KPI system
+        
+        Only the names of what already exists are sent back, and the model is
+        asked for the missing top-level properties alone, so a cut-off
+        response costs a short follow-up instead of a full regeneration.
+        """
+        kwargs = self._kpi_system_kwargs(company_info, "structured")
+        content = partial["content"]
+        missing = partial["missing"]
+        existing = [
+            metric.get("name") for metric in content.get("metrics") or []
+            if isinstance(metric, dict) and metric.get("name")
+        ]
+        
+        kwargs["prompt"] += f"""
+        
+        A previous answer to this request was cut off. It already defines these metrics:
+        {json.dumps(existing)}
+        
+        Return a JSON object containing ONLY these properties: {", ".join(missing)}.
+        Do not repeat metrics that are already defined; only add metrics needed to complete the system.
+        Dashboard recommendations may refer to any of the metrics above.
+        """
+        kwargs["operation"] = "kpi_continuation"
+        return kwargs
+    
+    def _kpi_category_kwargs(self, company_info: Dict[str, Any], category: str) -> Dict[str, Any]:
+        """Build the generate_completion arguments for one category of a fanned-out KPI system"""
+        kwargs = self._kpi_system_kwargs(company_info, "structured")
+        kwargs["prompt"] += f"""
+        
+        Only produce the {category.upper()} part of this system: 2 {category} metrics, each with
+        name, description, calculation, importance, sql_query, visualization and benchmark,
+        and category set to "{category}".
+        Return a JSON object containing ONLY the property: metrics.
+        """
+        kwargs["output_schema"] = KPI_CATEGORY_SCHEMA
+        kwargs["max_tokens"] = 900
+        kwargs["operation"] = "kpi_category"
+        return kwargs
+    
+    def _kpi_assembly_kwargs(self, company_info: Dict[str, Any], metrics: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Build the generate_completion arguments that group finished metrics into dashboards
+        
+        Only the names, categories and descriptions of the metrics are sent,
+        which keeps the final call of a fanned-out generation short.
+        """
+        outline = [
+            {"name": metric.get("name"), "category": metric.get("category"), "description": metric.get("description")}
+            for metric in metrics
+        ]
+        prompt = f"""
+        These KPIs were chosen for a {company_info.get("company_stage", "")} stage startup
+        with a {company_info.get("product_type", "")} product:
+        {json.dumps(outline)}
+        
+        Suggest 2-3 dashboards that group related metrics together, using the metric names
+        exactly as given in included_metrics, and write a short summary of the KPI system.
+        Return a JSON object containing ONLY the properties: dashboard_recommendations, summary.
+        """
+        return {
+            "prompt": prompt,
+            "system_message": KPI_SYSTEM_MESSAGE,
+            "temperature": 0.3,
+            "max_tokens": 600,
+            "structured_output": True,
+            "output_schema": KPI_ASSEMBLY_SCHEMA,
+            "operation": "kpi_assembly"
+        }
+    
+    def _sql_query_kwargs(
+        self,
+        metric_name: str,
+        metric_calculation: str,
+        tech_stack: str
+    ) -> Dict[str, Any]:
+        """Build the generate_completion arguments for a SQL generation request"""
         prompt = f"""
         Create a SQL query for {tech_stack} that calculates the '{metric_name}' metric.
         
@@ -267,12 +606,13 @@ class AzureOpenAIService:
         Only return the SQL query, nothing else.
         """
         
-        return self.generate_completion(
-            prompt=prompt,
-            system_message="You are a SQL expert that creates clean, efficient queries.",
-            temperature=0.3,
-            max_tokens=500
-        )
+        return {
+            "prompt": prompt,
+            "system_message": SQL_SYSTEM_MESSAGE,
+            "temperature": 0.3,
+            "max_tokens": 500,
+            "operation": "sql"
+        }
     
     def _create_kpi_prompt(
         self,
@@ -312,7 +652,8 @@ class AzureOpenAIService:
                 focus_list = strategic_focus[0]
             focus_areas = f"\nTheir strategic focus areas are: {focus_list}."
         
-        # Add custom context if provided
+        # Add custom context if provided, trimmed to the configured token budget
+        custom_prompt = self.budget.fit_text(custom_prompt)
         custom_context = f"\n\nAdditional context about the company:\n{custom_prompt}" if custom_prompt else ""
         
         prompt = f"""
@@ -341,9 +682,604 @@ class AzureOpenAIService:
         
         return prompt
 
-# Create a singleton instance
+class AsyncAzureOpenAIService(AzureOpenAIService):
+    """
+    Non-blocking variant of AzureOpenAIService
+    
+    Uses the AsyncAzureOpenAI client so that the FastAPI event loop keeps
+    serving other requests while a generation is in flight. Prompt building
+    and response handling are shared with the synchronous service.
+    """
+    
+    def __init__(self, cache: Optional[KPICache] = None):
+        """Initialize the service, optionally with a specific KPI cache"""
+        super().__init__()
+        self.cache = cache if cache is not None else get_kpi_cache()
+        self.singleflight = SingleFlight()
+    
+    def _client_for(self, upstream: Upstream) -> AsyncAzureOpenAI:
+        """Client used to call upstream"""
+        return upstream.async_client
+    
+    async def _create_completion(self, request: Dict[str, Any], operation: str) -> Any:
+        """
+        Async counterpart of AzureOpenAIService._create_completion
+        
+        For operations listed in AZURE_OPENAI_HEDGE_OPERATIONS, an attempt that
+        has not finished after AZURE_OPENAI_HEDGE_DELAY seconds is raced against
+        a duplicate request, sent to another upstream when there is one, and
+        the first success wins.
+        """
+        deadline = time.monotonic() + deadline_for(operation)
+        hedge = HEDGE_DELAY > 0 and operation in HEDGE_OPERATIONS
+        tried: List[str] = []
+        attempt = 0
+        while True:
+            attempt += 1
+            upstream = self.pool.acquire(request["model"], exclude=tried)
+            started = time.perf_counter()
+            upstream_in_flight.inc(upstream.name)
+            try:
+                if hedge:
+                    # Records the outcome of each of its calls itself
+                    winner, response = await self._hedged_create(upstream, request, operation, deadline)
+                else:
+                    winner = upstream
+                    response = await self._client_for(upstream).chat.completions.create(
+                        **_for_upstream(request, upstream), timeout=max(deadline - time.monotonic(), 1.0)
+                    )
+            except Exception as e:
+                if not hedge:
+                    observe_upstream(upstream.name, operation, started, "error")
+                    self.pool.record_failure(upstream, e)
+                tried.append(upstream.name)
+                delay = self._retry_delay(attempt, e, deadline, request["model"], tried)
+                if delay is None:
+                    raise
+                upstream_retries.inc(upstream.name, operation)
+                logger.warning(f"Retrying {operation} in {delay:.2f}s after {upstream.name} failed: {str(e)}")
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                if not hedge:
+                    upstream.breaker.release()
+                raise
+            finally:
+                upstream_in_flight.dec(upstream.name)
+                self.pool.release(upstream)
+            
+            if not hedge:
+                self.pool.record_success(winner, time.perf_counter() - started, response.usage)
+                observe_upstream(winner.name, operation, started, "success", response.usage)
+            return response
+    
+    async def _hedged_create(
+        self,
+        primary: Upstream,
+        request: Dict[str, Any],
+        operation: str,
+        deadline: float
+    ) -> Tuple[Upstream, Any]:
+        """
+        Send request to primary, and a duplicate if it is still running after HEDGE_DELAY
+
+        Every call records its own outcome with the pool: success or failure
+        for those that finished, a released breaker for the loser that is
+        cancelled. The caller has acquired primary and still releases it.
+        """
+        legs: Dict["asyncio.Task", Tuple[Upstream, float]] = {}
+        
+        def send(upstream: Upstream) -> None:
+            task = asyncio.ensure_future(self._client_for(upstream).chat.completions.create(
+                **_for_upstream(request, upstream), timeout=max(deadline - time.monotonic(), 1.0)
+            ))
+            legs[task] = (upstream, time.perf_counter())
+        
+        send(primary)
+        secondary: Optional[Upstream] = None
+        try:
+            done, _ = await asyncio.wait(legs, timeout=HEDGE_DELAY)
+            if not done:
+                try:
+                    secondary = self.pool.acquire(request["model"], exclude=[primary.name])
+                except CircuitOpenError:
+                    secondary = None
+                if secondary is not None:
+                    upstream_hedges.inc(secondary.name, operation)
+                    upstream_in_flight.inc(secondary.name)
+                    send(secondary)
+            error: Optional[BaseException] = None
+            pending = set(legs)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return legs[task][0], task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task, (upstream, started) in legs.items():
+                if not task.done() or task.cancelled():
+                    task.cancel()
+                    upstream.breaker.release()
+                elif task.exception() is not None:
+                    observe_upstream(upstream.name, operation, started, "error")
+                    self.pool.record_failure(upstream, task.exception())
+                else:
+                    response = task.result()
+                    self.pool.record_success(upstream, time.perf_counter() - started, response.usage)
+                    observe_upstream(upstream.name, operation, started, "success", response.usage)
+            if secondary is not None:
+                upstream_in_flight.dec(secondary.name)
+                self.pool.release(secondary)
+    
+    async def generate_completion(
+        self, 
+        prompt: str, 
+        system_message: str = "You are a helpful assistant.",
+        temperature: float = 0.7,
+        max_tokens: int = 1000,
+        model: Optional[str] = None,
+        structured_output: bool = False,
+        output_schema: Optional[Dict] = None,
+        operation: str = "completion"
+    ) -> Dict[str, Any]:
+        """
+        Generate a completion using Azure OpenAI without blocking the event loop
+        
+        Takes the same arguments and returns the same dictionary as
+        AzureOpenAIService.generate_completion. Concurrent calls that render
+        to an identical upstream request share a single upstream call.
+        """
+        if not self.client:
+            return {"success": False, "error": "Azure OpenAI client not initialized"}
+        
+        try:
+            request = self._build_request(
+                prompt=prompt,
+                system_message=system_message,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                model=model,
+                structured_output=structured_output,
+                output_schema=output_schema,
+                operation=operation
+            )
+        except TokenBudgetExceeded as e:
+            return {"success": False, "error": str(e), "status_code": 413}
+        
+        async def call() -> Dict[str, Any]:
+            try:
+                response = await self._create_completion(request, operation)
+            except Exception as e:
+                logger.error(f"Error generating completion: {str(e)}")
+                return self._upstream_failure(e)
+            
+            self._record_completion(operation, request, response)
+            return self._process_response(response, structured_output, operation, output_schema)
+        
+        return await self.singleflight.do(request_key(request), call)
+    
+    async def generate_kpi_system(
+        self,
+        company_info: Dict[str, Any],
+        output_format: str = "structured",
+        cache_mode: str = "use",
+        mode: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        Generate a KPI system based on company information
+        
+        If the response is cut off, the complete parts are kept and a
+        continuation request asks only for what is missing. Structured
+        results are conformed to KPI_SCHEMA, and successful ones are cached
+        by a normalized hash of the company information, output format,
+        deployment and prompt version.
+        
+        Args:
+            company_info: Dictionary containing company information
+            output_format: "structured" for JSON or "markdown" for text
+            cache_mode: "use" to read and write the cache, "bypass" to skip it
+                entirely, "refresh" to regenerate and overwrite the cached entry
+            mode: "single" or "fanout" (structured output only); defaults to
+                KPI_GENERATION_MODE
+            
+        Returns:
+            Dictionary containing the KPI system, with "cached" set on hits and
+            "partial"/"missing" set when a cut-off response could not be completed
+        """
+        key = make_cache_key(company_info, output_format, self.deployment_name, KPI_PROMPT_VERSION)
+        
+        if cache_mode == "use":
+            cached = await self.cache.aget(key)
+            if cached is not None:
+                return {**_conform_kpi_system(cached, output_format), "cached": True}
+        
+        if (mode or KPI_GENERATION_MODE) == "fanout" and output_format == "structured":
+            response = await self._generate_kpi_system_fanout(company_info)
+        else:
+            response = await self.generate_completion(**self._kpi_system_kwargs(company_info, output_format))
+            if response.get("partial"):
+                continuation = await self.generate_completion(**self._kpi_continuation_kwargs(company_info, response))
+                response = _merge_continuation(response, continuation)
+        response = _conform_kpi_system(response, output_format)
+        
+        if not response.get("success", False):
+            degraded = await self._degraded_kpi_system(key, company_info, output_format, response)
+            if degraded is not None:
+                return degraded
+        
+        if cache_mode != "bypass" and response.get("success", False) and not response.get("partial"):
+            await self.cache.aset(key, response)
+        
+        return {**response, "cached": False}
+    
+    async def _generate_kpi_system_fanout(self, company_info: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Generate a structured KPI system as concurrent per-category calls
+        
+        Each category's metrics are generated by a smaller completion, all at
+        once, so latency follows the slowest category rather than the whole
+        system. A final short call groups the merged metrics into dashboards
+        and writes the summary. The result has the same shape as a
+        single-call generation; categories that failed are reported as
+        missing "metrics" instead of failing the whole system.
+        """
+        results = await asyncio.gather(*[
+            self.generate_completion(**self._kpi_category_kwargs(company_info, category))
+            for category in KPI_CATEGORIES
+        ])
+        
+        metrics: List[Dict[str, Any]] = []
+        names = set()
+        usage = None
+        missing: List[str] = []
+        for category, result in zip(KPI_CATEGORIES, results):
+            usage = _add_usage(usage, result.get("usage"))
+            content = result.get("content") if result.get("success", False) else None
+            if not isinstance(content, dict) or not isinstance(content.get("metrics"), list) or not content["metrics"]:
+                logger.warning(f"KPI category {category} failed: {result.get('error', 'no metrics returned')}")
+                missing.append("metrics")
+                continue
+            if result.get("partial"):
+                missing.append("metrics")
+            for metric in content["metrics"]:
+                name = metric.get("name") if isinstance(metric, dict) else None
+                if isinstance(name, str) and name and name.lower() not in names:
+                    names.add(name.lower())
+                    metrics.append({**metric, "category": metric.get("category") or category})
+        
+        if not metrics:
+            # Nothing to assemble; report the first failure
+            return next((result for result in results if not result.get("success", False)), results[0])
+        
+        assembly = await self.generate_completion(**self._kpi_assembly_kwargs(company_info, metrics))
+        usage = _add_usage(usage, assembly.get("usage"))
+        extra = assembly.get("content") if assembly.get("success", False) else None
+        if not isinstance(extra, dict):
+            logger.warning(f"KPI assembly failed: {assembly.get('error')}")
+            extra = {}
+        
+        content = {"metrics": metrics}
+        for key in ("dashboard_recommendations", "summary"):
+            if key in extra:
+                content[key] = extra[key]
+            else:
+                missing.append(key)
+        
+        response = {"success": True, "content": content, "usage": usage}
+        if missing:
+            response["partial"] = True
+            response["missing"] = list(dict.fromkeys(missing))
+        return response
+    
+    async def stream_kpi_system(
+        self,
+        company_info: Dict[str, Any],
+        cache_mode: str = "use"
+    ) -> AsyncIterator[Tuple[str, Any]]:
+        """
+        Generate a structured KPI system, yielding each part as soon as it is complete
+        
+        Uses the streaming chat completions API and an incremental JSON parser,
+        so every element of "metrics" and "dashboard_recommendations" and the
+        "summary" are yielded while the rest of the object is still being
+        generated. Cache hits are replayed as the same sequence of events.
+        
+        Args:
+            company_info: Dictionary containing company information
+            cache_mode: "use", "bypass" or "refresh", as for generate_kpi_system
+            
+        Yields:
+            (event, data) tuples: "metric", "dashboard_recommendation", "summary",
+            then a final "done" or "error"
+        """
+        key = make_cache_key(company_info, "structured", self.deployment_name, KPI_PROMPT_VERSION)
+        
+        if cache_mode == "use":
+            cached = await self.cache.aget(key)
+            if cached is not None:
+                cached = _conform_kpi_system(cached)
+            if cached is not None and cached["success"]:
+                for event in _kpi_system_events(cached["content"]):
+                    yield event
+                yield "done", {"cached": True, "usage": cached.get("usage")}
+                return
+        
+        if not self.client:
+            yield "error", {"error": "Azure OpenAI client not initialized"}
+            return
+        
+        kwargs = self._kpi_system_kwargs(company_info, "structured")
+        operation = kwargs["operation"]
+        try:
+            request = self._build_request(model=None, **kwargs)
+        except TokenBudgetExceeded as e:
+            yield "error", {"error": str(e)}
+            return
+        request["stream"] = True
+        parser = IncrementalJSONObjectParser()
+        
+        upstream: Optional[Upstream] = None
+        failure: Optional[Exception] = None
+        emitted = False
+        
+        started = time.perf_counter()
+        try:
+            upstream = self.pool.acquire(request["model"])
+            upstream_in_flight.inc(upstream.name)
+            stream = await self._client_for(upstream).chat.completions.create(
+                **_for_upstream(request, upstream), timeout=deadline_for(operation)
+            )
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    for event in parser.feed(delta):
+                        emitted = True
+                        yield event
+        except Exception as e:
+            failure = e
+        except BaseException:
+            if upstream is not None:
+                upstream.breaker.release()
+            raise
+        finally:
+            if upstream is not None:
+                upstream_in_flight.dec(upstream.name)
+                self.pool.release(upstream)
+        
+        if failure is not None:
+            if upstream is not None:
+                observe_upstream(upstream.name, operation, started, "error")
+                self.pool.record_failure(upstream, failure)
+            logger.error(f"Error streaming KPI system: {str(failure)}")
+            # A degraded answer can only replace the stream if nothing was sent yet
+            degraded = None if emitted else await self._degraded_kpi_system(
+                key, company_info, "structured", self._upstream_failure(failure)
+            )
+            if degraded is None:
+                yield "error", {"error": str(failure)}
+                return
+            for event in _kpi_system_events(degraded["content"]):
+                yield event
+            yield "done", {"cached": degraded["cached"], "usage": None, "degraded": degraded["degraded"]}
+            return
+        
+        self.pool.record_success(upstream, time.perf_counter() - started)
+        observe_upstream(upstream.name, operation, started, "success")
+        
+        # Streaming responses carry no usage block, so count the tokens locally
+        completion_tokens = self.budget.tokenizer.count(parser.buffer)
+        self.budget.record(operation, completion_tokens)
+        record_usage(self.budget.count_messages(request["messages"]) + completion_tokens)
+        
+        try:
+            content = parser.result()
+        except json.JSONDecodeError:
+            # Complete elements have already been streamed; report what is missing
+            result = self._parse_structured(parser.buffer, operation, KPI_SCHEMA)
+            if not result["success"]:
+                yield "error", {**result, "raw_content": parser.buffer}
+                return
+            yield "done", {
+                "cached": False,
+                "usage": None,
+                "partial": result.get("partial", False),
+                "missing": result.get("missing", [])
+            }
+            return
+        
+        if cache_mode != "bypass":
+            conformed = _conform_kpi_system({"success": True, "content": content, "usage": None})
+            if conformed["success"]:
+                await self.cache.aset(key, conformed)
+        
+        yield "done", {"cached": False, "usage": None}
+    
+    async def _degraded_kpi_system(
+        self,
+        key: str,
+        company_info: Dict[str, Any],
+        output_format: str,
+        failure: Dict[str, Any]
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Stand-in answer for a KPI system request the upstream could not serve
+        
+        Prefers the cached system for the same request, even if expired, and
+        otherwise the closest example pack. Returns None when the failure was
+        not an upstream outage or nothing suitable exists.
+        """
+        if not DEGRADED_FALLBACK or failure.get("status_code") not in DEGRADABLE_STATUS_CODES:
+            return None
+        
+        cached = await self.cache.aget_stale(key)
+        if cached is not None:
+            logger.warning("Serving a cached KPI system while Azure OpenAI is unavailable")
+            return {**_conform_kpi_system(cached, output_format), "cached": True, "degraded": "cache"}
+        
+        if output_format != "structured":
+            return None
+        example = get_example_catalog().nearest(
+            company_info.get("product_type"), company_info.get("company_stage")
+        )
+        if example is None:
+            return None
+        logger.warning(f"Serving example pack {example.get('name')} while Azure OpenAI is unavailable")
+        return {
+            "success": True,
+            "content": _example_kpi_system(example),
+            "usage": None,
+            "cached": False,
+            "degraded": "example"
+        }
+    
+    async def generate_sql_query(
+        self,
+        metric_name: str,
+        metric_calculation: str,
+        tech_stack: str
+    ) -> Dict[str, Any]:
+        """Generate SQL for a specific metric based on the tech stack"""
+        return await self.generate_completion(
+            **self._sql_query_kwargs(metric_name, metric_calculation, tech_stack)
+        )
+    
+    async def generate_sql_queries(
+        self,
+        items: List[Dict[str, str]],
+        max_concurrency: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Generate SQL for several metrics concurrently
+        
+        Identical items are generated once, and at most max_concurrency
+        upstream calls run at a time.
+        
+        Args:
+            items: Dictionaries with metric_name, metric_calculation and tech_stack
+            max_concurrency: Cap on concurrent generations (defaults to SQL_BATCH_CONCURRENCY)
+            
+        Returns:
+            One result dictionary per item, in input order
+        """
+        semaphore = asyncio.Semaphore(max_concurrency or SQL_BATCH_CONCURRENCY)
+        
+        # Map each distinct item to its position in the list of upstream calls
+        unique: Dict[tuple, int] = {}
+        positions = []
+        for item in items:
+            key = (item["metric_name"], item["metric_calculation"], item["tech_stack"])
+            positions.append(unique.setdefault(key, len(unique)))
+        
+        async def generate(key: tuple) -> Dict[str, Any]:
+            async with semaphore:
+                return await self.generate_sql_query(*key)
+        
+        results = await asyncio.gather(*(generate(key) for key in unique))
+        return [results[position] for position in positions]
+
+def _for_upstream(request: Dict[str, Any], upstream: Upstream) -> Dict[str, Any]:
+    """Request arguments addressed to upstream's deployment"""
+    return {**request, "model": upstream.deployment}
+
+def _add_usage(total: Optional[Dict[str, int]], usage: Optional[Dict[str, int]]) -> Optional[Dict[str, int]]:
+    """Sum two usage dictionaries, either of which may be missing"""
+    if not usage:
+        return total
+    if not total:
+        return dict(usage)
+    return {name: total.get(name, 0) + usage.get(name, 0) for name in total}
+
+def _merge_continuation(partial: Dict[str, Any], continuation: Dict[str, Any]) -> Dict[str, Any]:
+    """Fill the missing parts of a partial KPI system from a continuation result"""
+    if not continuation.get("success", False) or not isinstance(continuation.get("content"), dict):
+        logger.warning(f"KPI continuation failed: {continuation.get('error')}")
+        return partial
+    
+    content = dict(partial["content"])
+    extra = continuation["content"]
+    for key in partial["missing"]:
+        value = extra.get(key)
+        if value is None:
+            continue
+        if isinstance(value, list) and isinstance(content.get(key), list):
+            names = {item.get("name") for item in content[key] if isinstance(item, dict)}
+            content[key] = content[key] + [
+                item for item in value
+                if not (isinstance(item, dict) and item.get("name") in names)
+            ]
+        else:
+            content[key] = value
+    
+    usage = {
+        name: partial["usage"][name] + continuation["usage"][name]
+        for name in partial["usage"]
+    }
+    missing = [key for key in continuation.get("missing", []) if key in partial["missing"]]
+    missing += [key for key in partial["missing"] if key not in content]
+    result = {"success": True, "content": content, "usage": usage}
+    if missing:
+        result["partial"] = True
+        result["missing"] = list(dict.fromkeys(missing))
+    return result
+
+def _conform_kpi_system(response: Dict[str, Any], output_format: str = "structured") -> Dict[str, Any]:
+    """
+    KPI system result whose structured content satisfies KPI_SCHEMA
+
+    Valid JSON is returned by the parser as-is, so fields of the wrong type
+    (a numeric benchmark, say) are coerced or dropped here, before the
+    result is cached or handed to the response models.
+    """
+    if output_format != "structured" or not response.get("success", False):
+        return response
+    content, errors = conform_to_schema(response.get("content"), KPI_SCHEMA)
+    if content is None:
+        logger.error(f"KPI system does not match the schema: {errors}")
+        return {
+            "success": False,
+            "error": "Structured output does not match the schema",
+            "raw_content": response.get("content")
+        }
+    if errors:
+        logger.warning(f"Conformed KPI system to the schema: {errors}")
+    return {**response, "content": content}
+
+def _example_kpi_system(example: Dict[str, Any]) -> Dict[str, Any]:
+    """Present an example pack in the structured KPI system shape"""
+    return {
+        "metrics": [{"name": name} for name in example.get("metrics", [])],
+        "dashboard_recommendations": [],
+        "summary": (
+            f"{example.get('name')}: a starter set of metrics for {example.get('product_type')} "
+            f"companies at the {example.get('company_stage')} stage, shown while AI generation is unavailable."
+        )
+    }
+
+def _kpi_system_events(content: Any) -> List[Tuple[str, Any]]:
+    """Split a complete KPI system into the events stream_kpi_system yields"""
+    if not isinstance(content, dict):
+        return []
+    events = []
+    for key, event in DEFAULT_ARRAY_EVENTS.items():
+        for item in content.get(key) or []:
+            events.append((event, item))
+    for key, value in content.items():
+        if key not in DEFAULT_ARRAY_EVENTS and not isinstance(value, (dict, list)):
+            events.append((key, value))
+    return events
+
+# Create singleton instances
 azure_openai_service = AzureOpenAIService()
+async_azure_openai_service = AsyncAzureOpenAIService()
 
 def get_azure_openai_service() -> AzureOpenAIService:
     """Get the Azure OpenAI service instance"""
     return azure_openai_service
+
+def get_async_azure_openai_service() -> AsyncAzureOpenAIService:
+    """Get the non-blocking Azure OpenAI service instance"""
+    return async_azure_openai_service
@@ -0,0 +1,105 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+# Configure logger
+logger = logging.getLogger(__name__)
+
+# Load environment variables
+load_dotenv()
+
+DEFAULT_CATALOG_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "example_systems.json")
+EXAMPLE_CATALOG_PATH = os.getenv("EXAMPLE_CATALOG_PATH", DEFAULT_CATALOG_PATH)
+EXAMPLE_CATALOG_MAX_AGE = int(os.getenv("EXAMPLE_CATALOG_MAX_AGE", "3600"))
+
+def _facet(value: Optional[str]) -> Optional[str]:
+    """Normalize a filter value; None and blank mean "any\""""
+    if value is None:
+        return None
+    value = " ".join(value.split()).lower()
+    return value or None
+
+class CatalogEntry:
+    """A pre-serialized response body and its strong ETag"""
+
+    __slots__ = ("body", "etag")
+
+    def __init__(self, examples: List[Dict[str, Any]]):
+        self.body = json.dumps(examples, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+        self.etag = '"' + hashlib.sha256(self.body).hexdigest()[:32] + '"'
+
+class ExampleCatalog:
+    """
+    Versioned catalog of example KPI systems
+
+    Loaded once from a JSON data file so new packs can be added without code
+    changes. Every combination of the product_type and company_stage filters
+    that can match anything is serialized up front, so a request is served
+    by a dictionary lookup and never re-encodes the catalog.
+    """
+
+    def __init__(self, path: str = EXAMPLE_CATALOG_PATH):
+        self.path = path
+        self.version: Optional[str] = None
+        self.examples: List[Dict[str, Any]] = []
+        self._entries: Dict[Tuple[Optional[str], Optional[str]], CatalogEntry] = {}
+        self._groups: Dict[Tuple[Optional[str], Optional[str]], List[Dict[str, Any]]] = {}
+        self._empty = CatalogEntry([])
+        self._lock = threading.Lock()
+
+    def load(self) -> None:
+        """(Re)load the data file and rebuild the serialized index"""
+        with open(self.path, "rb") as f:
+            data = json.load(f)
+        examples = data["examples"] if isinstance(data, dict) else data
+
+        groups: Dict[Tuple[Optional[str], Optional[str]], List[Dict[str, Any]]] = {}
+        for example in examples:
+            product_type = _facet(example.get("product_type"))
+            company_stage = _facet(example.get("company_stage"))
+            for key in {(None, None), (product_type, None), (None, company_stage), (product_type, company_stage)}:
+                groups.setdefault(key, []).append(example)
+
+        entries = {key: CatalogEntry(items) for key, items in groups.items()}
+        if (None, None) not in entries:
+            entries[(None, None)] = CatalogEntry([])
+        version = str(data.get("version", "")) if isinstance(data, dict) else ""
+
+        with self._lock:
+            self.examples = examples
+            self._entries = entries
+            self._groups = groups
+            self.version = version or entries[(None, None)].etag.strip('"')
+        logger.info(f"Loaded {len(examples)} example KPI systems (catalog version {self.version})")
+
+    def _ensure_loaded(self) -> None:
+        if self.version is None:
+            self.load()
+
+    def lookup(self, product_type: Optional[str] = None, company_stage: Optional[str] = None) -> CatalogEntry:
+        """Serialized examples matching the filters (case-insensitive, None matches any)"""
+        self._ensure_loaded()
+        return self._entries.get((_facet(product_type), _facet(company_stage)), self._empty)
+
+    def nearest(self, product_type: Optional[str] = None, company_stage: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Closest example: same product type and stage, else same product type, else same stage"""
+        self._ensure_loaded()
+        product_type, company_stage = _facet(product_type), _facet(company_stage)
+        for key in ((product_type, company_stage), (product_type, None), (None, company_stage)):
+            if key != (None, None) and self._groups.get(key):
+                return self._groups[key][0]
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        return {"version": self.version, "examples": len(self.examples), "indexed_filters": len(self._entries)}
+
+example_catalog = ExampleCatalog()
+
+def get_example_catalog() -> ExampleCatalog:
+    """Get the example catalog instance"""
+    return example_catalog
@@ -0,0 +1,458 @@
+import os
+import math
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from statistics import NormalDist
+from typing import Any, Dict, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+
+from .kpi_engine import NAT, KPIComputeError, encode_ids, to_seconds
+
+# Configure logger
+logger = logging.getLogger(__name__)
+
+# Load environment variables
+load_dotenv()
+
+# Processes the bootstrap is spread across (1 runs it in the API process)
+BOOTSTRAP_WORKERS = int(os.getenv("BOOTSTRAP_WORKERS") or os.cpu_count() or 1)
+# Resamples drawn from one seed; results depend on the seed only, not on
+# how chunks are distributed over workers
+BOOTSTRAP_CHUNK = 250
+# Below this many values drawn in total the bootstrap stays in-process
+BOOTSTRAP_PARALLEL_MIN_DRAWS = 20_000_000
+# Values gathered per vectorized draw, bounding worker memory
+BOOTSTRAP_BLOCK_DRAWS = 1 << 22
+
+OUTCOME_METRICS = ("sum", "count", "conversion")
+
+def _betainc(a: float, b: float, x: float) -> float:
+    """Regularized incomplete beta function I_x(a, b) (continued fraction)"""
+    if x <= 0:
+        return 0.0
+    if x >= 1:
+        return 1.0
+    if x > (a + 1) / (a + b + 2):
+        return 1.0 - _betainc(b, a, 1.0 - x)
+    front = math.exp(math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b) + a * math.log(x) + b * math.log1p(-x)) / a
+    tiny = 1e-300
+    c, d = 1.0, 1.0 - (a + b) * x / (a + 1)
+    d = 1.0 / (d if abs(d) > tiny else tiny)
+    result = d
+    for m in range(1, 100000):
+        for numerator in (
+            m * (b - m) * x / ((a + 2 * m - 1) * (a + 2 * m)),
+            -(a + m) * (a + b + m) * x / ((a + 2 * m) * (a + 2 * m + 1)),
+        ):
+            d = 1.0 + numerator * d
+            d = 1.0 / (d if abs(d) > tiny else tiny)
+            c = 1.0 + numerator / c
+            c = c if abs(c) > tiny else tiny
+            result *= c * d
+        if abs(c * d - 1.0) < 1e-12:
+            break
+    return front * result
+
+def t_two_sided_p(t: float, df: float) -> float:
+    """Two-sided p-value of a Student t statistic"""
+    if math.isnan(t) or math.isnan(df):
+        return math.nan
+    if math.isinf(df) or df > 1e7:
+        return 2 * (1 - NormalDist().cdf(abs(t)))
+    return _betainc(df / 2, 0.5, df / (df + t * t))
+
+def t_quantile(confidence: float, df: float) -> float:
+    """Critical value c with P(|T| <= c) = confidence for df degrees of freedom"""
+    normal = NormalDist().inv_cdf(0.5 + confidence / 2)
+    if math.isinf(df) or df > 1e7:
+        return normal
+    low, high = normal, normal
+    while t_two_sided_p(high, df) > 1 - confidence:
+        high *= 2
+    for _ in range(100):
+        middle = (low + high) / 2
+        if t_two_sided_p(middle, df) > 1 - confidence:
+            low = middle
+        else:
+            high = middle
+    return (low + high) / 2
+
+def welch_test(
+    control: Tuple[float, float, int],
+    treatment: Tuple[float, float, int],
+    confidence: float = 0.95
+) -> Dict[str, Optional[float]]:
+    """
+    Welch's unequal-variance t-test of treatment minus control
+
+    Args:
+        control: (mean, variance, users) of the control arm
+        treatment: (mean, variance, users) of the treatment arm
+        confidence: Level of the intervals
+
+    Returns:
+        Difference, lift (relative to the control mean) and their
+        intervals, t statistic, Welch-Satterthwaite degrees of freedom and
+        two-sided p-value; None where undefined
+    """
+    (mean_c, var_c, n_c), (mean_t, var_t, n_t) = control, treatment
+    if n_c < 2 or n_t < 2:
+        return {"difference": mean_t - mean_c, "ci": None, "lift": _ratio(mean_t - mean_c, mean_c),
+                "lift_ci": None, "t": None, "df": None, "p_value": None}
+    se_c, se_t = var_c / n_c, var_t / n_t
+    difference = mean_t - mean_c
+    se = math.sqrt(se_c + se_t)
+    if se == 0:
+        return {"difference": difference, "ci": [difference, difference], "lift": _ratio(difference, mean_c),
+                "lift_ci": None, "t": None, "df": None, "p_value": None if difference == 0 else 0.0}
+    df = (se_c + se_t) ** 2 / (se_c ** 2 / (n_c - 1) + se_t ** 2 / (n_t - 1))
+    t = difference / se
+    critical = t_quantile(confidence, df)
+
+    lift = lift_ci = None
+    if mean_c != 0:
+        # Delta method for the ratio of the two means
+        lift = difference / mean_c
+        lift_se = math.sqrt(se_t / mean_c ** 2 + mean_t ** 2 * se_c / mean_c ** 4)
+        lift_ci = [lift - critical * lift_se, lift + critical * lift_se]
+    return {
+        "difference": difference,
+        "ci": [difference - critical * se, difference + critical * se],
+        "lift": lift,
+        "lift_ci": lift_ci,
+        "t": t,
+        "df": df,
+        "p_value": t_two_sided_p(t, df),
+    }
+
+def _ratio(numerator: float, denominator: float) -> Optional[float]:
+    return numerator / denominator if denominator else None
+
+def _prepare_arm(values: np.ndarray) -> Dict[str, Any]:
+    """
+    Compact description of an arm that bootstrap workers sample from
+
+    Draws from the most common value (typically 0) are only counted, with
+    one binomial per resample, and just the other values are gathered.
+    When few distinct values exist, whole resamples come from one
+    multinomial draw over them instead.
+    """
+    distinct, counts = np.unique(values, return_counts=True)
+    mode = int(np.argmax(counts))
+    others = np.delete(distinct, mode)
+    other_counts = np.delete(counts, mode)
+    users = len(values)
+    arm = {"users": users, "mode": float(distinct[mode]), "other_share": float(other_counts.sum()) / users}
+    if len(distinct) * 8 < other_counts.sum():
+        arm.update(method="multinomial", values=distinct, probabilities=counts / users)
+    else:
+        arm.update(method="gather", values=np.repeat(others, other_counts))
+    return arm
+
+def _arm_cost(arm: Dict[str, Any]) -> float:
+    """Values drawn per resample of an arm"""
+    return len(arm["values"]) if arm["method"] == "multinomial" else arm["users"] * arm["other_share"]
+
+def _resample_means(arm: Dict[str, Any], rng: np.random.Generator, size: int) -> np.ndarray:
+    """Means of size bootstrap resamples of an arm"""
+    users = arm["users"]
+    if arm["method"] == "multinomial":
+        return rng.multinomial(users, arm["probabilities"], size=size) @ arm["values"] / users
+
+    values = arm["values"]
+    drawn = rng.binomial(users, arm["other_share"], size=size) if len(values) else np.zeros(size, dtype=np.int64)
+    sums = np.zeros(size)
+    rows = max(1, int(BOOTSTRAP_BLOCK_DRAWS // max(1.0, users * arm["other_share"])))
+    for start in range(0, size, rows):
+        block = drawn[start:start + rows]
+        total = int(block.sum())
+        if not total:
+            continue
+        # Sum each resample's run of draws; the trailing 0 keeps every offset in range
+        picked = np.append(values[rng.integers(0, len(values), total, dtype=np.uint32)], 0.0)
+        offsets = np.concatenate(([0], np.cumsum(block)[:-1]))
+        block_sums = np.add.reduceat(picked, offsets)
+        block_sums[block == 0] = 0.0
+        sums[start:start + len(block)] = block_sums
+    return (arm["mode"] * (users - drawn) + sums) / users
+
+def _bootstrap_chunks(arms: Sequence[Dict[str, Any]], seeds: Sequence[np.random.SeedSequence], sizes: Sequence[int]) -> np.ndarray:
+    """Resample means (resamples x arms) for a run of chunks; runs in pool workers"""
+    blocks = []
+    for seed, size in zip(seeds, sizes):
+        rng = np.random.default_rng(seed)
+        blocks.append(np.column_stack([_resample_means(arm, rng, size) for arm in arms]))
+    return np.vstack(blocks)
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+def get_bootstrap_pool() -> ProcessPoolExecutor:
+    """Get the bootstrap process pool, started on first use"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn rather than fork: the API process runs threads
+            _pool = ProcessPoolExecutor(max_workers=BOOTSTRAP_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+            logger.info(f"Started bootstrap pool with {BOOTSTRAP_WORKERS} processes")
+        return _pool
+
+def shutdown_bootstrap_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(cancel_futures=True)
+            _pool = None
+
+def bootstrap_means(arms_values: Sequence[np.ndarray], resamples: int, seed: int) -> np.ndarray:
+    """
+    Bootstrap distribution of the mean of each arm
+
+    Each arm is resampled independently, with replacement, at its own size.
+    The resamples are split into BOOTSTRAP_CHUNK-sized chunks seeded from
+    one SeedSequence, so the output depends only on the seed; large runs
+    are spread over the process pool.
+
+    Returns:
+        resamples x arms array of means
+    """
+    arms = [_prepare_arm(values) for values in arms_values]
+    sizes = [min(BOOTSTRAP_CHUNK, resamples - start) for start in range(0, resamples, BOOTSTRAP_CHUNK)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    draws = resamples * sum(_arm_cost(arm) for arm in arms)
+    if BOOTSTRAP_WORKERS <= 1 or draws < BOOTSTRAP_PARALLEL_MIN_DRAWS or len(sizes) == 1:
+        return _bootstrap_chunks(arms, seeds, sizes)
+
+    pool = get_bootstrap_pool()
+    parts = min(BOOTSTRAP_WORKERS, len(sizes))
+    bounds = np.linspace(0, len(sizes), parts + 1).astype(int)
+    try:
+        futures = [
+            pool.submit(_bootstrap_chunks, arms, seeds[lo:hi], sizes[lo:hi])
+            for lo, hi in zip(bounds[:-1], bounds[1:])
+        ]
+        return np.vstack([future.result() for future in futures])
+    except BrokenProcessPool as e:
+        # A worker died; start a fresh pool next time and finish this run here
+        logger.error(f"Bootstrap pool failed, running in-process: {str(e)}")
+        shutdown_bootstrap_pool()
+        return _bootstrap_chunks(arms, seeds, sizes)
+
+def _user_codes(exposures: Mapping[str, Any], outcomes: Mapping[str, Any]) -> Tuple[np.ndarray, np.ndarray]:
+    """Shared dense codes for the user ids of both tables"""
+    left, right = np.asarray(exposures["user_id"]), np.asarray(outcomes["user_id"])
+    if left.dtype.kind != right.dtype.kind or left.dtype.kind not in "iu":
+        left, right = left.astype(str), right.astype(str)
+    codes = encode_ids(np.concatenate([left, right]))
+    return codes[:len(left)], codes[len(left):]
+
+def _float_column(table: Mapping[str, Any], name: str) -> np.ndarray:
+    """
+    A numeric column as float64
+
+    Raises:
+        KPIComputeError: If the column holds non-numeric values
+    """
+    try:
+        return np.asarray(table[name], dtype=float)
+    except (TypeError, ValueError) as e:
+        raise KPIComputeError(f"Column {name}: {str(e)}")
+
+def _per_user(users: np.ndarray, values: np.ndarray, user_count: int, metric: str) -> np.ndarray:
+    """Outcome metric of every user from their outcome rows"""
+    if metric == "count":
+        return np.bincount(users, minlength=user_count).astype(float)
+    if metric == "conversion":
+        return (np.bincount(users, minlength=user_count) > 0).astype(float)
+    return np.bincount(users, weights=values, minlength=user_count)
+
+def experiment_impact(
+    exposures: Mapping[str, Any],
+    outcomes: Mapping[str, Any],
+    control: str = "control",
+    metric: str = "sum",
+    outcome_event: Optional[str] = None,
+    confidence: float = 0.95,
+    cuped: bool = True,
+    resamples: int = 10000,
+    seed: Optional[int] = None
+) -> Dict[str, Any]:
+    """
+    Impact of each flag variant on an outcome metric, against control
+
+    Every exposed user gets the metric over their outcome rows: the sum of
+    value (1 per row without one), the row count or conversion (any row).
+    With timestamps on both tables only outcomes at or after the user's
+    first exposure count, and the same metric before exposure becomes the
+    CUPED covariate unless exposures carry a covariate column. Users
+    exposed to more than one variant are excluded.
+
+    Args:
+        exposures: user_id, variant, optional timestamp and covariate
+        outcomes: user_id, optional value, timestamp and event
+        control: Variant the others are compared with
+        metric: One of OUTCOME_METRICS
+        outcome_event: Only count outcome rows with this event
+        confidence: Level of all intervals
+        cuped: Whether to report CUPED-adjusted estimates
+        resamples: Bootstrap resamples (0 skips the bootstrap)
+        seed: Bootstrap seed; a random one is drawn and returned if omitted
+
+    Returns:
+        Per-variant summaries and, per treatment, Welch, CUPED and
+        bootstrap estimates of the difference and lift
+
+    Raises:
+        KPIComputeError: If the inputs cannot produce the comparison
+    """
+    if metric not in OUTCOME_METRICS:
+        raise KPIComputeError(f"Unknown metric {metric!r}; expected one of {', '.join(OUTCOME_METRICS)}")
+    if not 0 < confidence < 1:
+        raise KPIComputeError("confidence must be between 0 and 1")
+    for name, table, required in (("exposures", exposures, ("user_id", "variant")), ("outcomes", outcomes, ("user_id",))):
+        missing = [c for c in required if c not in table]
+        if name == "outcomes" and outcome_event and "event" not in table:
+            missing.append("event")
+        if missing:
+            raise KPIComputeError(f"Table {name} is missing columns: {', '.join(missing)}")
+        if len({len(values) for values in table.values()}) > 1:
+            raise KPIComputeError(f"Columns of table {name} have different lengths")
+    if not len(exposures["user_id"]):
+        raise KPIComputeError("The exposures table is empty")
+
+    exposed, outcome_users = _user_codes(exposures, outcomes)
+    user_count = int(max(exposed.max(), outcome_users.max() if outcome_users.size else 0)) + 1
+    variants, variant_codes = np.unique(np.asarray(exposures["variant"]).astype(str), return_inverse=True)
+    variant_codes = variant_codes.reshape(-1)
+    if control not in variants:
+        raise KPIComputeError(f"Control variant {control!r} not found; variants are {', '.join(variants)}")
+
+    # Variant of every user; users seen in several variants are dropped
+    lowest = np.full(user_count, len(variants), dtype=np.int64)
+    highest = np.full(user_count, -1, dtype=np.int64)
+    np.minimum.at(lowest, exposed, variant_codes)
+    np.maximum.at(highest, exposed, variant_codes)
+    assigned = np.where(lowest == highest, lowest, -1)
+    excluded = int(((highest >= 0) & (lowest != highest)).sum())
+
+    values = _float_column(outcomes, "value") if "value" in outcomes else np.ones(len(outcome_users))
+    values = np.nan_to_num(values)
+    rows = np.ones(len(outcome_users), dtype=bool)
+    if outcome_event:
+        rows &= np.asarray(outcomes["event"]) == outcome_event
+    after = rows
+    before = None
+    if "timestamp" in exposures and "timestamp" in outcomes:
+        first_exposure = np.full(user_count, np.iinfo(np.int64).max, dtype=np.int64)
+        exposure_times = to_seconds(exposures["timestamp"])
+        timed = exposure_times != NAT
+        np.minimum.at(first_exposure, exposed[timed], exposure_times[timed])
+        outcome_times = to_seconds(outcomes["timestamp"])
+        after = rows & (outcome_times >= first_exposure[outcome_users])
+        before = rows & (outcome_times < first_exposure[outcome_users]) & (outcome_times != NAT)
+
+    outcome = _per_user(outcome_users[after], values[after], user_count, metric)
+    covariate = None
+    if "covariate" in exposures:
+        covariate = np.zeros(user_count)
+        covariate[exposed] = np.nan_to_num(_float_column(exposures, "covariate"))
+    elif before is not None:
+        covariate = _per_user(outcome_users[before], values[before], user_count, metric)
+
+    included = np.flatnonzero(assigned >= 0)
+    groups = [included[assigned[included] == code] for code in range(len(variants))]
+    arms = [outcome[users] for users in groups]
+    control_index = int(np.flatnonzero(variants == control)[0])
+
+    def summary(values: np.ndarray) -> Tuple[float, float, int]:
+        return (float(values.mean()) if values.size else math.nan,
+                float(values.var(ddof=1)) if values.size > 1 else math.nan,
+                int(values.size))
+
+    stats = [summary(values) for values in arms]
+
+    adjusted = None
+    cuped_info = None
+    if cuped and covariate is not None:
+        x, y = covariate[included], outcome[included]
+        x_var = x.var(ddof=1) if x.size > 1 else 0.0
+        if x_var > 0:
+            theta = float(np.cov(y, x, ddof=1)[0, 1] / x_var)
+            adjusted_outcome = np.zeros(user_count)
+            adjusted_outcome[included] = y - theta * (x - x.mean())
+            adjusted = [summary(adjusted_outcome[users]) for users in groups]
+            residual = adjusted_outcome[included].var(ddof=1)
+            y_var = y.var(ddof=1)
+            cuped_info = {
+                "theta": theta,
+                "variance_reduction": 1 - residual / y_var if y_var > 0 else None,
+                "covariate": "covariate" if "covariate" in exposures else "pre_exposure_metric",
+            }
+
+    bootstrap = None
+    if resamples > 0 and all(values.size for values in arms):
+        if seed is None:
+            seed = int(np.random.SeedSequence().entropy % (1 << 63))
+        bootstrap = bootstrap_means(arms, resamples, seed)
+    alpha = (1 - confidence) / 2 * 100
+
+    comparisons = []
+    for index, variant in enumerate(variants):
+        if index == control_index:
+            continue
+        comparison = {"variant": str(variant), "welch": welch_test(stats[control_index], stats[index], confidence)}
+        if adjusted is not None:
+            test = welch_test(adjusted[control_index], adjusted[index], confidence)
+            # Lift stays relative to the unadjusted control mean
+            mean_c = stats[control_index][0]
+            test["lift"] = _ratio(test["difference"], mean_c)
+            test["lift_ci"] = [bound / mean_c for bound in test["ci"]] if test["ci"] and mean_c else None
+            comparison["cuped"] = {**cuped_info, **test}
+        else:
+            comparison["cuped"] = None
+        if bootstrap is not None:
+            difference = bootstrap[:, index] - bootstrap[:, control_index]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                lift = np.where(bootstrap[:, control_index] != 0, difference / bootstrap[:, control_index], np.nan)
+            finite = lift[np.isfinite(lift)]
+            comparison["bootstrap"] = {
+                "ci": np.percentile(difference, [alpha, 100 - alpha]).tolist(),
+                "lift_ci": np.percentile(finite, [alpha, 100 - alpha]).tolist() if finite.size else None,
+                # Share of resamples on either side of 0, never below 1 / (resamples + 1)
+                "p_value": float(min(1.0, 2 * (min((difference <= 0).sum(), (difference >= 0).sum()) + 1) / (len(difference) + 1))),
+            }
+        else:
+            comparison["bootstrap"] = None
+        comparisons.append(comparison)
+
+    return {
+        "control": control,
+        "metric": metric,
+        "confidence": confidence,
+        "resamples": resamples if bootstrap is not None else 0,
+        "seed": seed if bootstrap is not None else None,
+        "excluded_users": excluded,
+        "variants": [
+            {"variant": str(variant), "users": n, "mean": _finite(mean), "std": _finite(math.sqrt(var)) if var >= 0 else None}
+            for variant, (mean, var, n) in zip(variants, stats)
+        ],
+        "comparisons": _finite_tree(comparisons),
+    }
+
+def _finite(value: Optional[float]) -> Optional[float]:
+    return None if value is None or not math.isfinite(value) else float(value)
+
+def _finite_tree(value: Any) -> Any:
+    """Replace NaN and infinities with None throughout lists and dicts"""
+    if isinstance(value, dict):
+        return {key: _finite_tree(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_finite_tree(item) for item in value]
+    if isinstance(value, float):
+        return _finite(value)
+    return value
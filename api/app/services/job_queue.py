@@ -0,0 +1,453 @@
+import os
+import json
+import time
+import uuid
+import socket
+import asyncio
+import sqlite3
+import logging
+import threading
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from .rate_limit import charge_usage_to
+
+# Configure logger
+logger = logging.getLogger(__name__)
+
+# Load environment variables
+load_dotenv()
+
+# Defaults to the api/ directory rather than the working directory
+DEFAULT_JOB_DB_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+    "metrically_jobs.db"
+)
+JOB_DB_PATH = os.getenv("JOB_DB_PATH") or DEFAULT_JOB_DB_PATH
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+# A running job whose lease is not renewed for this long is considered abandoned
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "120"))
+# Runs a job may start before it is failed instead of re-queued
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+# Finished jobs are deleted this long after they finish
+JOB_RETENTION_SECONDS = float(os.getenv("JOB_RETENTION_SECONDS", "86400"))
+
+# Identifies the process running a job, so its host can tell when it is gone
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+DEFAULT_PRIORITY = 5
+JOB_STATES = ("queued", "running", "succeeded", "failed", "cancelled")
+FINISHED_STATES = JOB_STATES[2:]
+
+_JOB_COLUMNS = (
+    "id", "kind", "owner", "priority", "status", "params", "result", "error", "status_code",
+    "attempts", "created_at", "started_at", "finished_at", "lease_expires_at", "worker"
+)
+
+_CREATE_TABLE = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    owner TEXT,
+    priority INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    params TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    status_code INTEGER,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    lease_expires_at REAL,
+    worker TEXT
+)
+"""
+_CREATE_STATUS_INDEX = "CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, priority, created_at)"
+_SELECT = f"SELECT {', '.join(_JOB_COLUMNS)} FROM jobs WHERE id = ?"
+_SELECT_QUEUED = "SELECT id, priority, created_at FROM jobs WHERE status = 'queued'"
+_INSERT = (
+    "INSERT INTO jobs (id, kind, owner, priority, status, params, created_at) "
+    "VALUES (?, ?, ?, ?, 'queued', ?, ?)"
+)
+_CLAIM = (
+    "UPDATE jobs SET status = 'running', attempts = attempts + 1, started_at = ?, lease_expires_at = ?, worker = ? "
+    "WHERE id = ? AND status = 'queued'"
+)
+_RENEW = "UPDATE jobs SET lease_expires_at = ? WHERE id = ? AND status = 'running'"
+_FINISH = (
+    "UPDATE jobs SET status = ?, result = ?, error = ?, status_code = ?, finished_at = ?, lease_expires_at = NULL "
+    "WHERE id = ? AND status = 'running'"
+)
+_CANCEL_QUEUED = (
+    "UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE id = ? AND status = 'queued'"
+)
+_REQUEUE = "UPDATE jobs SET status = 'queued', lease_expires_at = NULL WHERE id = ? AND status = 'running'"
+_SELECT_RUNNING = "SELECT id, attempts, lease_expires_at, worker FROM jobs WHERE status = 'running'"
+_FAIL_ABANDONED = (
+    "UPDATE jobs SET status = 'failed', error = 'Job was interrupted too many times', status_code = 500, "
+    "finished_at = ?, lease_expires_at = NULL WHERE id = ? AND status = 'running'"
+)
+_PURGE = "DELETE FROM jobs WHERE status IN ('succeeded', 'failed', 'cancelled') AND finished_at < ?"
+_COUNT_BY_STATUS = "SELECT status, COUNT(*) FROM jobs GROUP BY status"
+
+def _worker_alive(worker: Optional[str]) -> bool:
+    """Whether the process that claimed a job may still be running it"""
+    host, _, pid = (worker or "").rpartition(":")
+    if host != socket.gethostname() or not pid.isdigit():
+        # Another host's process; only its lease can tell
+        return True
+    if int(pid) == os.getpid():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+class JobStore:
+    """
+    SQLite-backed persistence for background jobs
+
+    Every state change is a single conditional UPDATE, so a job can only be
+    claimed once even when several processes share the database. Running
+    jobs record the process running them and hold a lease that it keeps
+    renewing; recover() puts a job back in the queue once its lease has
+    lapsed, or straight away if its process on this host is gone.
+    """
+
+    def __init__(self, path: str = JOB_DB_PATH):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(_CREATE_TABLE)
+        self._db.execute(_CREATE_STATUS_INDEX)
+        self._lock = threading.Lock()
+
+    def _execute(self, sql: str, params: tuple = ()) -> sqlite3.Cursor:
+        with self._lock:
+            return self._db.execute(sql, params)
+
+    def create(self, kind: str, params: Dict[str, Any], owner: Optional[str], priority: int) -> Dict[str, Any]:
+        """Insert a queued job and return it"""
+        job_id = uuid.uuid4().hex
+        self._execute(_INSERT, (job_id, kind, owner, priority, json.dumps(params), time.time()))
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Look up a job; params and result are decoded"""
+        with self._lock:
+            row = self._db.execute(_SELECT, (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(_JOB_COLUMNS, row))
+        job["params"] = json.loads(job["params"])
+        job["result"] = json.loads(job["result"]) if job["result"] is not None else None
+        return job
+
+    def queued(self) -> List[tuple]:
+        """(id, priority, created_at) of every queued job"""
+        with self._lock:
+            return self._db.execute(_SELECT_QUEUED).fetchall()
+
+    def claim(self, job_id: str) -> bool:
+        """Mark a queued job as running; False if it was cancelled or claimed elsewhere"""
+        now = time.time()
+        return self._execute(_CLAIM, (now, now + JOB_LEASE_SECONDS, WORKER_ID, job_id)).rowcount == 1
+
+    def renew(self, job_id: str) -> None:
+        """Extend the lease of a running job"""
+        self._execute(_RENEW, (time.time() + JOB_LEASE_SECONDS, job_id))
+
+    def finish(
+        self,
+        job_id: str,
+        status: str,
+        result: Optional[Dict[str, Any]] = None,
+        error: Optional[str] = None,
+        status_code: Optional[int] = None
+    ) -> None:
+        """Record the outcome of a running job"""
+        encoded = json.dumps(result) if result is not None else None
+        self._execute(_FINISH, (status, encoded, error, status_code, time.time(), job_id))
+
+    def cancel_queued(self, job_id: str) -> bool:
+        """Cancel a job that has not started yet"""
+        return self._execute(_CANCEL_QUEUED, (time.time(), job_id)).rowcount == 1
+
+    def requeue(self, job_id: str) -> None:
+        """Put a running job back in the queue, e.g. on shutdown"""
+        self._execute(_REQUEUE, (job_id,))
+
+    def recover(self, max_attempts: int = JOB_MAX_ATTEMPTS) -> int:
+        """
+        Re-queue jobs abandoned by crashed workers and purge old finished jobs
+
+        Jobs that already used max_attempts runs are failed instead, so a
+        job that crashes its worker cannot do so forever.
+
+        Returns:
+            Number of jobs re-queued
+        """
+        now = time.time()
+        requeued = failed = 0
+        with self._lock:
+            for job_id, attempts, lease_expires_at, worker in self._db.execute(_SELECT_RUNNING).fetchall():
+                if (lease_expires_at or 0) >= now and _worker_alive(worker):
+                    continue
+                if attempts < max_attempts:
+                    requeued += self._db.execute(_REQUEUE, (job_id,)).rowcount
+                else:
+                    failed += self._db.execute(_FAIL_ABANDONED, (now, job_id)).rowcount
+            self._db.execute(_PURGE, (now - JOB_RETENTION_SECONDS,))
+        if requeued or failed:
+            logger.warning(f"Recovered abandoned jobs: {requeued} re-queued, {failed} failed")
+        return requeued
+
+    def counts(self) -> Dict[str, int]:
+        """Number of jobs in each state"""
+        with self._lock:
+            return dict(self._db.execute(_COUNT_BY_STATUS).fetchall())
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+JobHandler = Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]
+
+class JobCancelError(Exception):
+    """Raised when a running job belongs to another process and cannot be cancelled here"""
+
+    def __init__(self, job_id: str, worker: Optional[str]):
+        super().__init__(f"Job {job_id} is running in another worker process ({worker})")
+        self.job_id = job_id
+        self.worker = worker
+
+class JobQueue:
+    """
+    Bounded pool of asyncio workers that run persisted jobs by priority
+
+    Jobs are ordered by priority (higher first), then by age. Cancelling a
+    queued job just marks it; workers skip it when it comes up. Cancelling
+    a running job cancels its task. Waiters are woken as soon as a job
+    finishes, which backs long-polling and the SSE endpoint.
+    """
+
+    def __init__(
+        self,
+        store: JobStore,
+        handlers: Dict[str, JobHandler],
+        workers: int = JOB_WORKERS
+    ):
+        """
+        Args:
+            store: Job persistence
+            handlers: Coroutine per job kind, called with the job's params;
+                returns a result dictionary with "success" and optionally
+                "error" and "status_code"
+            workers: Number of jobs run concurrently
+        """
+        self.store = store
+        self.handlers = handlers
+        self.workers = max(1, workers)
+        self._queue: Optional["asyncio.PriorityQueue[tuple]"] = None
+        self._workers: List["asyncio.Task[None]"] = []
+        self._running: Dict[str, "asyncio.Task[Any]"] = {}
+        self._finished: Dict[str, asyncio.Event] = {}
+        self._waiters: Dict[str, int] = {}
+        self._cancelled: set = set()
+        # Jobs per state as of the last change made by this process, so
+        # metrics scrapes never query the store
+        self.counts: Dict[str, int] = {}
+
+    async def start(self) -> None:
+        """Recover abandoned jobs, queue everything pending and start the workers"""
+        if self._workers:
+            return
+        self._queue = asyncio.PriorityQueue()
+        await asyncio.to_thread(self.store.recover)
+        for job_id, priority, created_at in await asyncio.to_thread(self.store.queued):
+            self._queue.put_nowait((-priority, created_at, job_id))
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        await self._refresh_counts()
+        logger.info(f"Started {self.workers} job workers with {self._queue.qsize()} queued jobs")
+
+    async def stop(self) -> None:
+        """Stop the workers; jobs that were running are re-queued for the next start"""
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def submit(
+        self,
+        kind: str,
+        params: Dict[str, Any],
+        owner: Optional[str] = None,
+        priority: int = DEFAULT_PRIORITY
+    ) -> Dict[str, Any]:
+        """
+        Persist a job and queue it
+
+        Raises:
+            ValueError: If there is no handler for kind
+        """
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        job = await asyncio.to_thread(self.store.create, kind, params, owner, priority)
+        if self._queue is not None:
+            self._queue.put_nowait((-priority, job["created_at"], job["id"]))
+        await self._refresh_counts()
+        return job
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return await asyncio.to_thread(self.store.get, job_id)
+
+    async def wait(self, job_id: str, timeout: float) -> Optional[Dict[str, Any]]:
+        """Return the job once it has finished, or as it is after timeout seconds"""
+        job = await self.get(job_id)
+        if job is None or job["status"] in FINISHED_STATES or timeout <= 0:
+            return job
+        event = self._finished.setdefault(job_id, asyncio.Event())
+        self._waiters[job_id] = self._waiters.get(job_id, 0) + 1
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            # The last waiter to leave drops the event, finished or not
+            self._waiters[job_id] -= 1
+            if not self._waiters[job_id]:
+                del self._waiters[job_id]
+                if self._finished.get(job_id) is event:
+                    del self._finished[job_id]
+        return await self.get(job_id)
+
+    async def cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Cancel a queued or running job; finished jobs are left as they are
+
+        Raises:
+            JobCancelError: If the job is running in another process
+        """
+        if await asyncio.to_thread(self.store.cancel_queued, job_id):
+            self._notify(job_id)
+            await self._refresh_counts()
+            return await self.get(job_id)
+        task = self._running.get(job_id)
+        if task is not None:
+            self._cancelled.add(job_id)
+            task.cancel()
+            await asyncio.wait([task])
+            await self._refresh_counts()
+            return await self.get(job_id)
+        job = await self.get(job_id)
+        if job is not None and job["status"] == "running":
+            raise JobCancelError(job_id, job["worker"])
+        return job
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "running": len(self._running),
+            "queued_locally": self._queue.qsize() if self._queue is not None else 0,
+            "jobs": dict(self.counts),
+        }
+
+    async def _refresh_counts(self) -> None:
+        self.counts = await asyncio.to_thread(self.store.counts)
+
+    def _notify(self, job_id: str) -> None:
+        event = self._finished.pop(job_id, None)
+        if event is not None:
+            event.set()
+
+    async def _worker(self) -> None:
+        while True:
+            _, _, job_id = await self._queue.get()
+            if not await asyncio.to_thread(self.store.claim, job_id):
+                # Cancelled while queued, or picked up by another process
+                continue
+            job = await asyncio.to_thread(self.store.get, job_id)
+            await self._refresh_counts()
+            task = asyncio.create_task(self._run(job))
+            self._running[job_id] = task
+            try:
+                await asyncio.shield(task)
+            except asyncio.CancelledError:
+                if not task.done():
+                    # The worker itself is stopping: give the job back to the queue
+                    task.cancel()
+                    await asyncio.wait([task])
+                    await asyncio.to_thread(self.store.requeue, job_id)
+                    await self._refresh_counts()
+                    raise
+            finally:
+                self._running.pop(job_id, None)
+
+    async def _run(self, job: Dict[str, Any]) -> None:
+        """Run one claimed job, renewing its lease, and record the outcome"""
+        job_id = job["id"]
+        charge_usage_to(job["owner"])
+        renew = asyncio.create_task(self._renew_lease(job_id))
+        try:
+            result = await self.handlers[job["kind"]](job["params"])
+        except asyncio.CancelledError:
+            if job_id in self._cancelled:
+                self._cancelled.discard(job_id)
+                await asyncio.to_thread(self.store.finish, job_id, "cancelled")
+                self._notify(job_id)
+            raise
+        except Exception as e:
+            logger.error(f"Job {job_id} ({job['kind']}) failed: {str(e)}")
+            await asyncio.to_thread(self.store.finish, job_id, "failed", None, str(e), 500)
+        else:
+            if result.get("success", False):
+                await asyncio.to_thread(self.store.finish, job_id, "succeeded", result)
+            else:
+                await asyncio.to_thread(
+                    self.store.finish, job_id, "failed", result,
+                    result.get("error", "Unknown error"), result.get("status_code", 500)
+                )
+        finally:
+            renew.cancel()
+        await self._refresh_counts()
+        self._notify(job_id)
+
+    async def _renew_lease(self, job_id: str) -> None:
+        while True:
+            await asyncio.sleep(JOB_LEASE_SECONDS / 3)
+            await asyncio.to_thread(self.store.renew, job_id)
+
+async def _run_kpi_system(params: Dict[str, Any]) -> Dict[str, Any]:
+    """Job handler for kind "kpi_system\""""
+    from .enhanced_azure_openai import get_async_azure_openai_service
+    service = get_async_azure_openai_service()
+    if not service.is_available():
+        return {"success": False, "error": "Azure OpenAI service is not available", "status_code": 503}
+    return await service.generate_kpi_system(
+        company_info=params["company_info"],
+        output_format=params.get("output_format", "structured"),
+        cache_mode=params.get("cache_mode", "use"),
+        mode=params.get("mode")
+    )
+
+_job_queue: Optional[JobQueue] = None
+
+def get_job_queue() -> JobQueue:
+    """Get the job queue instance, opening its store on first use"""
+    global _job_queue
+    if _job_queue is None:
+        _job_queue = JobQueue(JobStore(), {"kpi_system": _run_kpi_system})
+    return _job_queue
+
+def get_job_counts() -> Dict[str, int]:
+    """Jobs per state as last seen by this process; empty if the queue was never used"""
+    return dict(_job_queue.counts) if _job_queue is not None else {}
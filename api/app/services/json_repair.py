@@ -0,0 +1,219 @@
+import json
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+# Configure logger
+logger = logging.getLogger(__name__)
+
+_SCHEMA_TYPES = {
+    "object": dict,
+    "array": list,
+    "string": str,
+    "number": (int, float),
+    "integer": int,
+    "boolean": bool,
+}
+
+def strip_code_fences(text: str) -> str:
+    """Remove a surrounding markdown code fence, if any"""
+    text = text.strip()
+    if text.startswith("```"):
+        newline = text.find("\n")
+        text = text[newline + 1:] if newline != -1 else text[3:]
+        text = text.rstrip()
+        if text.endswith("```"):
+            text = text[:-3]
+    return text.strip()
+
+def _drop_trailing_comma(out: List[str]) -> None:
+    """Remove a dangling comma (and whitespace after it) from the end of out"""
+    end = len(out)
+    while end and out[end - 1].isspace():
+        end -= 1
+    if end and out[end - 1] == ",":
+        del out[end - 1:]
+
+def repair_json(text: str, max_cut_depth: int = 2) -> Tuple[Any, int]:
+    """
+    Parse model-generated JSON, tolerating the usual defects
+
+    Handles code fences and prose around the document, trailing commas and
+    output cut off mid-value (for example by max_tokens). A truncated
+    document is cut back to the last value that completed at a nesting depth
+    of at most max_cut_depth, and the containers still open there are
+    closed. With the default, only whole elements of top-level arrays and
+    whole top-level values survive, never half of a metric.
+
+    Args:
+        text: Raw model output
+        max_cut_depth: Deepest nesting level a truncated document may be cut at
+
+    Returns:
+        (value, open_depth) where open_depth is 0 for a complete document,
+        otherwise the number of containers that had to be closed (2 means the
+        last top-level array was still being written)
+
+    Raises:
+        json.JSONDecodeError: If nothing could be recovered
+    """
+    text = strip_code_fences(text)
+    try:
+        return json.loads(text), 0
+    except json.JSONDecodeError as e:
+        error = e
+
+    starts = [index for index in (text.find("{"), text.find("[")) if index != -1]
+    if not starts:
+        raise error
+
+    out: List[str] = []
+    stack: List[str] = []
+    in_string = False
+    escape = False
+    string_is_value = False
+    previous = ""
+    # Output length and open containers at the last safe place to cut
+    cut: Optional[Tuple[int, Tuple[str, ...]]] = None
+
+    for ch in text[min(starts):]:
+        if in_string:
+            out.append(ch)
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+                previous = ch
+                if string_is_value and len(stack) <= max_cut_depth:
+                    cut = (len(out), tuple(stack))
+            continue
+
+        if ch.isspace():
+            out.append(ch)
+            continue
+
+        if ch == '"':
+            in_string = True
+            string_is_value = previous == ":" or (bool(stack) and stack[-1] == "[")
+        elif ch in "{[":
+            stack.append(ch)
+        elif ch in "}]":
+            if not stack or (stack[-1] == "{") != (ch == "}"):
+                break
+            _drop_trailing_comma(out)
+            stack.pop()
+            out.append(ch)
+            previous = ch
+            if not stack:
+                break
+            if len(stack) <= max_cut_depth:
+                cut = (len(out), tuple(stack))
+            continue
+        elif ch == "," and previous not in ('"', "}", "]", ",", "[", "{", ":"):
+            # A number or literal just ended
+            if len(stack) <= max_cut_depth:
+                cut = (len(out), tuple(stack))
+        out.append(ch)
+        previous = ch
+
+    if not stack and out:
+        return json.loads("".join(out)), 0
+    if cut is None:
+        raise error
+
+    length, open_containers = cut
+    out = out[:length]
+    _drop_trailing_comma(out)
+    for container in reversed(open_containers):
+        out.append("}" if container == "{" else "]")
+    return json.loads("".join(out)), len(open_containers)
+
+def schema_errors(value: Any, schema: Dict[str, Any], path: str = "$") -> List[str]:
+    """
+    Check value against the subset of JSON Schema used for structured outputs
+
+    Supports type, properties, required and items.
+
+    Returns:
+        List of error messages, empty if value conforms
+    """
+    expected = schema.get("type")
+    if expected in _SCHEMA_TYPES and not isinstance(value, _SCHEMA_TYPES[expected]):
+        return [f"{path}: expected {expected}"]
+
+    errors = []
+    if isinstance(value, dict):
+        for key in schema.get("required", ()):
+            if key not in value:
+                errors.append(f"{path}: missing {key}")
+        for key, subschema in schema.get("properties", {}).items():
+            if key in value:
+                errors.extend(schema_errors(value[key], subschema, f"{path}.{key}"))
+    elif isinstance(value, list) and "items" in schema:
+        for index, item in enumerate(value):
+            errors.extend(schema_errors(item, schema["items"], f"{path}[{index}]"))
+    return errors
+
+_DROP = object()
+
+def _conform(value: Any, schema: Dict[str, Any], path: str, errors: List[str]) -> Any:
+    """Conformed copy of value, or _DROP if it cannot be kept at all"""
+    expected = schema.get("type")
+    if expected in _SCHEMA_TYPES and not isinstance(value, _SCHEMA_TYPES[expected]):
+        if expected == "string" and isinstance(value, (int, float)) and not isinstance(value, bool):
+            # Models often write numbers where text was asked for; keep them as text
+            errors.append(f"{path}: coerced to string")
+            return str(value)
+        errors.append(f"{path}: expected {expected}")
+        return _DROP
+
+    if isinstance(value, dict):
+        conformed = {}
+        for key, item in value.items():
+            subschema = schema.get("properties", {}).get(key)
+            item = item if subschema is None else _conform(item, subschema, f"{path}.{key}", errors)
+            if item is not _DROP:
+                conformed[key] = item
+        missing = [key for key in schema.get("required", ()) if key not in conformed]
+        if missing:
+            errors.append(f"{path}: missing {', '.join(missing)}")
+            return _DROP
+        return conformed
+    if isinstance(value, list) and "items" in schema:
+        kept = [_conform(item, schema["items"], f"{path}[{index}]", errors) for index, item in enumerate(value)]
+        return [item for item in kept if item is not _DROP]
+    return value
+
+def conform_to_schema(value: Any, schema: Dict[str, Any]) -> Tuple[Optional[Any], List[str]]:
+    """
+    Drop the parts of a parsed document that do not match schema
+
+    Only the offending parts go: a wrongly-typed field is coerced to a
+    string when text was expected and removed otherwise, while an array
+    element or object is dropped only when it has the wrong type itself or
+    lacks a required property.
+
+    Returns:
+        (value, errors) where errors describes what was changed; value is
+        None when the document root itself does not match
+    """
+    errors: List[str] = []
+    conformed = _conform(value, schema, "$", errors)
+    return (None if conformed is _DROP else conformed), errors
+
+def missing_parts(value: Any, schema: Dict[str, Any], open_depth: int) -> List[str]:
+    """
+    Top-level properties a salvaged document still needs
+
+    Properties that are absent, plus the last property when the document
+    was cut off inside it (open_depth of 2 or more).
+    """
+    if not isinstance(value, dict):
+        return []
+    missing = [key for key in schema.get("properties", {}) if key not in value]
+    if open_depth >= 2 and value:
+        last = next(reversed(value))
+        if isinstance(value[last], list):
+            missing.insert(0, last)
+    return missing
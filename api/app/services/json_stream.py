@@ -0,0 +1,172 @@
+import json
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+# Configure logger
+logger = logging.getLogger(__name__)
+
+# Top-level arrays whose elements are emitted individually, mapped to the event name
+DEFAULT_ARRAY_EVENTS = {
+    "metrics": "metric",
+    "dashboard_recommendations": "dashboard_recommendation",
+}
+
+class IncrementalJSONObjectParser:
+    """
+    Incremental parser for a streamed top-level JSON object
+
+    Text is fed in arbitrary chunks as it arrives from the model. Every
+    character is scanned exactly once; whenever an element of one of the
+    configured top-level arrays, or a top-level scalar value, is complete it
+    is decoded and returned as an (event, value) pair. Anything before the
+    first "{" (such as a code fence) is ignored.
+    """
+
+    def __init__(self, array_events: Optional[Dict[str, str]] = None):
+        """
+        Initialize the parser
+
+        Args:
+            array_events: Mapping of top-level array key to the event name
+                emitted for each of its elements
+        """
+        self.array_events = array_events if array_events is not None else DEFAULT_ARRAY_EVENTS
+        self.buffer = ""
+        self._pos = 0
+        self._started = False
+        self._finished = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_start = -1
+        self._expect_key = False
+        self._current_key: Optional[str] = None
+        self._value_start = -1
+        self._element_start = -1
+        self._end = -1
+
+    @property
+    def finished(self) -> bool:
+        """Whether the top-level object has been closed"""
+        return self._finished
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        """
+        Consume a chunk of streamed text
+
+        Args:
+            chunk: Next piece of model output
+
+        Returns:
+            List of (event, value) pairs completed by this chunk
+        """
+        events: List[Tuple[str, Any]] = []
+        self.buffer += chunk
+        buffer = self.buffer
+
+        for i in range(self._pos, len(buffer)):
+            if self._finished:
+                break
+            ch = buffer[i]
+
+            if not self._started:
+                if ch == "{":
+                    self._started = True
+                    self._depth = 1
+                    self._expect_key = True
+                    self.buffer = buffer = buffer[i:]
+                    return events + self._rescan_from(1)
+                continue
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    self._close_string(i, events)
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                self._string_start = i
+            elif ch in "{[":
+                self._open(ch, i)
+            elif ch in "}]":
+                self._close(ch, i, events)
+            elif self._depth == 1:
+                if ch == ":":
+                    self._expect_key = False
+                    self._value_start = -1
+                elif ch == ",":
+                    self._emit_scalar(i, events)
+                    self._expect_key = True
+                elif not ch.isspace() and self._value_start < 0 and not self._expect_key:
+                    self._value_start = i
+
+        self._pos = len(buffer)
+        return events
+
+    def result(self) -> Any:
+        """Decode the complete buffered object"""
+        return json.loads(self.buffer[: self._end_index()])
+
+    def _rescan_from(self, start: int) -> List[Tuple[str, Any]]:
+        """Continue scanning after re-basing the buffer on the opening brace"""
+        self._pos = start
+        return self.feed("")
+
+    def _end_index(self) -> int:
+        """Index just past the closing brace, or the whole buffer if still open"""
+        return self._end if self._finished else len(self.buffer)
+
+    def _open(self, ch: str, i: int) -> None:
+        """Handle an opening bracket or brace"""
+        if self._depth == 1 and not self._expect_key:
+            self._value_start = i
+        elif self._depth == 2 and self._current_key in self.array_events and ch == "{":
+            self._element_start = i
+        self._depth += 1
+
+    def _close(self, ch: str, i: int, events: List[Tuple[str, Any]]) -> None:
+        """Handle a closing bracket or brace"""
+        self._depth -= 1
+        if self._depth == 2 and self._element_start >= 0:
+            self._emit(self.array_events[self._current_key], self._element_start, i + 1, events)
+            self._element_start = -1
+        elif self._depth == 1:
+            # A nested top-level value has closed; only scalars are emitted whole
+            self._value_start = -1
+        elif self._depth == 0:
+            self._emit_scalar(i, events)
+            self._finished = True
+            self._end = i + 1
+
+    def _close_string(self, i: int, events: List[Tuple[str, Any]]) -> None:
+        """Handle the closing quote of a string"""
+        if self._depth != 1:
+            return
+        if self._expect_key:
+            try:
+                self._current_key = json.loads(self.buffer[self._string_start : i + 1])
+            except json.JSONDecodeError:
+                self._current_key = None
+        elif self._value_start < 0:
+            self._emit(self._current_key, self._string_start, i + 1, events)
+            self._value_start = -2
+
+    def _emit_scalar(self, end: int, events: List[Tuple[str, Any]]) -> None:
+        """Emit a pending non-string top-level scalar (number, true, false, null)"""
+        if self._value_start >= 0 and self._current_key is not None:
+            self._emit(self._current_key, self._value_start, end, events)
+        self._value_start = -1
+
+    def _emit(self, event: Optional[str], start: int, end: int, events: List[Tuple[str, Any]]) -> None:
+        """Decode buffer[start:end] and append it as an event"""
+        if event is None:
+            return
+        try:
+            events.append((event, json.loads(self.buffer[start:end])))
+        except json.JSONDecodeError as e:
+            logger.warning(f"Skipping undecodable streamed value for {event}: {str(e)}")
@@ -0,0 +1,303 @@
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+
+# Configure logger
+logger = logging.getLogger(__name__)
+
+# Fields of CompanyInfo that determine the generated KPI system
+CACHE_KEY_FIELDS = (
+    "product_type",
+    "company_stage",
+    "tech_stack",
+    "industry",
+    "business_model",
+    "strategic_focus",
+    "custom_prompt",
+)
+
+def _normalize_text(value: Any) -> str:
+    """Lower-case a value and collapse runs of whitespace"""
+    if value is None:
+        return ""
+    return " ".join(str(value).split()).lower()
+
+def normalize_company_info(company_info: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Reduce company information to a canonical form for cache keying
+
+    Text fields are compared case- and whitespace-insensitively and
+    strategic_focus is treated as an unordered set.
+
+    Args:
+        company_info: Dictionary containing company information
+
+    Returns:
+        Canonical dictionary suitable for hashing
+    """
+    normalized = {}
+    for field in CACHE_KEY_FIELDS:
+        value = company_info.get(field)
+        if field == "strategic_focus":
+            normalized[field] = sorted({_normalize_text(v) for v in (value or []) if _normalize_text(v)})
+        else:
+            normalized[field] = _normalize_text(value)
+    return normalized
+
+def make_cache_key(
+    company_info: Dict[str, Any],
+    output_format: str,
+    deployment: str,
+    prompt_version: str
+) -> str:
+    """
+    Build a content-addressed cache key for a KPI system request
+
+    Args:
+        company_info: Dictionary containing company information
+        output_format: "structured" or "markdown"
+        deployment: Azure deployment the result was generated with
+        prompt_version: Version of the KPI prompt template
+
+    Returns:
+        Hex SHA-256 digest identifying the request
+    """
+    payload = {
+        "company_info": normalize_company_info(company_info),
+        "output_format": output_format,
+        "deployment": deployment,
+        "prompt_version": prompt_version,
+    }
+    encoded = json.dumps(payload, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+class KPICache:
+    """
+    Two-tier cache for generated KPI systems
+
+    The first tier is an in-memory LRU with a per-entry TTL. When a path is
+    configured, entries are also written to a SQLite file so that they
+    survive restarts and are shared by workers on the same host. The async
+    methods run lookups and writes that touch that file on a worker thread.
+
+    Expired entries stay in memory until evicted, and evicted entries move
+    to a stale tier of the same size, so get_stale can still serve them
+    while the upstream is down even without the SQLite tier.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 256,
+        ttl_seconds: float = 86400,
+        path: Optional[str] = None
+    ):
+        """
+        Initialize the cache
+
+        Args:
+            max_entries: Maximum number of entries held in memory
+            ttl_seconds: Lifetime of an entry in seconds
+            path: Optional SQLite file for the persistent tier
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.path = path
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._stale: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if path:
+            self._db = self._open_db(path)
+
+    def _open_db(self, path: str) -> Optional[sqlite3.Connection]:
+        """Open the SQLite tier, returning None if it cannot be used"""
+        try:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS kpi_cache ("
+                "key TEXT PRIMARY KEY, expires_at REAL NOT NULL, value TEXT NOT NULL)"
+            )
+            return db
+        except sqlite3.Error as e:
+            logger.error(f"Failed to open KPI cache database at {path}: {str(e)}")
+            return None
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Look up a cached result
+
+        Args:
+            key: Cache key from make_cache_key
+
+        Returns:
+            The cached result, or None on a miss or expired entry
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+
+            value = self._disk_get(key, now)
+            if value is not None:
+                self._remember(key, value[0], value[1])
+                self.disk_hits += 1
+                return value[1]
+
+            self.misses += 1
+            return None
+
+    def get_stale(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Look up an entry even if it has expired
+
+        Used to serve a degraded answer when the upstream is unavailable;
+        does not count towards the hit/miss statistics.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                return entry[1]
+            if key in self._stale:
+                return self._stale[key]
+            if self._db is None:
+                return None
+            try:
+                row = self._db.execute("SELECT value FROM kpi_cache WHERE key = ?", (key,)).fetchone()
+            except sqlite3.Error as e:
+                logger.error(f"Failed to read KPI cache entry: {str(e)}")
+                return None
+        return json.loads(row[0]) if row is not None else None
+
+    def set(self, key: str, value: Dict[str, Any]) -> None:
+        """
+        Store a result in every configured tier
+
+        Args:
+            key: Cache key from make_cache_key
+            value: Result dictionary to cache
+        """
+        expires_at = time.time() + self.ttl_seconds
+        with self._lock:
+            self._remember(key, expires_at, value)
+            if self._db is not None:
+                try:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO kpi_cache (key, expires_at, value) VALUES (?, ?, ?)",
+                        (key, expires_at, json.dumps(value)),
+                    )
+                except sqlite3.Error as e:
+                    logger.error(f"Failed to persist KPI cache entry: {str(e)}")
+
+    def invalidate(self, key: str) -> None:
+        """Remove a single entry from every tier"""
+        with self._lock:
+            self._entries.pop(key, None)
+            self._stale.pop(key, None)
+            if self._db is not None:
+                try:
+                    self._db.execute("DELETE FROM kpi_cache WHERE key = ?", (key,))
+                except sqlite3.Error as e:
+                    logger.error(f"Failed to delete KPI cache entry: {str(e)}")
+
+    def clear(self) -> None:
+        """Remove all entries from every tier"""
+        with self._lock:
+            self._entries.clear()
+            self._stale.clear()
+            if self._db is not None:
+                try:
+                    self._db.execute("DELETE FROM kpi_cache")
+                except sqlite3.Error as e:
+                    logger.error(f"Failed to clear KPI cache: {str(e)}")
+
+    async def aget(self, key: str) -> Optional[Dict[str, Any]]:
+        """Async variant of get"""
+        if self._db is None:
+            return self.get(key)
+        return await asyncio.to_thread(self.get, key)
+
+    async def aget_stale(self, key: str) -> Optional[Dict[str, Any]]:
+        """Async variant of get_stale"""
+        if self._db is None:
+            return self.get_stale(key)
+        return await asyncio.to_thread(self.get_stale, key)
+
+    async def aset(self, key: str, value: Dict[str, Any]) -> None:
+        """Async variant of set"""
+        if self._db is None:
+            self.set(key, value)
+        else:
+            await asyncio.to_thread(self.set, key, value)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters and current size"""
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "persistent": self._db is not None,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_ratio": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            }
+
+    def _remember(self, key: str, expires_at: float, value: Dict[str, Any]) -> None:
+        """Insert into the memory tier and evict the least recently used entries"""
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        self._stale.pop(key, None)
+        while len(self._entries) > self.max_entries:
+            evicted, (_, old_value) = self._entries.popitem(last=False)
+            self._stale[evicted] = old_value
+        while len(self._stale) > self.max_entries:
+            self._stale.popitem(last=False)
+
+    def _disk_get(self, key: str, now: float) -> Optional[Tuple[float, Dict[str, Any]]]:
+        """Read an unexpired entry from the SQLite tier"""
+        if self._db is None:
+            return None
+        try:
+            row = self._db.execute(
+                "SELECT expires_at, value FROM kpi_cache WHERE key = ? AND expires_at > ?",
+                (key, now),
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.error(f"Failed to read KPI cache entry: {str(e)}")
+            return None
+        if row is None:
+            return None
+        return row[0], json.loads(row[1])
+
+# Create a singleton instance
+kpi_cache = KPICache(
+    max_entries=int(os.getenv("KPI_CACHE_MAX_ENTRIES", "256")),
+    ttl_seconds=float(os.getenv("KPI_CACHE_TTL_SECONDS", "86400")),
+    path=os.getenv("KPI_CACHE_PATH") or None
+)
+
+def get_kpi_cache() -> KPICache:
+    """Get the KPI cache instance"""
+    return kpi_cache
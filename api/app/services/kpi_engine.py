@@ -0,0 +1,486 @@
+import logging
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Configure logger
+logger = logging.getLogger(__name__)
+
+PERIODS = ("day", "week", "month", "quarter", "year")
+
+# Average days per month, used to convert churn between period lengths
+DAYS_PER_MONTH = 365.2425 / 12
+
+# Metric -> tables it is computed from
+METRIC_TABLES = {
+    "mrr": ("subscriptions",),
+    "active_subscriptions": ("subscriptions",),
+    "new_customers": ("subscriptions",),
+    "churn_rate": ("subscriptions",),
+    "arpu": ("subscriptions",),
+    "ltv": ("subscriptions",),
+    "cac": ("subscriptions", "marketing_spend"),
+    "revenue": ("transactions",),
+    "orders": ("transactions",),
+    "aov": ("transactions",),
+    "active_users": ("events",),
+    "conversion_rate": ("events",),
+    "dau_mau": ("events",),
+}
+
+# Columns each table must provide
+REQUIRED_COLUMNS = {
+    "subscriptions": ("customer_id", "amount", "start"),
+    "transactions": ("amount", "timestamp"),
+    "events": ("user_id", "timestamp"),
+    "marketing_spend": ("amount", "timestamp"),
+}
+
+# Multipliers that turn a subscription amount into a monthly amount
+BILLING_INTERVALS = {"month": 1.0, "monthly": 1.0, "year": 1 / 12, "yearly": 1 / 12, "annual": 1 / 12,
+                     "quarter": 1 / 3, "quarterly": 1 / 3, "week": 52 / 12, "weekly": 52 / 12}
+
+# Epoch seconds standing in for a missing timestamp (what NaT converts to)
+NAT = np.iinfo(np.int64).min
+
+class KPIComputeError(ValueError):
+    """Raised when the input tables cannot produce the requested metrics"""
+
+def to_seconds(values: Any) -> np.ndarray:
+    """
+    Convert a timestamp column to int64 epoch seconds
+
+    Accepts ISO 8601 strings, epoch seconds (as numbers or text), columns
+    mixing the two, or datetime64 arrays. Missing values (None, "" or NaT)
+    become NAT.
+    """
+    array = np.asarray(values)
+    if array.dtype.kind == "M":
+        return array.astype("datetime64[s]").astype(np.int64)
+    if array.dtype.kind in "iu":
+        return array.astype(np.int64)
+    if array.dtype.kind == "f":
+        seconds = np.where(np.isnan(array), NAT, array)
+        return seconds.astype(np.int64)
+    if array.dtype.kind == "O":
+        array = np.where(array == None, "NaT", array).astype(str)  # noqa: E711 - elementwise comparison
+    array = np.where(array == "", "NaT", array).astype(str)
+    try:
+        # Epoch seconds given as text (CSV) or mixed with nulls (JSON)
+        return to_seconds(np.where(array == "NaT", "nan", array).astype(float))
+    except ValueError:
+        pass
+
+    # Mixed column: values with no "-" after the sign are epoch seconds, the
+    # rest ISO 8601 (datetime64 would read "1706745600" as a year)
+    numeric = (np.char.find(array, "-", 1) == -1) & (array != "NaT")
+    seconds = np.empty(array.shape, dtype=np.int64)
+    try:
+        seconds[numeric] = to_seconds(array[numeric].astype(float))
+        # Strip a trailing Z, which datetime64 does not accept
+        seconds[~numeric] = np.char.rstrip(array[~numeric], "Z").astype("datetime64[s]").astype(np.int64)
+    except ValueError as e:
+        raise KPIComputeError(f"Invalid timestamp: {str(e)}")
+    return seconds
+
+def period_edges(start: np.datetime64, end: np.datetime64, period: str) -> np.ndarray:
+    """
+    Boundaries of the calendar periods covering [start, end], as datetime64[s]
+
+    Returns one more edge than there are periods; weeks start on Monday.
+    """
+    if period not in PERIODS:
+        raise KPIComputeError(f"Unknown period {period!r}; expected one of {', '.join(PERIODS)}")
+    if period == "week":
+        # datetime64 weeks start on Thursday (the epoch); shift to Monday
+        monday = np.datetime64("1970-01-05")
+        first = monday + ((start.astype("datetime64[D]") - monday) // 7) * 7
+        last = monday + ((end.astype("datetime64[D]") - monday) // 7) * 7
+        edges = np.arange(first, last + 8, 7, dtype="datetime64[D]")
+    elif period == "quarter":
+        first = start.astype("datetime64[M]")
+        first = first - (first.astype(np.int64) % 3)
+        last = end.astype("datetime64[M]")
+        last = last - (last.astype(np.int64) % 3)
+        edges = np.arange(first, last + 4, 3, dtype="datetime64[M]")
+    else:
+        unit = {"day": "D", "month": "M", "year": "Y"}[period]
+        edges = np.arange(start.astype(f"datetime64[{unit}]"), end.astype(f"datetime64[{unit}]") + 2, dtype=f"datetime64[{unit}]")
+    return edges.astype("datetime64[s]")
+
+def bucket(seconds: np.ndarray, edges: np.ndarray) -> np.ndarray:
+    """Period index of each timestamp; -1 for timestamps outside the edges or missing"""
+    index = np.searchsorted(edges, seconds, side="right") - 1
+    index[(seconds < edges[0]) | (seconds >= edges[-1])] = -1
+    return index
+
+def sum_by(index: np.ndarray, weights: Optional[np.ndarray], periods: int) -> np.ndarray:
+    """Sum weights (or count rows) per period index, ignoring -1"""
+    valid = index >= 0
+    return np.bincount(index[valid], weights=None if weights is None else weights[valid], minlength=periods)[:periods].astype(float)
+
+def distinct_by(index: np.ndarray, ids: np.ndarray, periods: int) -> np.ndarray:
+    """Number of distinct ids per period index, ignoring -1"""
+    valid = index >= 0
+    if not valid.any():
+        return np.zeros(periods)
+    pairs = np.unique(index[valid].astype(np.int64) * (int(ids.max()) + 1) + ids[valid])
+    return np.bincount(pairs // (int(ids.max()) + 1), minlength=periods)[:periods].astype(float)
+
+def cumulative_at(times: np.ndarray, weights: Optional[np.ndarray], at: np.ndarray) -> np.ndarray:
+    """
+    Sum of weights (or count) of the rows with time <= each point of at
+
+    at must be sorted. Each row is only located among the len(at) points,
+    so this is O(n log k) with no sort of the rows.
+    """
+    index = np.searchsorted(at, times, side="left")
+    return np.cumsum(np.bincount(index, weights=weights, minlength=len(at) + 1)[:len(at)]).astype(float)
+
+def safe_divide(numerator: np.ndarray, denominator: np.ndarray) -> np.ndarray:
+    """Elementwise ratio with NaN where the denominator is zero"""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(denominator != 0, numerator / np.where(denominator != 0, denominator, 1), np.nan)
+
+def encode_ids(values: Any) -> np.ndarray:
+    """Small non-negative int64 codes for an id column of any type"""
+    array = np.asarray(values)
+    if array.dtype.kind in "iu" and array.size:
+        low, high = int(array.min()), int(array.max())
+        if high - low < 4 * array.size:
+            # Compact integer ids are codes already; skip the sort in unique
+            return array.astype(np.int64) - low
+    if array.dtype.kind not in "iub":
+        array = array.astype(str)
+    _, codes = np.unique(array, return_inverse=True)
+    return codes.reshape(-1).astype(np.int64)
+
+class KPIEngine:
+    """
+    Column-oriented calculator for the standard metric catalog
+
+    Tables are mappings of column name to an array (or list) of values.
+    Every metric is computed with whole-column NumPy operations: timestamps
+    are bucketed into calendar periods with searchsorted, sums and counts
+    per period come from bincount, distinct counts from unique on combined
+    (period, id) keys, and point-in-time levels such as MRR from cumulative
+    sums of starts and ends located among the period boundaries.
+
+    Subscription metrics are subscription-level: churn_rate is the share
+    of subscriptions active at the start of a period that ended during it,
+    and arpu is MRR per active subscription.
+    """
+
+    def __init__(self, tables: Mapping[str, Mapping[str, Any]]):
+        self.tables = tables
+        self._columns: Dict[Tuple[str, str], np.ndarray] = {}
+
+    def column(self, table: str, name: str, kind: str = "raw") -> np.ndarray:
+        """
+        A column as an array: kind is "raw", "time" (epoch seconds), "float" or "id" (dense codes)
+
+        Raises:
+            KPIComputeError: If a time or float column holds values of another type
+        """
+        key = (table, f"{name}:{kind}")
+        if key not in self._columns:
+            values = self.tables[table][name]
+            if kind == "time":
+                array = to_seconds(values)
+            elif kind == "float":
+                try:
+                    array = np.asarray(values, dtype=float)
+                except (TypeError, ValueError) as e:
+                    raise KPIComputeError(f"Column {name}: {str(e)}")
+            elif kind == "id":
+                array = encode_ids(values)
+            else:
+                array = np.asarray(values)
+            self._columns[key] = array
+        return self._columns[key]
+
+    def has(self, table: str, name: str) -> bool:
+        return table in self.tables and name in self.tables[table]
+
+    def validate(self, metrics: Sequence[str]) -> None:
+        """
+        Check that the tables needed by metrics are present and consistent
+
+        Raises:
+            KPIComputeError: If a metric is unknown or its inputs are missing
+        """
+        for metric in metrics:
+            if metric not in METRIC_TABLES:
+                raise KPIComputeError(f"Unknown metric {metric!r}; expected one of {', '.join(METRIC_TABLES)}")
+            for table in METRIC_TABLES[metric]:
+                if table not in self.tables:
+                    raise KPIComputeError(f"Metric {metric} needs the {table} table")
+                missing = [c for c in REQUIRED_COLUMNS[table] if c not in self.tables[table]]
+                if missing:
+                    raise KPIComputeError(f"Table {table} is missing columns: {', '.join(missing)}")
+                lengths = {len(values) for values in self.tables[table].values()}
+                if len(lengths) > 1:
+                    raise KPIComputeError(f"Columns of table {table} have different lengths")
+
+    def time_range(self, metrics: Sequence[str]) -> Tuple[np.datetime64, np.datetime64]:
+        """Earliest and latest timestamp across the tables the metrics use"""
+        lows, highs = [], []
+        for table in {t for metric in metrics for t in METRIC_TABLES[metric]}:
+            for name in ("start", "timestamp"):
+                if self.has(table, name):
+                    seconds = self.column(table, name, "time")
+                    seconds = seconds[seconds != NAT]
+                    if seconds.size:
+                        lows.append(seconds.min())
+                        highs.append(seconds.max())
+        if not lows:
+            raise KPIComputeError("The input tables contain no timestamps")
+        return np.datetime64(int(min(lows)), "s"), np.datetime64(int(max(highs)), "s")
+
+    def compute(
+        self,
+        metrics: Sequence[str],
+        period: str = "month",
+        start: Optional[np.datetime64] = None,
+        end: Optional[np.datetime64] = None,
+        conversion_event: str = "purchase"
+    ) -> Dict[str, Any]:
+        """
+        Compute metrics per period
+
+        Args:
+            metrics: Names from METRIC_TABLES
+            period: Calendar period to group by
+            start: First instant to cover (defaults to the earliest timestamp)
+            end: Last instant to cover (defaults to the latest timestamp)
+            conversion_event: Event name counted by conversion_rate
+
+        Returns:
+            {"periods": period start dates, "metrics": {name: values}} with
+            NaN where a metric is undefined (e.g. a ratio over zero)
+
+        Raises:
+            KPIComputeError: If the inputs cannot produce the metrics
+        """
+        metrics = list(dict.fromkeys(metrics))
+        self.validate(metrics)
+        if start is None or end is None:
+            low, high = self.time_range(metrics)
+            start = low if start is None else start
+            end = high if end is None else end
+        if end < start:
+            raise KPIComputeError("end is before start")
+
+        edges = period_edges(np.datetime64(start, "s"), np.datetime64(end, "s"), period)
+        context = _Context(self, edges, period, conversion_event)
+        values = {metric: getattr(context, metric)() for metric in metrics}
+        return {"periods": edges[:-1], "metrics": values}
+
+class _Context:
+    """Per-call state shared by the metric kernels, so common intermediates are computed once"""
+
+    def __init__(self, engine: KPIEngine, edges: np.ndarray, period: str, conversion_event: str):
+        self.engine = engine
+        self.edges = edges
+        self.seconds = edges.astype(np.int64)
+        self.periods = len(edges) - 1
+        self.period = period
+        self.conversion_event = conversion_event
+        self._cache: Dict[str, np.ndarray] = {}
+
+    def _cached(self, name: str, build) -> np.ndarray:
+        if name not in self._cache:
+            self._cache[name] = build()
+        return self._cache[name]
+
+    # Subscriptions
+
+    def _subscription_times(self) -> Tuple[np.ndarray, np.ndarray]:
+        """(start, end) seconds; subscriptions without an end never end"""
+        def build():
+            engine = self.engine
+            starts = engine.column("subscriptions", "start", "time")
+            if engine.has("subscriptions", "end"):
+                ends = engine.column("subscriptions", "end", "time").copy()
+                ends[ends == NAT] = np.iinfo(np.int64).max
+            else:
+                ends = np.full(starts.shape, np.iinfo(np.int64).max)
+            return np.stack([starts, ends])
+        times = self._cached("subscription_times", build)
+        return times[0], times[1]
+
+    def _monthly_amount(self) -> np.ndarray:
+        def build():
+            engine = self.engine
+            amount = engine.column("subscriptions", "amount", "float")
+            if not engine.has("subscriptions", "interval"):
+                return amount
+            intervals = np.char.lower(engine.column("subscriptions", "interval").astype(str))
+            factor = np.ones(amount.shape)
+            for name, multiplier in BILLING_INTERVALS.items():
+                factor[intervals == name] = multiplier
+            return amount * factor
+        return self._cached("monthly_amount", build)
+
+    def _active_level(self, weights: Optional[np.ndarray], at: np.ndarray) -> np.ndarray:
+        """Sum of weights (or count) of subscriptions active at each of the (sorted) times at"""
+        starts, ends = self._subscription_times()
+        if weights is not None:
+            weights = np.where(starts != NAT, weights, 0.0)
+        else:
+            weights = (starts != NAT).astype(float)
+        # A subscription is active at t when start <= t < end
+        return cumulative_at(starts, weights, at) - cumulative_at(ends, weights, at)
+    
+    def _closing_level(self, weights: Optional[np.ndarray]) -> np.ndarray:
+        """Active level at the last second of each period"""
+        return self._active_level(weights, self.seconds[1:] - 1)
+
+    def mrr(self) -> np.ndarray:
+        """Monthly recurring revenue at the end of each period"""
+        return self._cached("mrr", lambda: self._closing_level(self._monthly_amount()))
+
+    def active_subscriptions(self) -> np.ndarray:
+        """Active subscriptions at the end of each period"""
+        return self._cached("active", lambda: self._closing_level(None))
+
+    def new_customers(self) -> np.ndarray:
+        """Customers whose first subscription started in the period"""
+        def build():
+            starts, _ = self._subscription_times()
+            customers = self.engine.column("subscriptions", "customer_id", "id")
+            first = np.full(int(customers.max()) + 1 if customers.size else 0, np.iinfo(np.int64).max)
+            np.minimum.at(first, customers, np.where(starts == NAT, np.iinfo(np.int64).max, starts))
+            return sum_by(bucket(first, self.seconds), None, self.periods)
+        return self._cached("new_customers", build)
+
+    def churn_rate(self) -> np.ndarray:
+        """Subscriptions ended during the period / subscriptions active at its start"""
+        def build():
+            starts, ends = self._subscription_times()
+            # Only subscriptions that were active at the start of their end period count as churned
+            index = bucket(ends, self.seconds)
+            counted = index >= 0
+            counted[counted] = starts[counted] <= self.seconds[index[counted]]
+            churned = sum_by(np.where(counted, index, -1), None, self.periods)
+            return safe_divide(churned, self._active_level(None, self.seconds[:-1]))
+        return self._cached("churn_rate", build)
+
+    def arpu(self) -> np.ndarray:
+        """MRR per active subscription at the end of the period"""
+        return safe_divide(self.mrr(), self.active_subscriptions())
+
+    def ltv(self) -> np.ndarray:
+        """ARPU / monthly churn rate (churn is converted to a monthly rate first)"""
+        days = np.diff(self.seconds) / 86400
+        monthly_churn = 1 - np.power(1 - self.churn_rate(), DAYS_PER_MONTH / days)
+        return safe_divide(self.arpu(), monthly_churn)
+
+    def cac(self) -> np.ndarray:
+        """Marketing spend in the period / new customers in the period"""
+        engine = self.engine
+        index = bucket(engine.column("marketing_spend", "timestamp", "time"), self.seconds)
+        spend = sum_by(index, engine.column("marketing_spend", "amount", "float"), self.periods)
+        return safe_divide(spend, self.new_customers())
+
+    # Transactions
+
+    def _transaction_index(self) -> np.ndarray:
+        return self._cached(
+            "transaction_index",
+            lambda: bucket(self.engine.column("transactions", "timestamp", "time"), self.seconds)
+        )
+
+    def revenue(self) -> np.ndarray:
+        """Sum of transaction amounts in the period"""
+        return self._cached("revenue", lambda: sum_by(
+            self._transaction_index(), self.engine.column("transactions", "amount", "float"), self.periods
+        ))
+
+    def orders(self) -> np.ndarray:
+        """Number of transactions in the period"""
+        return self._cached("orders", lambda: sum_by(self._transaction_index(), None, self.periods))
+
+    def aov(self) -> np.ndarray:
+        """Average order value: revenue / orders"""
+        return safe_divide(self.revenue(), self.orders())
+
+    # Events
+
+    def _event_index(self) -> np.ndarray:
+        return self._cached(
+            "event_index",
+            lambda: bucket(self.engine.column("events", "timestamp", "time"), self.seconds)
+        )
+
+    def active_users(self) -> np.ndarray:
+        """Distinct users with any event in the period"""
+        return self._cached("active_users", lambda: distinct_by(
+            self._event_index(), self.engine.column("events", "user_id", "id"), self.periods
+        ))
+
+    def conversion_rate(self) -> np.ndarray:
+        """Distinct users with the conversion event / distinct active users"""
+        engine = self.engine
+        if not engine.has("events", "event"):
+            raise KPIComputeError("conversion_rate needs an event column in the events table")
+        converted = engine.column("events", "event").astype(str) == self.conversion_event
+        index = np.where(converted, self._event_index(), -1)
+        users = distinct_by(index, engine.column("events", "user_id", "id"), self.periods)
+        return safe_divide(users, self.active_users())
+
+    def dau_mau(self) -> np.ndarray:
+        """Average daily active users over the period / active users in the period"""
+        seconds = self.engine.column("events", "timestamp", "time")
+        users = self.engine.column("events", "user_id", "id")
+        period_index = self._event_index()
+        day = np.where(period_index >= 0, (seconds - self.seconds[0]) // 86400, -1)
+        days = int((self.seconds[-1] - self.seconds[0]) // 86400) + 1
+        daily = distinct_by(day, users, days)
+        # Attribute each day's count to the period containing that day
+        day_starts = self.seconds[0] + np.arange(days) * 86400
+        day_period = bucket(day_starts, self.seconds)
+        daily_sum = sum_by(day_period, daily, self.periods)
+        days_in_period = np.diff(self.seconds) / 86400
+        return safe_divide(daily_sum / days_in_period, self.active_users())
+
+def compute_kpis(
+    tables: Mapping[str, Mapping[str, Any]],
+    metrics: Sequence[str],
+    period: str = "month",
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    conversion_event: str = "purchase"
+) -> Dict[str, Any]:
+    """
+    Compute metrics over columnar tables and return JSON-ready lists
+
+    Args:
+        tables: Table name -> column name -> values
+        metrics: Names from METRIC_TABLES
+        period: One of PERIODS
+        start: ISO date or timestamp of the first instant to cover
+        end: ISO date or timestamp of the last instant to cover
+        conversion_event: Event name counted by conversion_rate
+
+    Returns:
+        {"period": ..., "periods": [ISO dates], "metrics": {name: [float or None]}}
+
+    Raises:
+        KPIComputeError: If the inputs cannot produce the metrics
+    """
+    try:
+        bounds = [np.datetime64(value, "s") if value else None for value in (start, end)]
+    except ValueError as e:
+        raise KPIComputeError(f"Invalid start or end: {str(e)}")
+    result = KPIEngine(tables).compute(metrics, period, bounds[0], bounds[1], conversion_event)
+    return {
+        "period": period,
+        "periods": [str(day) for day in result["periods"].astype("datetime64[D]")],
+        "metrics": {name: json_floats(values) for name, values in result["metrics"].items()},
+    }
+
+def json_floats(values: np.ndarray) -> List[Optional[float]]:
+    """Floats with NaN and infinities replaced by None"""
+    values = np.asarray(values, dtype=float)
+    return [None if not np.isfinite(value) else value for value in values.tolist()]
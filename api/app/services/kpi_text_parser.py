@@ -0,0 +1,199 @@
+import re
+import logging
+from typing import Any, Dict, List, Optional
+
+# Configure logger
+logger = logging.getLogger(__name__)
+
+# Section headings the legacy KPI prompt asks for, mapped to the field they fill
+SECTIONS = {
+    "METRICS": "metrics",
+    "SQL QUERIES": "sql",
+    "SQL QUERY": "sql",
+    "DASHBOARD VISUALIZATION": "visualization",
+    "DASHBOARD VISUALIZATIONS": "visualization",
+    "VISUALIZATIONS": "visualization",
+    "BENCHMARKS": "benchmark",
+    "BENCHMARKS AND TARGETS": "benchmark",
+}
+
+CATEGORIES = ("ACQUISITION", "ACTIVATION", "RETENTION", "REVENUE", "REFERRAL", "ENGAGEMENT")
+
+# Labels of per-metric fields inside the METRICS section
+FIELD_LABELS = {
+    "description": "description",
+    "definition": "description",
+    "calculation": "calculation",
+    "calculation formula": "calculation",
+    "formula": "calculation",
+    "why it matters": "importance",
+    "importance": "importance",
+    "why it's important": "importance",
+    "sql": "sql",
+    "sql query": "sql",
+    "visualization": "visualization",
+    "benchmark": "benchmark",
+    "benchmarks": "benchmark",
+    "target": "benchmark",
+    # Generic labels that continue whatever the current section fills
+    "explanation": "",
+    "type": "",
+    "chart": "",
+    "chart type": "",
+    "query": "",
+}
+
+METRIC_FIELDS = ("name", "category", "description", "calculation", "importance", "sql", "visualization", "benchmark")
+
+_HEADING_MARKUP = re.compile(r"^[#*_\s]*(?:\d+[.)]\s*)?[*_\s]*|[*_:\s]+$")
+_ITEM = re.compile(
+    r"^(?P<indent>\s*)(?:#{1,6}\s*|(?:\d+[.)]|[-*•])\s+|(?=\*\*|__))(?:\*\*|__)?(?P<label>[^*_:]+?)(?:\*\*|__)?\s*(?::(?:\*\*)?\s*(?P<rest>.*))?$"
+)
+_PARENTHETICAL = re.compile(r"\s*\(([^)]*)\)\s*")
+
+def _name_keys(name: str) -> List[str]:
+    """Keys a metric can be referred to by, e.g. "Customer Acquisition Cost (CAC)" -> full name, base name, CAC"""
+    keys = [name.lower().strip()]
+    base = _PARENTHETICAL.sub(" ", name).strip().lower()
+    if base and base not in keys:
+        keys.append(base)
+    for alias in _PARENTHETICAL.findall(name):
+        alias = alias.strip().lower()
+        if alias and alias not in keys:
+            keys.append(alias)
+    return keys
+
+class KPISectionParser:
+    """
+    Single-pass parser for the sectioned text the legacy KPI prompt produces
+
+    Text can be fed in arbitrary chunks (for example straight from a
+    streaming response); each line is examined exactly once. The METRICS
+    section creates one record per metric, and the SQL QUERIES, DASHBOARD
+    VISUALIZATION and BENCHMARKS sections attach to those records by name or
+    abbreviation.
+    """
+
+    def __init__(self):
+        self._pending = ""
+        self._section: Optional[str] = None
+        self._category: Optional[str] = None
+        self._metrics: List[Dict[str, List[str]]] = []
+        self._index: Dict[str, Dict[str, List[str]]] = {}
+        self._current: Optional[Dict[str, List[str]]] = None
+        self._field: Optional[str] = None
+        self._item_indent = 0
+        self._in_code = False
+        self._closed = False
+
+    def feed(self, chunk: str) -> None:
+        """Consume the next piece of text"""
+        text = self._pending + chunk
+        lines = text.split("\n")
+        self._pending = lines.pop()
+        for line in lines:
+            self._line(line)
+
+    def close(self) -> List[Dict[str, Any]]:
+        """Finish parsing and return one record per metric"""
+        if not self._closed:
+            if self._pending:
+                self._line(self._pending)
+                self._pending = ""
+            self._closed = True
+        return [
+            {field: " ".join(metric[field]).strip() if field != "sql" else "\n".join(metric[field]).strip()
+             for field in METRIC_FIELDS}
+            for metric in self._metrics
+        ]
+
+    def _metric(self, name: str) -> Dict[str, List[str]]:
+        """Look up a metric by any of its names, creating it if unknown"""
+        keys = _name_keys(name)
+        for key in keys:
+            metric = self._index.get(key)
+            if metric is not None:
+                return metric
+        metric = {field: [] for field in METRIC_FIELDS}
+        metric["name"].append(name.strip())
+        if self._category:
+            metric["category"].append(self._category)
+        self._metrics.append(metric)
+        for key in keys:
+            self._index.setdefault(key, metric)
+        return metric
+
+    def _field_for(self, label: str) -> Optional[str]:
+        """Metric field a "Label:" refers to, or None if it is not a field label"""
+        field = FIELD_LABELS.get(label.lower())
+        if field == "":
+            return self._section if self._section != "metrics" else "description"
+        return field
+
+    def _line(self, line: str) -> None:
+        stripped = line.strip()
+
+        if stripped.startswith("```"):
+            self._in_code = not self._in_code
+            if self._current is not None and self._section == "sql":
+                self._field = "sql"
+            return
+        if self._in_code:
+            if self._current is not None and self._field == "sql":
+                self._current["sql"].append(line.rstrip())
+            return
+        if not stripped:
+            return
+
+        heading = _HEADING_MARKUP.sub("", stripped).upper()
+        if heading in SECTIONS:
+            self._section = SECTIONS[heading]
+            self._current = None
+            self._field = None
+            return
+
+        if self._section == "metrics" and len(heading) < 60 and "METRIC" in heading:
+            category = next((c for c in CATEGORIES if heading.startswith(c)), None)
+            if category:
+                self._category = category.title()
+                self._current = None
+                self._field = None
+                return
+
+        match = _ITEM.match(line)
+        if match:
+            label = match.group("label").strip()
+            rest = (match.group("rest") or "").strip()
+            field = self._field_for(label)
+            if field is not None and self._current is not None:
+                self._field = field
+                if rest:
+                    self._current[field].append(rest)
+                return
+            nested = len(match.group("indent")) > self._item_indent
+            if self._current is not None and nested:
+                self._current[self._field or "description"].append(stripped.lstrip("-*• "))
+                return
+            if self._section is not None:
+                self._current = self._metric(label)
+                self._item_indent = len(match.group("indent"))
+                self._field = None if self._section == "metrics" else self._section
+                if rest:
+                    self._current[self._field or "description"].append(rest)
+                return
+
+        # Free-standing "Label: value" lines and continuations of the previous field
+        label, colon, rest = stripped.partition(":")
+        field = self._field_for(label.strip("*_ ")) if colon else None
+        if field is not None and self._current is not None:
+            self._field = field
+            if rest.strip(" *_"):
+                self._current[field].append(rest.strip(" *_"))
+        elif self._current is not None:
+            self._current[self._field or "description"].append(stripped)
+
+def parse_kpi_sections(text: str) -> List[Dict[str, Any]]:
+    """Parse a complete legacy KPI response into per-metric records"""
+    parser = KPISectionParser()
+    parser.feed(text)
+    return parser.close()
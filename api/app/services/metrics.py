@@ -0,0 +1,292 @@
+import time
+import bisect
+import logging
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Configure logger
+logger = logging.getLogger(__name__)
+
+# Latency buckets in seconds: sub-millisecond cache hits up to minute-long generations
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 40.0, 60.0)
+
+def _escape(value: Any) -> str:
+    """Escape a label value"""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    """Render a Prometheus label set"""
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    """Render a sample value"""
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+class _Metric:
+    """Base class for labelled metrics"""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+class Counter(_Metric):
+    """Monotonically increasing value per label set"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+            for labels, value in items
+        ]
+
+class Gauge(Counter):
+    """Value per label set that can go up and down"""
+
+    kind = "gauge"
+
+    def dec(self, *labels: str, amount: float = 1.0) -> None:
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels: str, value: float) -> None:
+        with self._lock:
+            self._values[labels] = value
+
+class Histogram(_Metric):
+    """Cumulative-bucket histogram per label set"""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [bucket counts..., +Inf count], sum
+        self._values: Dict[Tuple[str, ...], List[Any]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = [[0] * (len(self.buckets) + 1), 0.0]
+                self._values[labels] = entry
+            entry[0][index] += 1
+            entry[1] += value
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = [(labels, list(counts), total) for labels, (counts, total) in self._values.items()]
+        lines = self.header()
+        for labels, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+class MetricsRegistry:
+    """
+    Minimal Prometheus registry
+
+    Holds metrics updated on the hot path plus collector callbacks that are
+    only evaluated when /metrics is scraped, so components that already keep
+    their own counters (caches, queues, limiters) are not instrumented twice.
+    """
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], Iterable[Tuple[str, str, str, Dict[str, str], float]]]] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def add_collector(
+        self,
+        collector: Callable[[], Iterable[Tuple[str, str, str, Dict[str, str], float]]]
+    ) -> None:
+        """
+        Register a scrape-time collector
+
+        The callable yields (name, kind, documentation, labels, value) samples.
+        """
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        """Render every metric in the Prometheus text exposition format"""
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+
+        seen = set()
+        for collector in self._collectors:
+            try:
+                samples = list(collector())
+            except Exception as e:
+                logger.error(f"Metrics collector failed: {str(e)}")
+                continue
+            for name, kind, documentation, labels, value in samples:
+                if name not in seen:
+                    seen.add(name)
+                    lines.append(f"# HELP {name} {documentation}")
+                    lines.append(f"# TYPE {name} {kind}")
+                lines.append(f"{name}{_format_labels(list(labels), list(labels.values()))} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+registry = MetricsRegistry()
+
+http_requests = registry.counter(
+    "metrically_http_requests_total", "HTTP requests by route and status", ("method", "route", "status")
+)
+http_request_duration = registry.histogram(
+    "metrically_http_request_duration_seconds", "HTTP request latency by route", ("method", "route")
+)
+http_in_flight = registry.gauge(
+    "metrically_http_requests_in_flight", "HTTP requests currently being handled"
+)
+upstream_duration = registry.histogram(
+    "metrically_azure_openai_request_duration_seconds",
+    "Azure OpenAI call latency by deployment and operation",
+    ("deployment", "operation", "outcome")
+)
+upstream_in_flight = registry.gauge(
+    "metrically_azure_openai_requests_in_flight", "Azure OpenAI calls currently in flight", ("deployment",)
+)
+upstream_tokens = registry.counter(
+    "metrically_azure_openai_tokens_total",
+    "Tokens reported by Azure OpenAI usage blocks",
+    ("deployment", "operation", "type")
+)
+upstream_retries = registry.counter(
+    "metrically_azure_openai_retries_total",
+    "Azure OpenAI calls retried after a retryable failure",
+    ("deployment", "operation")
+)
+upstream_hedges = registry.counter(
+    "metrically_azure_openai_hedged_requests_total",
+    "Duplicate Azure OpenAI calls sent because the first was slow",
+    ("deployment", "operation")
+)
+structured_output_failures = registry.counter(
+    "metrically_structured_output_parse_failures_total",
+    "Structured outputs that could not be parsed as JSON",
+    ("operation",)
+)
+structured_output_repairs = registry.counter(
+    "metrically_structured_output_repairs_total",
+    "Malformed structured outputs recovered by JSON repair, by whether parts were missing",
+    ("operation", "outcome")
+)
+
+def get_metrics_registry() -> MetricsRegistry:
+    """Get the metrics registry instance"""
+    return registry
+
+def observe_upstream(
+    deployment: str,
+    operation: str,
+    started: float,
+    outcome: str,
+    usage: Optional[Any] = None
+) -> None:
+    """
+    Record one Azure OpenAI call
+
+    Args:
+        deployment: Deployment the call was sent to
+        operation: kpi_system, sql, completion, ...
+        started: time.perf_counter() value taken before the call
+        outcome: "success" or "error"
+        usage: Usage block or dictionary from the response, if any
+    """
+    upstream_duration.observe(time.perf_counter() - started, deployment, operation, outcome)
+    if usage is None:
+        return
+    for kind in ("prompt_tokens", "completion_tokens"):
+        value = usage.get(kind) if isinstance(usage, dict) else getattr(usage, kind, None)
+        if value:
+            upstream_tokens.inc(deployment, operation, kind.split("_")[0], amount=value)
+
+class PrometheusMiddleware:
+    """
+    ASGI middleware timing every HTTP request
+
+    Requests are labelled with the matched route template rather than the
+    raw path so label cardinality stays bounded. Implemented as plain ASGI
+    so streamed responses are neither buffered nor delayed.
+    """
+
+    def __init__(self, app: Any):
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status_code = [500]
+
+        async def send_wrapper(message: Dict[str, Any]) -> None:
+            if message["type"] == "http.response.start":
+                status_code[0] = message["status"]
+            await send(message)
+
+        http_in_flight.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            http_in_flight.dec()
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            method = scope["method"]
+            http_request_duration.observe(time.perf_counter() - started, method, path)
+            http_requests.inc(method, path, str(status_code[0]))
@@ -0,0 +1,185 @@
+import os
+import math
+import time
+import logging
+import threading
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import Any, Dict, Optional, Tuple
+
+from fastapi import Depends, HTTPException, status
+from dotenv import load_dotenv
+
+from ..models.auth import get_current_user
+
+# Configure logger
+logger = logging.getLogger(__name__)
+
+# Load environment variables
+load_dotenv()
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() in ("1", "true", "yes")
+RATE_LIMIT_RPM = float(os.getenv("RATE_LIMIT_RPM", "60"))
+RATE_LIMIT_TPM = float(os.getenv("RATE_LIMIT_TPM", "40000"))
+RATE_LIMIT_MAX_USERS = int(os.getenv("RATE_LIMIT_MAX_USERS", "10000"))
+
+# User whose token budget pays for upstream calls made by the current request
+_request_user: ContextVar[Optional[str]] = ContextVar("request_user", default=None)
+
+class TokenBucket:
+    """
+    Classic token bucket that may be charged into debt
+
+    Requests are admitted only while the balance is positive, but actual
+    usage is charged after the fact and can push the balance below zero;
+    the bucket then refuses requests until the debt has been refilled.
+    """
+
+    __slots__ = ("capacity", "rate", "tokens", "updated")
+
+    def __init__(self, capacity: float, per_seconds: float = 60.0):
+        """
+        Args:
+            capacity: Maximum balance, also the amount refilled per period
+            per_seconds: Length of the refill period in seconds
+        """
+        self.capacity = capacity
+        self.rate = capacity / per_seconds
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float = 0.0) -> float:
+        """Seconds until the balance exceeds amount (0 if it already does)"""
+        self._refill(time.monotonic())
+        if self.tokens > amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate + 1e-3
+
+    def consume(self, amount: float) -> None:
+        """Deduct amount, possibly going into debt"""
+        self._refill(time.monotonic())
+        self.tokens -= amount
+
+class RateLimiter:
+    """
+    Per-user requests-per-minute and tokens-per-minute limiter
+
+    Each user gets one bucket for requests and one for model tokens. The
+    request bucket is charged on admission; the token bucket is charged with
+    the real usage reported by Azure once the request has finished.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: float = RATE_LIMIT_RPM,
+        tokens_per_minute: float = RATE_LIMIT_TPM,
+        max_users: int = RATE_LIMIT_MAX_USERS
+    ):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_users = max_users
+        self._buckets: "OrderedDict[str, Tuple[TokenBucket, TokenBucket]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def _buckets_for(self, user: str) -> Tuple[TokenBucket, TokenBucket]:
+        buckets = self._buckets.get(user)
+        if buckets is None:
+            buckets = (TokenBucket(self.requests_per_minute), TokenBucket(self.tokens_per_minute))
+            self._buckets[user] = buckets
+            # Idle users are forgotten first; a fresh bucket starts full anyway
+            while len(self._buckets) > self.max_users:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(user)
+        return buckets
+
+    def acquire(self, user: str) -> float:
+        """
+        Admit a request for user
+
+        Returns:
+            0 if the request is admitted, otherwise seconds until it would be
+        """
+        with self._lock:
+            requests, tokens = self._buckets_for(user)
+            retry_after = max(requests.wait_time(1.0 - 1e-9), tokens.wait_time(0.0))
+            if retry_after > 0:
+                self.rejected += 1
+                return retry_after
+            requests.consume(1.0)
+            return 0.0
+
+    def charge(self, user: str, total_tokens: int) -> None:
+        """Charge model tokens actually used by user"""
+        if total_tokens <= 0:
+            return
+        with self._lock:
+            self._buckets_for(user)[1].consume(total_tokens)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return limiter configuration and counters"""
+        with self._lock:
+            return {
+                "enabled": RATE_LIMIT_ENABLED,
+                "requests_per_minute": self.requests_per_minute,
+                "tokens_per_minute": self.tokens_per_minute,
+                "tracked_users": len(self._buckets),
+                "rejected": self.rejected,
+            }
+
+rate_limiter = RateLimiter()
+
+def get_rate_limiter() -> RateLimiter:
+    """Get the rate limiter instance"""
+    return rate_limiter
+
+def record_usage(usage: Any) -> None:
+    """
+    Charge upstream token usage to the user of the request being handled
+
+    Accepts the usage block of a chat completion, the usage dictionary
+    returned by the services, or a plain token count. Calls made outside a
+    rate limited request are not charged.
+    """
+    user = _request_user.get()
+    if user is None or usage is None:
+        return
+    if isinstance(usage, dict):
+        total = usage.get("total_tokens") or 0
+    elif isinstance(usage, (int, float)):
+        total = usage
+    else:
+        total = getattr(usage, "total_tokens", 0) or 0
+    rate_limiter.charge(user, int(total))
+
+def charge_usage_to(user: Optional[str]) -> None:
+    """Charge upstream usage recorded by the current task to user, e.g. for background jobs"""
+    _request_user.set(user)
+
+async def rate_limited_user(current_user: dict = Depends(get_current_user)) -> dict:
+    """
+    Dependency that authenticates and rate limits the current user
+
+    Rejects the request with 429 and a Retry-After header when the user is
+    out of requests or tokens. Tokens used by upstream calls made while
+    handling the request are charged through record_usage.
+    """
+    if not RATE_LIMIT_ENABLED:
+        return current_user
+
+    user = current_user["email"]
+    retry_after = rate_limiter.acquire(user)
+    if retry_after > 0:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Rate limit exceeded. Please retry later.",
+            headers={"Retry-After": str(math.ceil(retry_after))},
+        )
+
+    _request_user.set(user)
+    return current_user
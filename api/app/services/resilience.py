@@ -0,0 +1,210 @@
+import os
+import time
+import random
+import logging
+import threading
+from typing import Any, Dict, Optional
+
+import openai
+from dotenv import load_dotenv
+
+# Configure logger
+logger = logging.getLogger(__name__)
+
+# Load environment variables
+load_dotenv()
+
+RETRY_MAX_ATTEMPTS = int(os.getenv("AZURE_OPENAI_RETRY_MAX_ATTEMPTS", "3"))
+RETRY_BASE_DELAY = float(os.getenv("AZURE_OPENAI_RETRY_BASE_DELAY", "0.5"))
+RETRY_MAX_DELAY = float(os.getenv("AZURE_OPENAI_RETRY_MAX_DELAY", "8"))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("AZURE_OPENAI_BREAKER_FAILURES", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("AZURE_OPENAI_BREAKER_RESET_SECONDS", "30"))
+HEDGE_DELAY = float(os.getenv("AZURE_OPENAI_HEDGE_DELAY", "0"))
+HEDGE_OPERATIONS = tuple(
+    op.strip() for op in os.getenv("AZURE_OPENAI_HEDGE_OPERATIONS", "sql").split(",") if op.strip()
+)
+
+# Total time budget per operation across all attempts, in seconds
+DEFAULT_DEADLINES = {
+    "kpi_system": 90.0,
+    "kpi_continuation": 60.0,
+    "kpi_category": 45.0,
+    "kpi_assembly": 30.0,
+    "sql": 20.0,
+    "completion": 60.0,
+}
+
+def _parse_deadlines(spec: str) -> Dict[str, float]:
+    """Parse "operation=seconds,..." overrides on top of DEFAULT_DEADLINES"""
+    deadlines = dict(DEFAULT_DEADLINES)
+    for part in spec.split(","):
+        name, _, seconds = part.partition("=")
+        if name.strip() and seconds.strip():
+            deadlines[name.strip()] = float(seconds)
+    return deadlines
+
+OPERATION_DEADLINES = _parse_deadlines(os.getenv("AZURE_OPENAI_DEADLINES", ""))
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a deployment whose circuit breaker is open"""
+
+    def __init__(self, deployment: str, retry_after: float):
+        super().__init__(f"Azure OpenAI deployment {deployment} is unavailable (circuit open)")
+        self.deployment = deployment
+        self.retry_after = retry_after
+
+def deadline_for(operation: str) -> float:
+    """Total time budget for an operation"""
+    return OPERATION_DEADLINES.get(operation, OPERATION_DEADLINES["completion"])
+
+def status_code_of(error: BaseException) -> Optional[int]:
+    """HTTP status of an OpenAI API error, if it has one"""
+    return getattr(error, "status_code", None)
+
+def is_retryable(error: BaseException) -> bool:
+    """Whether a failed call may succeed if repeated: throttling, timeouts, connection errors and 5xx"""
+    if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError)):
+        return True
+    status = status_code_of(error)
+    return status is not None and (status in (408, 409, 429) or status >= 500)
+
+def is_outage(error: BaseException) -> bool:
+    """Whether a failure says the deployment is unhealthy (throttling does not)"""
+    return is_retryable(error) and status_code_of(error) not in (408, 409, 429)
+
+def retry_after_seconds(error: BaseException) -> Optional[float]:
+    """Delay requested by the server through retry-after-ms or Retry-After"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        return None
+    return None
+
+class RetryPolicy:
+    """Exponential backoff with full jitter that never retries sooner than the server asked"""
+
+    def __init__(
+        self,
+        max_attempts: int = RETRY_MAX_ATTEMPTS,
+        base_delay: float = RETRY_BASE_DELAY,
+        max_delay: float = RETRY_MAX_DELAY
+    ):
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt: int, error: BaseException) -> float:
+        """Seconds to wait before attempt number attempt + 1 (attempts count from 1)"""
+        backoff = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (attempt - 1))))
+        requested = retry_after_seconds(error)
+        return max(backoff, requested) if requested is not None else backoff
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker for one deployment
+
+    Opens after failure_threshold consecutive outage-type failures. While
+    open, calls are refused for reset_seconds; then a single probe call is
+    let through (half-open), and its outcome closes or re-opens the circuit.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+        reset_seconds: float = BREAKER_RESET_SECONDS
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.probing = False
+        self.rejected = 0
+        self.times_opened = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> None:
+        """
+        Admit a call
+
+        Raises:
+            CircuitOpenError: If the circuit is open or a probe is already running
+        """
+        with self._lock:
+            if self.opened_at is None:
+                return
+            remaining = self.reset_seconds - (time.monotonic() - self.opened_at)
+            if remaining <= 0 and not self.probing:
+                self.probing = True
+                return
+            self.rejected += 1
+            raise CircuitOpenError(self.name, max(remaining, 1.0))
+
+    def release(self) -> None:
+        """Give up an admitted call without a verdict, e.g. when it was cancelled"""
+        with self._lock:
+            self.probing = False
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self.opened_at is not None:
+                logger.info(f"Circuit for {self.name} closed")
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def record_failure(self, error: BaseException) -> None:
+        """Count a failed call; errors that show the deployment is up count as success"""
+        if not is_outage(error):
+            self.record_success()
+            return
+        with self._lock:
+            self.failures += 1
+            if self.probing or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logger.warning(f"Circuit for {self.name} opened after {self.failures} failures")
+                    self.times_opened += 1
+                self.opened_at = time.monotonic()
+            self.probing = False
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "times_opened": self.times_opened,
+            "rejected": self.rejected,
+        }
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+def get_circuit_breaker(deployment: str) -> CircuitBreaker:
+    """Get the circuit breaker for a deployment, creating it on first use"""
+    with _breakers_lock:
+        breaker = _breakers.get(deployment)
+        if breaker is None:
+            breaker = CircuitBreaker(deployment)
+            _breakers[deployment] = breaker
+        return breaker
+
+def circuit_breaker_stats() -> Dict[str, Dict[str, Any]]:
+    """State of every circuit breaker, by deployment"""
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {breaker.name: breaker.stats() for breaker in breakers}
@@ -0,0 +1,96 @@
+import json
+import asyncio
+import hashlib
+import logging
+from typing import Any, Awaitable, Callable, Dict
+
+# Configure logger
+logger = logging.getLogger(__name__)
+
+def request_key(request: Dict[str, Any]) -> str:
+    """
+    Hash a fully rendered upstream request
+
+    Args:
+        request: Keyword arguments for client.chat.completions.create
+
+    Returns:
+        Hex SHA-256 digest of the canonical JSON encoding
+    """
+    encoded = json.dumps(request, sort_keys=True, separators=(",", ":"), default=str).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+class _Call:
+    """An in-flight call and the number of callers waiting on it"""
+
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: "asyncio.Task[Any]"):
+        self.task = task
+        self.waiters = 0
+
+class SingleFlight:
+    """
+    Coalesce concurrent identical async calls into one
+
+    The first caller for a key starts the work as a separate task; callers
+    that arrive while it is running await the same task instead of starting
+    their own. A caller being cancelled does not cancel the shared task while
+    others are still waiting on it, and the task is cancelled once every
+    waiter has gone. Exceptions raised by the task are delivered to every
+    waiter, and the key is released as soon as the task finishes so later
+    calls start fresh.
+    """
+
+    def __init__(self):
+        """Initialize with no calls in flight"""
+        self._calls: Dict[str, _Call] = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Run fn, or join an identical call already in flight
+
+        Args:
+            key: Identity of the call, usually from request_key
+            fn: Zero-argument coroutine function performing the work
+
+        Returns:
+            The result of the shared call
+        """
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.ensure_future(fn()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _task, key=key, call=call: self._release(key, call))
+            self.leaders += 1
+        else:
+            self.coalesced += 1
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                # Every caller has given up, so stop paying for the upstream call
+                self._release(key, call)
+                call.task.cancel()
+
+    def in_flight(self) -> int:
+        """Number of distinct calls currently running"""
+        return len(self._calls)
+
+    def stats(self) -> Dict[str, int]:
+        """Return leader/follower counters"""
+        return {
+            "in_flight": len(self._calls),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+        }
+
+    def _release(self, key: str, call: _Call) -> None:
+        """Forget a call so new requests for the key start their own"""
+        if self._calls.get(key) is call:
+            del self._calls[key]
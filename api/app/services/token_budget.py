@@ -0,0 +1,236 @@
+import os
+import math
+import logging
+import threading
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+# Configure logger
+logger = logging.getLogger(__name__)
+
+# Load environment variables
+load_dotenv()
+
+MODEL_CONTEXT_TOKENS = int(os.getenv("MODEL_CONTEXT_TOKENS", "8192"))
+CUSTOM_PROMPT_MAX_TOKENS = int(os.getenv("CUSTOM_PROMPT_MAX_TOKENS", "1000"))
+MIN_COMPLETION_TOKENS = int(os.getenv("MIN_COMPLETION_TOKENS", "256"))
+ADAPTIVE_MAX_TOKENS = os.getenv("ADAPTIVE_MAX_TOKENS", "true").lower() in ("1", "true", "yes")
+TOKENIZER_ENCODING = os.getenv("TOKENIZER_ENCODING", "cl100k_base")
+
+# Chat format overhead per message and per reply, as documented for gpt-4/gpt-3.5
+TOKENS_PER_MESSAGE = 4
+TOKENS_PER_REPLY = 3
+
+TRUNCATION_MARKER = "\n[...]\n"
+
+class TokenBudgetExceeded(ValueError):
+    """Raised when a prompt cannot fit the model context with room for a reply"""
+
+class Tokenizer:
+    """
+    Counts tokens with tiktoken when it is installed and its encoding is
+    available, falling back to a four-characters-per-token estimate.
+    """
+
+    def __init__(self, encoding_name: str = TOKENIZER_ENCODING):
+        self.encoding_name = encoding_name
+        self._encoding: Any = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def load(self) -> None:
+        """
+        Load the encoding now
+
+        tiktoken downloads the BPE file on first use, so the app calls this
+        from a worker thread at startup rather than on the event loop
+        inside the first request.
+        """
+        self._get_encoding()
+
+    def _get_encoding(self) -> Any:
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    try:
+                        import tiktoken
+                        self._encoding = tiktoken.get_encoding(self.encoding_name)
+                    except Exception as e:
+                        logger.warning(f"tiktoken unavailable, estimating token counts: {str(e)}")
+                        self._encoding = None
+                    self._loaded = True
+        return self._encoding
+
+    @property
+    def exact(self) -> bool:
+        """Whether counts come from a real tokenizer"""
+        return self._get_encoding() is not None
+
+    def count(self, text: str) -> int:
+        """Number of tokens in text"""
+        if not text:
+            return 0
+        encoding = self._get_encoding()
+        if encoding is not None:
+            return len(encoding.encode(text, disallowed_special=()))
+        return math.ceil(len(text) / 4)
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """
+        Shorten text to at most max_tokens, keeping its beginning and end
+
+        The head carries most of the context in practice, so it gets two
+        thirds of the budget; the elided middle is marked.
+        """
+        if max_tokens <= 0:
+            return ""
+        if self.count(text) <= max_tokens:
+            return text
+
+        budget = max(0, max_tokens - self.count(TRUNCATION_MARKER))
+        head_tokens = (budget * 2) // 3
+        tail_tokens = budget - head_tokens
+        encoding = self._get_encoding()
+        if encoding is not None:
+            tokens = encoding.encode(text, disallowed_special=())
+            head = encoding.decode(tokens[:head_tokens])
+            tail = encoding.decode(tokens[len(tokens) - tail_tokens:]) if tail_tokens else ""
+        else:
+            head = text[: head_tokens * 4]
+            tail = text[len(text) - tail_tokens * 4:] if tail_tokens else ""
+        return head + TRUNCATION_MARKER + tail
+
+class CompletionSizeTracker:
+    """
+    Rolling window of completion sizes per operation
+
+    Used to size max_tokens from what an operation actually needs rather
+    than from a worst-case constant. Truncated completions are recorded at
+    the limit they hit, so the estimate grows when the cap was too tight.
+    """
+
+    def __init__(self, window: int = 200, min_samples: int = 20, quantile: float = 0.99, headroom: float = 1.25):
+        self.window = window
+        self.min_samples = min_samples
+        self.quantile = quantile
+        self.headroom = headroom
+        self._samples: Dict[str, Deque[int]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, operation: str, completion_tokens: int, truncated: bool = False, limit: Optional[int] = None) -> None:
+        """Record one completion for operation"""
+        if truncated and limit:
+            # The model wanted more than the cap; make the next estimate generous
+            completion_tokens = int(limit * self.headroom)
+        with self._lock:
+            samples = self._samples.get(operation)
+            if samples is None:
+                samples = deque(maxlen=self.window)
+                self._samples[operation] = samples
+            samples.append(int(completion_tokens))
+
+    def estimate(self, operation: str) -> Optional[int]:
+        """High quantile of recent completion sizes plus headroom, or None without enough history"""
+        with self._lock:
+            samples = sorted(self._samples.get(operation, ()))
+        if len(samples) < self.min_samples:
+            return None
+        index = min(len(samples) - 1, math.ceil(self.quantile * len(samples)) - 1)
+        return int(samples[index] * self.headroom)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            operations = list(self._samples)
+        return {
+            operation: {"samples": len(self._samples[operation]), "estimate": self.estimate(operation)}
+            for operation in operations
+        }
+
+class TokenBudgetPlanner:
+    """
+    Plans token budgets before a request is sent
+
+    Counts prompt tokens locally, trims oversized free-text context, rejects
+    prompts that cannot leave room for a reply, and picks max_tokens from the
+    rolling completion history of the operation, capped by the caller's limit
+    and by the remaining context window.
+    """
+
+    def __init__(
+        self,
+        tokenizer: Optional[Tokenizer] = None,
+        context_tokens: int = MODEL_CONTEXT_TOKENS,
+        min_completion_tokens: int = MIN_COMPLETION_TOKENS,
+        adaptive: bool = ADAPTIVE_MAX_TOKENS,
+        adaptive_operations: tuple = ("kpi_system", "kpi_category", "sql")
+    ):
+        self.tokenizer = tokenizer or Tokenizer()
+        self.context_tokens = context_tokens
+        self.min_completion_tokens = min_completion_tokens
+        self.adaptive = adaptive
+        self.adaptive_operations = adaptive_operations
+        self.history = CompletionSizeTracker()
+
+    def count_messages(self, messages: List[Dict[str, str]]) -> int:
+        """Prompt tokens for a list of chat messages"""
+        total = TOKENS_PER_REPLY
+        for message in messages:
+            total += TOKENS_PER_MESSAGE + self.tokenizer.count(message.get("content") or "")
+        return total
+
+    def fit_text(self, text: str, max_tokens: int = CUSTOM_PROMPT_MAX_TOKENS) -> str:
+        """Truncate free text (such as custom_prompt) to a token budget"""
+        if not text:
+            return text
+        return self.tokenizer.truncate(text, max_tokens)
+
+    def plan_max_tokens(self, messages: List[Dict[str, str]], operation: str, max_tokens: int) -> int:
+        """
+        Choose max_tokens for a request
+
+        Args:
+            messages: Fully rendered chat messages
+            operation: kpi_system, sql, completion, ...
+            max_tokens: Caller's limit, treated as an upper bound
+
+        Returns:
+            max_tokens to send
+
+        Raises:
+            TokenBudgetExceeded: If the prompt leaves no room for a useful reply
+        """
+        prompt_tokens = self.count_messages(messages)
+        available = self.context_tokens - prompt_tokens
+        floor = min(self.min_completion_tokens, max_tokens)
+        if available < floor:
+            raise TokenBudgetExceeded(
+                f"Prompt is {prompt_tokens} tokens; the {self.context_tokens}-token context "
+                f"leaves {max(available, 0)} tokens for the reply"
+            )
+
+        planned = max_tokens
+        if self.adaptive and operation in self.adaptive_operations:
+            estimate = self.history.estimate(operation)
+            if estimate is not None:
+                planned = max(floor, min(max_tokens, estimate))
+        return min(planned, available)
+
+    def record(self, operation: str, completion_tokens: int, truncated: bool = False, limit: Optional[int] = None) -> None:
+        """Feed an observed completion size back into the history"""
+        self.history.record(operation, completion_tokens, truncated, limit)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "exact_tokenizer": self.tokenizer.exact,
+            "context_tokens": self.context_tokens,
+            "adaptive": self.adaptive,
+            "operations": self.history.stats(),
+        }
+
+token_budget_planner = TokenBudgetPlanner()
+
+def get_token_budget_planner() -> TokenBudgetPlanner:
+    """Get the token budget planner instance"""
+    return token_budget_planner
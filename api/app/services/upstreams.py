@@ -0,0 +1,268 @@
+import os
+import json
+import time
+import random
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Sequence
+from urllib.parse import urlparse
+
+from dotenv import load_dotenv
+
+from .azure_clients import get_shared_client, get_shared_async_client
+from .rate_limit import TokenBucket
+from .resilience import CircuitOpenError, get_circuit_breaker, retry_after_seconds, status_code_of
+
+# Configure logger
+logger = logging.getLogger(__name__)
+
+# Load environment variables
+load_dotenv()
+
+# "least_loaded" routes to the upstream with the fewest calls in flight per
+# unit of weight; "latency" weights that by each upstream's recent latency
+ROUTING_STRATEGY = os.getenv("AZURE_OPENAI_ROUTING", "least_loaded")
+
+# Smoothing factor of the per-upstream latency average
+LATENCY_EWMA_ALPHA = 0.2
+
+class Upstream:
+    """
+    One Azure OpenAI deployment the service can send requests to
+
+    Tracks calls in flight, a latency moving average, optional RPM/TPM
+    quota buckets and a 429 cool-down; health is owned by the circuit
+    breaker registered under the upstream's name.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        endpoint: str,
+        api_key: str,
+        deployment: str,
+        api_version: str = "2023-05-15",
+        rpm: Optional[float] = None,
+        tpm: Optional[float] = None,
+        weight: float = 1.0
+    ):
+        self.name = name
+        self.endpoint = endpoint
+        self.api_key = api_key
+        self.deployment = deployment
+        self.api_version = api_version
+        self.weight = weight if weight > 0 else 1.0
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.breaker = get_circuit_breaker(name)
+        self.in_flight = 0
+        self.latency: Optional[float] = None
+        self.cooldown_until = 0.0
+        self.calls = 0
+        self.failures = 0
+        self._client = None
+        self._async_client = None
+        self._shared_client = None
+        self._shared_async_client = None
+
+    @property
+    def client(self) -> Any:
+        """
+        Sync OpenAI client for this upstream (retries are handled by the caller)
+
+        The shared client is looked up on every access, so a copy made
+        before close_clients() replaced the connection pool is never used.
+        """
+        shared = get_shared_client(api_key=self.api_key, endpoint=self.endpoint, api_version=self.api_version)
+        if self._client is None or self._shared_client not in (None, shared):
+            self._shared_client = shared
+            self._client = shared.with_options(max_retries=0)
+        return self._client
+
+    @property
+    def async_client(self) -> Any:
+        """Async OpenAI client for this upstream (retries are handled by the caller), resolved like client"""
+        shared = get_shared_async_client(api_key=self.api_key, endpoint=self.endpoint, api_version=self.api_version)
+        if self._async_client is None or self._shared_async_client not in (None, shared):
+            self._shared_async_client = shared
+            self._async_client = shared.with_options(max_retries=0)
+        return self._async_client
+
+    def quota_wait(self) -> float:
+        """Seconds until the RPM/TPM quota and any 429 cool-down allow another call"""
+        wait = max(0.0, self.cooldown_until - time.monotonic())
+        if self.requests is not None:
+            wait = max(wait, self.requests.wait_time(1.0 - 1e-9))
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.wait_time(0.0))
+        return wait
+
+    def score(self) -> float:
+        """Routing cost; lower is better"""
+        load = (self.in_flight + 1) / self.weight
+        if ROUTING_STRATEGY == "latency":
+            return load * (self.latency if self.latency is not None else 1.0)
+        return load
+
+    def stats(self) -> Dict[str, Any]:
+        cooldown = max(0.0, self.cooldown_until - time.monotonic())
+        return {
+            "name": self.name,
+            "endpoint": urlparse(self.endpoint).netloc or self.endpoint,
+            "deployment": self.deployment,
+            "healthy": self.breaker.state == "closed" and cooldown == 0,
+            "circuit": self.breaker.state,
+            "in_flight": self.in_flight,
+            "latency_ms": round(self.latency * 1000, 1) if self.latency is not None else None,
+            "cooldown_seconds": round(cooldown, 1),
+            "requests_per_minute": self.requests.capacity if self.requests else None,
+            "tokens_per_minute": self.tokens.capacity if self.tokens else None,
+            "calls": self.calls,
+            "failures": self.failures,
+        }
+
+class UpstreamPool:
+    """
+    Routes completions across several Azure OpenAI upstreams
+
+    Each call goes to the healthy upstream with the lowest score that still
+    has quota, skipping upstreams whose circuit is open, that are cooling
+    down after a 429, or that already failed the same call, so a failing
+    region is failed over to automatically.
+    """
+
+    def __init__(self, upstreams: Sequence[Upstream]):
+        self.upstreams = list(upstreams)
+        self._lock = threading.Lock()
+
+    def candidates(self, deployment: Optional[str] = None) -> List[Upstream]:
+        """Upstreams serving deployment, or all of them if none does"""
+        if deployment:
+            matching = [u for u in self.upstreams if u.deployment == deployment or u.name == deployment]
+            if matching:
+                return matching
+        return list(self.upstreams)
+
+    def acquire(self, deployment: Optional[str] = None, exclude: Sequence[str] = ()) -> Upstream:
+        """
+        Pick an upstream for one call and count it as in flight
+
+        Raises:
+            CircuitOpenError: If every candidate is unavailable
+        """
+        candidates = [u for u in self.candidates(deployment) if u.name not in exclude]
+        if not candidates:
+            # Every candidate already failed this call; allow another try on the best of them
+            candidates = self.candidates(deployment)
+        if not candidates:
+            raise CircuitOpenError("(none configured)", 1.0)
+
+        with self._lock:
+            # Prefer upstreams with quota available right now, then the least loaded
+            ranked = sorted(candidates, key=lambda u: (u.quota_wait() > 0, u.score(), random.random()))
+            retry_after = None
+            for upstream in ranked:
+                try:
+                    upstream.breaker.allow()
+                except CircuitOpenError as e:
+                    retry_after = e.retry_after if retry_after is None else min(retry_after, e.retry_after)
+                    continue
+                upstream.in_flight += 1
+                upstream.calls += 1
+                if upstream.requests is not None:
+                    upstream.requests.consume(1.0)
+                return upstream
+        raise CircuitOpenError(",".join(u.name for u in candidates), retry_after or 1.0)
+
+    def release(self, upstream: Upstream) -> None:
+        """A call acquired from upstream has finished, whatever its outcome"""
+        with self._lock:
+            upstream.in_flight -= 1
+
+    def record_success(self, upstream: Upstream, latency: float, usage: Any = None) -> None:
+        upstream.breaker.record_success()
+        with self._lock:
+            upstream.latency = latency if upstream.latency is None else (
+                LATENCY_EWMA_ALPHA * latency + (1 - LATENCY_EWMA_ALPHA) * upstream.latency
+            )
+            total = getattr(usage, "total_tokens", None) if usage is not None else None
+            if upstream.tokens is not None and total:
+                upstream.tokens.consume(total)
+
+    def record_failure(self, upstream: Upstream, error: BaseException) -> None:
+        upstream.breaker.record_failure(error)
+        with self._lock:
+            upstream.failures += 1
+            if status_code_of(error) == 429:
+                upstream.cooldown_until = time.monotonic() + (retry_after_seconds(error) or 1.0)
+
+    def has_alternative(self, deployment: Optional[str], exclude: Sequence[str]) -> bool:
+        """Whether a call that failed on the upstreams in exclude can fail over immediately"""
+        return any(
+            u.name not in exclude and u.breaker.state != "open" and u.quota_wait() == 0
+            for u in self.candidates(deployment)
+        )
+
+    def stats(self) -> List[Dict[str, Any]]:
+        return [upstream.stats() for upstream in self.upstreams]
+
+def load_upstreams() -> List[Upstream]:
+    """
+    Build the upstream list from the environment
+
+    AZURE_OPENAI_UPSTREAMS holds a JSON list (or the path of a JSON file) of
+    objects with name, endpoint, api_key, deployment and optional
+    api_version, rpm, tpm and weight. Without it, the single upstream
+    described by AZURE_OPENAI_ENDPOINT / AZURE_OPENAI_DEPLOYMENT_NAME is used.
+    """
+    spec = os.getenv("AZURE_OPENAI_UPSTREAMS", "").strip()
+    api_version = os.getenv("AZURE_OPENAI_API_VERSION", "2023-05-15")
+    if spec:
+        if not spec.startswith("["):
+            with open(spec) as f:
+                spec = f.read()
+        upstreams = []
+        for entry in json.loads(spec):
+            upstreams.append(Upstream(
+                name=entry.get("name") or entry["deployment"],
+                endpoint=entry["endpoint"],
+                api_key=entry.get("api_key") or os.getenv("AZURE_OPENAI_API_KEY", ""),
+                deployment=entry["deployment"],
+                api_version=entry.get("api_version", api_version),
+                rpm=entry.get("rpm"),
+                tpm=entry.get("tpm"),
+                weight=entry.get("weight", 1.0),
+            ))
+        return upstreams
+
+    api_key = os.getenv("AZURE_OPENAI_API_KEY")
+    endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
+    if not api_key or not endpoint:
+        return []
+    deployment = os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME", "gpt-4")
+    rpm = os.getenv("AZURE_OPENAI_RPM")
+    tpm = os.getenv("AZURE_OPENAI_TPM")
+    return [Upstream(
+        name=deployment,
+        endpoint=endpoint,
+        api_key=api_key,
+        deployment=deployment,
+        api_version=api_version,
+        rpm=float(rpm) if rpm else None,
+        tpm=float(tpm) if tpm else None,
+    )]
+
+_pool: Optional[UpstreamPool] = None
+_pool_lock = threading.Lock()
+
+def get_upstream_pool() -> UpstreamPool:
+    """Get the upstream pool instance"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            try:
+                _pool = UpstreamPool(load_upstreams())
+            except (OSError, ValueError, KeyError) as e:
+                logger.error(f"Invalid AZURE_OPENAI_UPSTREAMS configuration: {str(e)}")
+                _pool = UpstreamPool([])
+        return _pool
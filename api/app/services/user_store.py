@@ -0,0 +1,271 @@
+import os
+import sys
+import json
+import queue
+import asyncio
+import time
+import sqlite3
+import logging
+import argparse
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from dotenv import load_dotenv
+
+# Configure logger
+logger = logging.getLogger(__name__)
+
+# Load environment variables
+load_dotenv()
+
+# Defaults to the api/ directory rather than the working directory
+DEFAULT_USER_DB_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+    "metrically_users.db"
+)
+USER_DB_PATH = os.getenv("USER_DB_PATH") or DEFAULT_USER_DB_PATH
+USER_DB_POOL_SIZE = int(os.getenv("USER_DB_POOL_SIZE", "4"))
+
+USER_FIELDS = ("email", "full_name", "hashed_password", "disabled")
+
+# SQL statements are constants so sqlite3's per-connection statement cache reuses them
+_CREATE_TABLE = """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY,
+    email TEXT NOT NULL,
+    full_name TEXT,
+    hashed_password TEXT NOT NULL,
+    disabled INTEGER NOT NULL DEFAULT 0
+)
+"""
+_CREATE_EMAIL_INDEX = "CREATE UNIQUE INDEX IF NOT EXISTS users_email ON users (email)"
+_SELECT_BY_EMAIL = "SELECT email, full_name, hashed_password, disabled FROM users WHERE email = ?"
+_INSERT = "INSERT INTO users (email, full_name, hashed_password, disabled) VALUES (?, ?, ?, ?)"
+_INSERT_OR_IGNORE = "INSERT OR IGNORE INTO users (email, full_name, hashed_password, disabled) VALUES (?, ?, ?, ?)"
+_UPDATE_PASSWORD = "UPDATE users SET hashed_password = ? WHERE email = ?"
+# Revoked access tokens, by SHA-256 digest, shared by every worker process
+_CREATE_REVOKED_TABLE = """
+CREATE TABLE IF NOT EXISTS revoked_tokens (
+    token_hash TEXT PRIMARY KEY,
+    expires_at REAL NOT NULL
+)
+"""
+_SELECT_REVOKED = "SELECT 1 FROM revoked_tokens WHERE token_hash = ? AND expires_at > ?"
+_INSERT_REVOKED = "INSERT OR REPLACE INTO revoked_tokens (token_hash, expires_at) VALUES (?, ?)"
+_PURGE_REVOKED = "DELETE FROM revoked_tokens WHERE expires_at <= ?"
+
+class UserStore:
+    """
+    Persistent user repository backed by SQLite
+
+    The database runs in WAL mode so several uvicorn workers can read
+    concurrently while one writes. Each process keeps a small pool of
+    connections; the async methods run the blocking calls on a worker
+    thread so they do not stall the event loop.
+    """
+
+    def __init__(self, path: str = USER_DB_PATH, pool_size: int = USER_DB_POOL_SIZE):
+        """
+        Open the database and create the schema if needed
+
+        Args:
+            path: SQLite database file
+            pool_size: Number of pooled connections
+        """
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._pool: "queue.Queue[sqlite3.Connection]" = queue.Queue()
+        for _ in range(max(1, pool_size)):
+            self._pool.put(self._connect())
+
+        with self._connection() as conn:
+            conn.execute(_CREATE_TABLE)
+            conn.execute(_CREATE_EMAIL_INDEX)
+            conn.execute(_CREATE_REVOKED_TABLE)
+
+    def _connect(self) -> sqlite3.Connection:
+        """Open a pooled connection"""
+        conn = sqlite3.connect(
+            self.path,
+            timeout=10,
+            check_same_thread=False,
+            isolation_level=None
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    @contextmanager
+    def _connection(self) -> Iterator[sqlite3.Connection]:
+        """Borrow a connection from the pool"""
+        conn = self._pool.get()
+        try:
+            yield conn
+        finally:
+            self._pool.put(conn)
+
+    def get(self, email: str) -> Optional[Dict[str, Any]]:
+        """
+        Look up a user by email
+
+        Returns:
+            User record, or None if no such user exists
+        """
+        with self._connection() as conn:
+            row = conn.execute(_SELECT_BY_EMAIL, (email,)).fetchone()
+        if row is None:
+            return None
+        return {
+            "email": row[0],
+            "full_name": row[1],
+            "hashed_password": row[2],
+            "disabled": bool(row[3]),
+        }
+
+    def create(self, user: Dict[str, Any]) -> bool:
+        """
+        Insert a new user
+
+        Returns:
+            True if the user was created, False if the email is already taken
+        """
+        try:
+            with self._connection() as conn:
+                conn.execute(_INSERT, _user_params(user))
+            return True
+        except sqlite3.IntegrityError:
+            return False
+
+    def update_password_hash(self, email: str, hashed_password: str) -> None:
+        """Replace a user's stored password hash"""
+        with self._connection() as conn:
+            conn.execute(_UPDATE_PASSWORD, (hashed_password, email))
+
+    def bulk_import(self, users: Iterable[Dict[str, Any]]) -> int:
+        """
+        Insert many users in a single transaction, skipping existing emails
+
+        Returns:
+            Number of users inserted
+        """
+        params = [_user_params(user) for user in users]
+        with self._connection() as conn:
+            before = conn.total_changes
+            conn.execute("BEGIN")
+            try:
+                conn.executemany(_INSERT_OR_IGNORE, params)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            return conn.total_changes - before
+
+    def revoke_token(self, token_hash: str, expires_at: float) -> None:
+        """
+        Record a revoked access token until it would have expired anyway
+
+        Revocations of tokens that have since expired are purged.
+        """
+        with self._connection() as conn:
+            conn.execute(_INSERT_REVOKED, (token_hash, expires_at))
+            conn.execute(_PURGE_REVOKED, (time.time(),))
+
+    def is_token_revoked(self, token_hash: str) -> bool:
+        """Whether an unexpired access token has been revoked by any process"""
+        with self._connection() as conn:
+            return conn.execute(_SELECT_REVOKED, (token_hash, time.time())).fetchone() is not None
+
+    async def aget(self, email: str) -> Optional[Dict[str, Any]]:
+        """Async variant of get"""
+        return await asyncio.to_thread(self.get, email)
+
+    async def acreate(self, user: Dict[str, Any]) -> bool:
+        """Async variant of create"""
+        return await asyncio.to_thread(self.create, user)
+
+    async def aupdate_password_hash(self, email: str, hashed_password: str) -> None:
+        """Async variant of update_password_hash"""
+        await asyncio.to_thread(self.update_password_hash, email, hashed_password)
+
+    async def arevoke_token(self, token_hash: str, expires_at: float) -> None:
+        """Async variant of revoke_token"""
+        await asyncio.to_thread(self.revoke_token, token_hash, expires_at)
+
+    async def ais_token_revoked(self, token_hash: str) -> bool:
+        """Async variant of is_token_revoked"""
+        return await asyncio.to_thread(self.is_token_revoked, token_hash)
+
+    def close(self) -> None:
+        """Close every pooled connection"""
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
+
+def _user_params(user: Dict[str, Any]) -> tuple:
+    """Positional parameters for the insert statements"""
+    return (
+        user["email"],
+        user.get("full_name"),
+        user["hashed_password"],
+        1 if user.get("disabled") else 0,
+    )
+
+_user_store: Optional[UserStore] = None
+_user_store_lock = threading.Lock()
+
+def get_user_store() -> UserStore:
+    """Get the user store instance, opening it on first use"""
+    global _user_store
+    if _user_store is None:
+        with _user_store_lock:
+            if _user_store is None:
+                _user_store = UserStore()
+    return _user_store
+
+def load_users(path: str) -> List[Dict[str, Any]]:
+    """
+    Read users to import from a JSON file
+
+    The file may be a list of user records or a mapping of email to record
+    (the shape of the old in-memory fake_users_db). Records carrying a
+    plain "password" instead of "hashed_password" are hashed on import.
+    """
+    with open(path) as f:
+        data = json.load(f)
+    records = list(data.values()) if isinstance(data, dict) else list(data)
+
+    users = []
+    for record in records:
+        user = {field: record.get(field) for field in USER_FIELDS}
+        if not user["hashed_password"]:
+            if not record.get("password"):
+                raise ValueError(f"User {record.get('email')} has no password or hashed_password")
+            from ..models.auth import get_password_hash
+            user["hashed_password"] = get_password_hash(record["password"])
+        users.append(user)
+    return users
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Command line entry point: python -m app.services.user_store import users.json"""
+    parser = argparse.ArgumentParser(description="Manage the Metrically user store")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    import_parser = subparsers.add_parser("import", help="Bulk import users from a JSON file")
+    import_parser.add_argument("file", help="JSON list of users, or mapping of email to user")
+    import_parser.add_argument("--db", default=USER_DB_PATH, help="SQLite database path")
+    args = parser.parse_args(argv)
+
+    store = UserStore(path=args.db)
+    users = load_users(args.file)
+    inserted = store.bulk_import(users)
+    print(f"Imported {inserted} of {len(users)} users into {args.db}")
+    store.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
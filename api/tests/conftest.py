@@ -0,0 +1,10 @@
+import os
+import tempfile
+
+# Keep the services' on-disk state out of the working tree during tests
+_state = tempfile.mkdtemp(prefix="metrically-tests-")
+os.environ.setdefault("USER_DB_PATH", os.path.join(_state, "users.db"))
+os.environ.setdefault("JOB_DB_PATH", os.path.join(_state, "jobs.db"))
+os.environ.setdefault("DATA_STORE_PATH", os.path.join(_state, "data"))
+os.environ["KPI_CACHE_PATH"] = ""
+os.environ.setdefault("BOOTSTRAP_WORKERS", "1")
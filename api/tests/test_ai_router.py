@@ -0,0 +1,79 @@
+import json
+from types import SimpleNamespace
+
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.models.auth import get_current_user
+from app.services import enhanced_azure_openai
+from app.services.kpi_cache import KPICache
+from app.services.rate_limit import rate_limited_user
+from app.services.upstreams import Upstream, UpstreamPool
+
+COMPANY = {"product_type": "SaaS", "company_stage": "Growth", "tech_stack": "Postgres", "industry": "Fintech"}
+
+def test_generate_kpi_accepts_metrics_and_dashboards_without_names(monkeypatch):
+    service = enhanced_azure_openai.get_async_azure_openai_service()
+
+    async def generate_kpi_system(**kwargs):
+        return {
+            "success": True,
+            "content": {
+                "metrics": [{"name": "MRR", "category": "Revenue"}, {"description": "Unnamed metric"}],
+                "dashboard_recommendations": [{"description": "Unnamed dashboard"}],
+                "summary": "ok",
+            },
+        }
+
+    monkeypatch.setattr(service, "is_available", lambda: True)
+    monkeypatch.setattr(service, "generate_kpi_system", generate_kpi_system)
+    app.dependency_overrides[rate_limited_user] = lambda: {"email": "test@metrically.ai"}
+    try:
+        response = TestClient(app).post("/ai/generate-kpi", json=COMPANY)
+    finally:
+        app.dependency_overrides.pop(rate_limited_user, None)
+
+    assert response.status_code == 200
+    metrics = response.json()["content"]["metrics"]
+    assert [metric["name"] for metric in metrics] == ["MRR", None]
+
+def test_valid_off_schema_reply_passes_response_models(monkeypatch):
+    """A JSON reply that parses but breaks the schema is served (and cached) in model-valid form"""
+    reply = {
+        "metrics": [{"name": "MRR", "benchmark": 5, "importance": 3}],
+        "dashboard_recommendations": [{"name": "Revenue", "included_metrics": ["MRR", 7]}],
+        "summary": "ok",
+    }
+    usage = SimpleNamespace(prompt_tokens=1, completion_tokens=1, total_tokens=2)
+
+    async def create(**kwargs):
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=json.dumps(reply)))], usage=usage)
+
+    service = enhanced_azure_openai.get_async_azure_openai_service()
+    upstream = Upstream("response-model-test", "https://example.invalid", "key", "gpt-4")
+    upstream._async_client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    monkeypatch.setattr(service, "pool", UpstreamPool([upstream]))
+    monkeypatch.setattr(service, "client", upstream.client)
+    monkeypatch.setattr(service, "cache", KPICache(max_entries=4, ttl_seconds=60))
+    user = {"email": "response-model@metrically.ai"}
+    app.dependency_overrides[rate_limited_user] = lambda: user
+    app.dependency_overrides[get_current_user] = lambda: user
+    try:
+        with TestClient(app) as client:
+            first = client.post("/ai/generate-kpi", params={"mode": "single"}, json=COMPANY)
+            cached = client.post("/ai/generate-kpi", params={"mode": "single"}, json=COMPANY)
+            job = client.post("/ai/jobs/kpi", json={"company_info": COMPANY, "cache": "bypass", "mode": "single"})
+            finished = client.get(f"/ai/jobs/{job.json()['id']}", params={"wait": 10})
+    finally:
+        app.dependency_overrides.pop(rate_limited_user, None)
+        app.dependency_overrides.pop(get_current_user, None)
+
+    assert first.status_code == 200
+    metric = first.json()["content"]["metrics"][0]
+    assert (metric["benchmark"], metric["importance"]) == ("5", "3")
+    assert first.json()["content"]["dashboard_recommendations"][0]["included_metrics"] == ["MRR", "7"]
+    assert cached.status_code == 200
+    assert cached.json()["cached"] is True
+    assert finished.status_code == 200
+    assert finished.json()["status"] == "succeeded"
+    assert finished.json()["result"]["content"]["metrics"][0]["benchmark"] == "5"
@@ -0,0 +1,51 @@
+import asyncio
+import os
+import inspect
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from fastapi import HTTPException
+
+from app.models import auth as auth_model
+from app.models.auth import create_access_token, get_current_user, get_password_hash
+from app.routers import auth
+from app.services import user_store
+from app.services.user_store import UserStore
+
+def test_authenticate_user_is_sync_with_async_variant(tmp_path, monkeypatch):
+    store = UserStore(str(tmp_path / "users.db"))
+    store.create({"email": "sync@example.com", "hashed_password": get_password_hash("secret")})
+    monkeypatch.setattr(user_store, "_user_store", store)
+
+    assert not inspect.iscoroutinefunction(auth.authenticate_user)
+    assert auth.authenticate_user("sync@example.com", "secret").email == "sync@example.com"
+    assert auth.authenticate_user("sync@example.com", "wrong") is False
+    assert auth.authenticate_user("missing@example.com", "secret") is False
+
+    user = asyncio.run(auth.authenticate_user_async("sync@example.com", "secret"))
+    assert user.email == "sync@example.com"
+    assert asyncio.run(auth.authenticate_user_async("sync@example.com", "wrong")) is False
+
+def test_get_user_store_builds_one_instance_across_threads(monkeypatch):
+    monkeypatch.setattr(user_store, "_user_store", None)
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        stores = list(pool.map(lambda _: user_store.get_user_store(), range(32)))
+    assert len({id(store) for store in stores}) == 1
+
+def test_default_user_db_path_does_not_depend_on_cwd():
+    assert user_store.DEFAULT_USER_DB_PATH.endswith("metrically_users.db")
+    assert os.path.isabs(user_store.DEFAULT_USER_DB_PATH)
+
+def test_token_revoked_by_another_worker_is_rejected(tmp_path, monkeypatch):
+    store = UserStore(str(tmp_path / "users.db"))
+    monkeypatch.setattr(user_store, "_user_store", store)
+    token = create_access_token({"sub": "revoked@example.com"})
+    assert asyncio.run(get_current_user(token)) == {"email": "revoked@example.com"}
+
+    # Another process only shares the store, not this process's token cache
+    other = UserStore(store.path)
+    other.revoke_token(auth_model._token_digest(token), time.time() + 60)
+    with pytest.raises(HTTPException) as excinfo:
+        asyncio.run(get_current_user(token))
+    assert excinfo.value.status_code == 401
@@ -0,0 +1,123 @@
+import numpy as np
+import pytest
+
+from app.services import cohort_engine
+from app.services.cohort_engine import cohort_retention, compute_cohorts
+from app.services.kpi_engine import KPIComputeError
+
+JAN_1 = 1704067200  # a Monday
+
+def _day(seconds):
+    return seconds // 86400
+
+def _week(seconds):
+    # Weeks start on Monday; 1970-01-05 is day 4
+    return (seconds // 86400 - 4) // 7
+
+def _reference(users, seconds, names, index, horizon, retention, signup_event=None, activity_event=None):
+    """Cohort matrix by looping over users and events"""
+    first = {}
+    for user, second, name in zip(users, seconds, names):
+        if signup_event is None or name == signup_event:
+            first[user] = min(first.get(user, second), second)
+    base = index(min(first.values()))
+    cohort_count = index(max(first.values())) - base + 1
+    last_period = index(max(seconds)) - base
+
+    sizes = np.zeros(cohort_count, dtype=int)
+    for user, second in first.items():
+        sizes[index(second) - base] += 1
+    offsets = {}
+    for user, second, name in zip(users, seconds, names):
+        if user in first and (activity_event is None or name == activity_event):
+            offset = index(second) - index(first[user])
+            if offset >= 0:
+                offsets.setdefault(user, set()).add(offset)
+
+    counts = np.zeros((cohort_count, horizon), dtype=int)
+    for user, seen in offsets.items():
+        cohort = index(first[user]) - base
+        for k in range(horizon):
+            if (k in seen) if retention == "n_day" else (max(seen) >= k):
+                counts[cohort, k] += 1
+    observed = np.add.outer(np.arange(cohort_count), np.arange(horizon)) <= last_period
+    return sizes, counts, observed
+
+def _random_events(seed, users=300, events=4000, days=90):
+    rng = np.random.default_rng(seed)
+    user_ids = rng.integers(0, users, events)
+    seconds = JAN_1 + rng.integers(0, days * 86400, events)
+    names = rng.choice(["signup", "visit", "purchase"], events)
+    return [f"u{u}" for u in user_ids], seconds, names
+
+@pytest.mark.parametrize("retention", ["n_day", "unbounded"])
+@pytest.mark.parametrize("period,index,horizon", [("day", _day, 30), ("week", _week, 6)])
+@pytest.mark.parametrize("bitmap", [True, False])
+def test_matrix_matches_reference(monkeypatch, retention, period, index, horizon, bitmap):
+    if not bitmap:
+        # Force the sort-based fallback for distinct (user, offset) pairs
+        monkeypatch.setattr(cohort_engine, "BITMAP_MAX_CELLS", 0)
+    users, seconds, names = _random_events(7)
+
+    result = cohort_retention({"user_id": users, "timestamp": seconds}, period, horizon, retention)
+
+    sizes, counts, observed = _reference(users, seconds, names, index, horizon, retention)
+    assert result["sizes"].tolist() == sizes.tolist()
+    assert result["counts"].tolist() == counts.tolist()
+    assert result["observed"].tolist() == observed.tolist()
+
+@pytest.mark.parametrize("retention", ["n_day", "unbounded"])
+def test_signup_and_activity_events_match_reference(retention):
+    users, seconds, names = _random_events(11)
+    events = {"user_id": users, "timestamp": seconds, "event": names}
+
+    result = cohort_retention(events, "week", 8, retention, signup_event="signup", activity_event="purchase")
+
+    sizes, counts, _ = _reference(users, seconds, names, _week, 8, retention, "signup", "purchase")
+    assert result["sizes"].tolist() == sizes.tolist()
+    assert result["counts"].tolist() == counts.tolist()
+
+def test_unbounded_counts_returns_past_the_horizon():
+    day = 86400
+    events = {"user_id": ["a", "a", "b", "b"], "timestamp": [JAN_1, JAN_1 + 5 * day, JAN_1, JAN_1 + day]}
+
+    n_day = cohort_retention(events, "day", 3, "n_day")
+    unbounded = cohort_retention(events, "day", 3, "unbounded")
+
+    assert n_day["counts"].tolist() == [[2, 1, 0]]
+    assert unbounded["counts"].tolist() == [[2, 2, 1]]
+
+def test_compute_cohorts_nulls_unobserved_cells_and_weights_average():
+    day = 86400
+    events = {
+        "user_id": ["a", "b", "c", "a", "c"],
+        "timestamp": [JAN_1, JAN_1, JAN_1 + day, JAN_1 + day, JAN_1 + 2 * day],
+    }
+
+    result = compute_cohorts(events, "day", 3, "n_day")
+
+    assert result["cohorts"] == ["2024-01-01", "2024-01-02"]
+    assert result["sizes"] == [2, 1]
+    assert result["counts"] == [[2, 1, 0], [1, 1, None]]
+    assert result["percentages"] == [[100.0, 50.0, 0.0], [100.0, 100.0, None]]
+    assert result["average"] == pytest.approx([100.0, 200 / 3, 0.0])
+
+def test_start_and_end_limit_signups():
+    day = 86400
+    events = {"user_id": ["a", "b", "c"], "timestamp": [JAN_1, JAN_1 + day, JAN_1 + 2 * day]}
+
+    result = compute_cohorts(events, "day", 2, "n_day", start="2024-01-02", end="2024-01-02")
+
+    assert result["cohorts"] == ["2024-01-02"]
+    assert result["sizes"] == [1]
+
+def test_invalid_requests_raise():
+    events = {"user_id": ["a"], "timestamp": [JAN_1]}
+    with pytest.raises(KPIComputeError):
+        cohort_retention(events, "week", 4, "rolling")
+    with pytest.raises(KPIComputeError):
+        cohort_retention(events, "week", 0)
+    with pytest.raises(KPIComputeError):
+        cohort_retention({"user_id": ["a"]}, "week", 4)
+    with pytest.raises(KPIComputeError):
+        cohort_retention(events, "week", 4, signup_event="signup")
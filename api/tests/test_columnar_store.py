@@ -0,0 +1,186 @@
+import csv
+import io
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.models.auth import get_current_user
+from app.services import columnar_store
+from app.services.columnar_store import ColumnarStore, DatasetBusy, IngestError
+from app.services.kpi_engine import compute_kpis
+from app.services.rate_limit import rate_limited_user
+
+OWNER = "owner@example.com"
+FEB_1 = 1706745600
+
+SUBSCRIPTIONS_CSV = (
+    "customer_id,amount,start,end,interval,plan\n"
+    "c1,100,2024-01-01,,month,basic\n"
+    "c2,1200,2024-01-15T12:00:00Z,2024-03-10,year,pro\n"
+    f"c3,50,{FEB_1},,month,basic\n"
+    "c4,10,2023-06-01,2023-07-01,month,basic\n"
+)
+
+EVENTS_NDJSON = (
+    b'{"user_id": "u1", "timestamp": "2024-01-01T10:00:00Z", "event": "visit"}\n'
+    b'{"user_id": "u2", "timestamp": "2024-01-02T10:00:00Z", "event": "purchase"}\n'
+    b'{"user_id": "u1", "timestamp": "2024-01-03T10:00:00Z", "event": "visit"}\n'
+    b'{"user_id": "u3", "timestamp": null, "event": "visit"}\n'
+)
+
+def _ingest(store, table, fmt, data, dataset="shop", chunk=7):
+    ingest = store.open_ingest(OWNER, dataset, table, fmt)
+    try:
+        for offset in range(0, len(data), chunk):
+            ingest.feed(data[offset:offset + chunk])
+    except BaseException:
+        ingest.abort()
+        raise
+    return ingest.close()
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    # Small batches so uploads span several flushes
+    monkeypatch.setattr(columnar_store, "INGEST_BATCH_ROWS", 2)
+    return ColumnarStore(str(tmp_path))
+
+def test_csv_subscriptions_with_epoch_start_count_in_mrr(store):
+    summary = _ingest(store, "subscriptions", "csv", SUBSCRIPTIONS_CSV.encode())
+
+    assert summary["rows"] == 4
+    assert summary["rejected_rows"] == 0
+    assert summary["ignored_columns"] == ["plan"]
+    tables = {"subscriptions": store.load_table(OWNER, "shop", "subscriptions")}
+    result = compute_kpis(tables, ["mrr"], "month", "2024-01-01", "2024-03-31")
+    assert result["metrics"]["mrr"] == pytest.approx([200.0, 250.0, 150.0])
+
+    table = store.summary(OWNER, "shop")["tables"]["subscriptions"]
+    assert table["first"] == "2023-06-01T00:00:00"
+    assert table["last"] == "2024-02-01T00:00:00"
+
+def test_ndjson_events_round_trip_and_reject_rows_without_timestamp(store):
+    summary = _ingest(store, "events", "ndjson", EVENTS_NDJSON)
+
+    assert summary["rows"] == 3
+    assert summary["rejected_rows"] == 1
+    assert summary["partitions_touched"] == 3
+    events = store.load_table(OWNER, "shop", "events")
+    assert events["event"].tolist() == ["visit", "purchase", "visit"]
+    # Ids come back as dictionary codes: u1 twice, u2 once
+    assert events["user_id"][0] == events["user_id"][2] != events["user_id"][1]
+
+def test_later_ingest_appends_and_reuses_dictionaries(store):
+    _ingest(store, "events", "ndjson", EVENTS_NDJSON)
+    _ingest(store, "events", "csv", b"user_id,timestamp,event\nu1,2024-01-03T11:00:00Z,purchase\n")
+
+    events = store.load_table(OWNER, "shop", "events")
+    assert len(events["timestamp"]) == 4
+    assert events["user_id"][-1] == events["user_id"][0]
+    assert events["event"].tolist()[-1] == "purchase"
+    assert store.summary(OWNER, "shop")["tables"]["events"]["partitions"] == 3
+
+def test_load_table_prunes_partitions_outside_range(store):
+    _ingest(store, "events", "ndjson", EVENTS_NDJSON)
+
+    events = store.load_table(OWNER, "shop", "events", np.datetime64("2024-01-02"), np.datetime64("2024-01-02T23:59:59"))
+    assert events["timestamp"].tolist() == [1704189600]
+    assert isinstance(events["timestamp"], np.memmap)
+
+    empty = store.load_table(OWNER, "shop", "events", np.datetime64("2025-01-01"))
+    assert len(empty["timestamp"]) == 0
+
+def test_subscription_pruning_keeps_earlier_active_subscriptions(store):
+    _ingest(store, "subscriptions", "csv", SUBSCRIPTIONS_CSV.encode())
+
+    march = store.load_table(OWNER, "shop", "subscriptions", np.datetime64("2024-03-01"), np.datetime64("2024-03-31"))
+    # c4 ended in 2023, so its partition is skipped; the open-ended ones are kept
+    assert sorted(march["amount"].tolist()) == [50.0, 100.0, 1200.0]
+
+    june = store.load_table(OWNER, "shop", "subscriptions", np.datetime64("2023-06-01"), np.datetime64("2023-06-30"))
+    assert june["amount"].tolist() == [10.0]
+
+def test_all_rejected_batch_and_aborted_ingest_leave_no_rows(store):
+    summary = _ingest(store, "events", "csv", b"user_id,timestamp,event\nu1,,visit\nu2,,visit\n")
+    assert summary["rows"] == 0
+    assert summary["rejected_rows"] == 2
+    assert store.load_table(OWNER, "shop", "events") is None
+
+    ingest = store.open_ingest(OWNER, "shop", "events", "ndjson")
+    ingest.feed(EVENTS_NDJSON)
+    ingest.abort()
+    assert store.load_table(OWNER, "shop", "events") is None
+
+def test_invalid_uploads_are_rejected(store):
+    with pytest.raises(IngestError):
+        store.open_ingest(OWNER, "../escape", "events", "csv")
+    with pytest.raises(IngestError):
+        store.open_ingest(OWNER, "shop", "orders", "csv")
+    with pytest.raises(IngestError):
+        _ingest(store, "events", "csv", b"user_id,event\nu1,visit\n")
+
+    ingest = store.open_ingest(OWNER, "shop", "events", "csv")
+    try:
+        with pytest.raises(DatasetBusy):
+            store.open_ingest(OWNER, "shop", "events", "csv")
+    finally:
+        ingest.abort()
+
+def test_ingested_dataset_feeds_compute_endpoint():
+    user = {"email": "columnar-endpoint@example.com"}
+    app.dependency_overrides[get_current_user] = lambda: user
+    app.dependency_overrides[rate_limited_user] = lambda: user
+    try:
+        client = TestClient(app)
+        response = client.post(
+            "/data/ingest", params={"dataset": "billing", "table": "subscriptions"},
+            content=SUBSCRIPTIONS_CSV, headers={"Content-Type": "text/csv"}
+        )
+        assert response.status_code == 200
+        assert response.json()["rows"] == 4
+
+        response = client.post("/kpi/compute", json={
+            "metrics": ["mrr"], "dataset": "billing", "start": "2024-01-01", "end": "2024-03-31"
+        })
+    finally:
+        app.dependency_overrides.pop(get_current_user, None)
+        app.dependency_overrides.pop(rate_limited_user, None)
+
+    assert response.status_code == 200
+    assert response.json()["metrics"]["mrr"] == pytest.approx([200.0, 250.0, 150.0])
+
+@pytest.mark.parametrize("table,csv_text,request_fields", [
+    # Transactions before start in the same month still count in that month
+    ("transactions", "amount,timestamp\n10,2024-03-02\n20,2024-03-20\n5,2024-01-10\n",
+     {"metrics": ["revenue", "orders"], "start": "2024-03-15", "end": "2024-04-10"}),
+    # A returning customer whose first subscription ended long before start is not new
+    ("subscriptions", "customer_id,amount,start,end\nc1,10,2023-01-01,2023-02-01\nc1,10,2024-03-05,\nc2,20,2024-03-10,\n",
+     {"metrics": ["new_customers", "mrr", "churn_rate"], "start": "2024-03-01", "end": "2024-04-30"}),
+    ("subscriptions", "customer_id,amount,start,end\nc1,10,2023-01-01,2023-02-01\nc1,10,2024-03-05,\nc2,20,2024-03-10,\n",
+     {"metrics": ["mrr"], "start": "2024-03-20", "end": "2024-03-21", "period": "week"}),
+])
+def test_dataset_results_match_inline_results(table, csv_text, request_fields):
+    user = {"email": "dataset-vs-inline@example.com"}
+    rows = list(csv.DictReader(io.StringIO(csv_text)))
+    inline = {column: [row[column] or None for row in rows] for column in rows[0]}
+    if "amount" in inline:
+        inline["amount"] = [float(value) for value in inline["amount"]]
+    app.dependency_overrides[get_current_user] = lambda: user
+    app.dependency_overrides[rate_limited_user] = lambda: user
+    try:
+        client = TestClient(app)
+        dataset = f"inline-{table}-{len(request_fields['metrics'])}-{request_fields.get('period', 'month')}"
+        ingested = client.post(
+            "/data/ingest", params={"dataset": dataset, "table": table},
+            content=csv_text, headers={"Content-Type": "text/csv"}
+        )
+        assert ingested.status_code == 200
+        from_dataset = client.post("/kpi/compute", json={**request_fields, "dataset": dataset})
+        from_inline = client.post("/kpi/compute", json={**request_fields, "tables": {table: inline}})
+    finally:
+        app.dependency_overrides.pop(get_current_user, None)
+        app.dependency_overrides.pop(rate_limited_user, None)
+
+    assert from_inline.status_code == from_dataset.status_code == 200
+    assert from_dataset.json() == from_inline.json()
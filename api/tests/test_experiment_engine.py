@@ -0,0 +1,174 @@
+import math
+
+import numpy as np
+import pytest
+
+from app.services import experiment_engine
+from app.services.experiment_engine import (
+    _prepare_arm,
+    bootstrap_means,
+    experiment_impact,
+    shutdown_bootstrap_pool,
+    t_quantile,
+    t_two_sided_p,
+    welch_test,
+)
+from app.services.kpi_engine import KPIComputeError
+
+def _t_two_sided_p_by_integration(t, df, steps=20000):
+    """Reference p-value from Simpson's rule over the t density"""
+    log_norm = math.lgamma((df + 1) / 2) - math.lgamma(df / 2) - 0.5 * math.log(df * math.pi)
+
+    def density(x):
+        return math.exp(log_norm - (df + 1) / 2 * math.log1p(x * x / df))
+
+    h = abs(t) / steps
+    inner = sum((4 if i % 2 else 2) * density(i * h) for i in range(1, steps))
+    return 1 - 2 * h / 3 * (density(0) + inner + density(abs(t)))
+
+@pytest.mark.parametrize("t,df", [(2.0, 5), (2.16930, 25.408), (0.5, 3.3), (4.0, 120)])
+def test_t_two_sided_p_matches_integration(t, df):
+    assert t_two_sided_p(t, df) == pytest.approx(_t_two_sided_p_by_integration(t, df), abs=1e-8)
+
+def test_t_quantile_known_values():
+    assert t_quantile(0.95, 10) == pytest.approx(2.228138852, abs=1e-6)
+    assert t_quantile(0.95, 1) == pytest.approx(12.70620474, abs=1e-5)
+    assert t_quantile(0.99, 30) == pytest.approx(2.749995654, abs=1e-6)
+    assert t_quantile(0.95, math.inf) == pytest.approx(1.959963985, abs=1e-9)
+
+def test_welch_test_known_values():
+    result = welch_test((10.0, 4.0, 10), (12.0, 9.0, 20))
+
+    se = math.sqrt(4.0 / 10 + 9.0 / 20)
+    df = (0.4 + 0.45) ** 2 / (0.4 ** 2 / 9 + 0.45 ** 2 / 19)
+    assert result["difference"] == 2.0
+    assert result["t"] == pytest.approx(2.0 / se)
+    assert result["df"] == pytest.approx(df)
+    assert result["p_value"] == pytest.approx(_t_two_sided_p_by_integration(2.0 / se, df), abs=1e-8)
+    critical = t_quantile(0.95, df)
+    assert result["ci"] == pytest.approx([2.0 - critical * se, 2.0 + critical * se])
+    assert result["lift"] == pytest.approx(0.2)
+
+def test_welch_test_degenerate_arms():
+    assert welch_test((1.0, 0.0, 1), (2.0, 0.0, 5))["p_value"] is None
+    constant = welch_test((1.0, 0.0, 5), (1.0, 0.0, 5))
+    assert constant["ci"] == [0.0, 0.0]
+    assert constant["p_value"] is None
+    assert welch_test((0.0, 1.0, 5), (1.0, 1.0, 5))["lift"] is None
+
+def _experiment(seed, users=4000, effect=0.5):
+    """Exposures with a pre-period covariate that explains most of the outcome"""
+    rng = np.random.default_rng(seed)
+    ids = np.arange(users)
+    variants = np.where(ids % 2 == 0, "control", "treatment")
+    baseline = rng.normal(10.0, 3.0, users)
+    outcome = baseline + rng.normal(0.0, 1.0, users) + effect * (variants == "treatment")
+    exposures = {"user_id": ids, "variant": variants, "covariate": baseline}
+    outcomes = {"user_id": ids, "value": outcome}
+    return exposures, outcomes
+
+def test_cuped_reduces_variance_and_keeps_the_estimate():
+    exposures, outcomes = _experiment(3)
+
+    result = experiment_impact(exposures, outcomes, resamples=0)
+
+    comparison = result["comparisons"][0]
+    welch, cuped = comparison["welch"], comparison["cuped"]
+    # Outcome variance is 9 + 1, of which the covariate explains 9
+    assert cuped["variance_reduction"] == pytest.approx(0.9, abs=0.02)
+    assert cuped["theta"] == pytest.approx(1.0, abs=0.05)
+    assert cuped["covariate"] == "covariate"
+    assert cuped["difference"] == pytest.approx(0.5, abs=0.1)
+    cuped_width = cuped["ci"][1] - cuped["ci"][0]
+    welch_width = welch["ci"][1] - welch["ci"][0]
+    assert cuped_width < 0.4 * welch_width
+    assert cuped["p_value"] < welch["p_value"]
+
+def test_pre_exposure_outcomes_become_the_covariate():
+    exposures = {
+        "user_id": ["a", "b", "c", "d"],
+        "variant": ["control", "control", "treatment", "treatment"],
+        "timestamp": ["2024-01-10"] * 4,
+    }
+    outcomes = {
+        "user_id": ["a", "a", "b", "c", "c", "d", "d"],
+        "value": [5.0, 6.0, 2.0, 4.0, 9.0, 1.0, 3.0],
+        "timestamp": ["2024-01-01", "2024-01-11", "2024-01-12", "2024-01-02", "2024-01-12", "2024-01-05", "2024-01-15"],
+    }
+
+    result = experiment_impact(exposures, outcomes, resamples=0)
+
+    # Only outcomes at or after exposure count: a=6, b=2, c=9, d=3
+    assert [variant["mean"] for variant in result["variants"]] == [4.0, 6.0]
+    assert result["comparisons"][0]["cuped"]["covariate"] == "pre_exposure_metric"
+
+def test_users_in_several_variants_are_excluded():
+    exposures = {"user_id": [1, 2, 3, 3, 4], "variant": ["control", "control", "control", "treatment", "treatment"]}
+    outcomes = {"user_id": [1, 3, 4]}
+
+    result = experiment_impact(exposures, outcomes, metric="conversion", resamples=0)
+
+    assert result["excluded_users"] == 1
+    assert [(v["variant"], v["users"], v["mean"]) for v in result["variants"]] == [
+        ("control", 2, 0.5), ("treatment", 1, 1.0)
+    ]
+
+def test_seeded_bootstrap_is_reproducible():
+    exposures, outcomes = _experiment(5, users=600)
+
+    first = experiment_impact(exposures, outcomes, resamples=1000, seed=42)
+    second = experiment_impact(exposures, outcomes, resamples=1000, seed=42)
+    other = experiment_impact(exposures, outcomes, resamples=1000, seed=43)
+
+    assert first["seed"] == 42
+    assert first["comparisons"][0]["bootstrap"] == second["comparisons"][0]["bootstrap"]
+    assert first["comparisons"][0]["bootstrap"] != other["comparisons"][0]["bootstrap"]
+    unseeded = experiment_impact(exposures, outcomes, resamples=100)
+    assert isinstance(unseeded["seed"], int)
+
+def test_bootstrap_does_not_depend_on_the_worker_pool(monkeypatch):
+    rng = np.random.default_rng(9)
+    arms = [rng.exponential(5.0, 300), rng.exponential(6.0, 200)]
+    in_process = bootstrap_means(arms, 1200, seed=7)
+
+    monkeypatch.setattr(experiment_engine, "BOOTSTRAP_WORKERS", 2)
+    monkeypatch.setattr(experiment_engine, "BOOTSTRAP_PARALLEL_MIN_DRAWS", 0)
+    try:
+        parallel = bootstrap_means(arms, 1200, seed=7)
+        assert experiment_engine._pool is not None
+    finally:
+        shutdown_bootstrap_pool()
+
+    assert np.array_equal(in_process, parallel)
+
+@pytest.mark.parametrize("method,values", [
+    # Mostly zeros with a few purchases: gather, including resamples that draw none of them
+    ("gather", np.concatenate([np.zeros(995), np.arange(1.0, 6.0) * 10])),
+    ("gather", np.random.default_rng(1).exponential(3.0, 500)),
+    ("multinomial", np.random.default_rng(2).integers(0, 3, 2000).astype(float)),
+])
+def test_bootstrap_means_have_the_sampling_distribution(method, values):
+    assert _prepare_arm(values)["method"] == method
+
+    means = bootstrap_means([values], 4000, seed=11)[:, 0]
+
+    standard_error = values.std() / math.sqrt(len(values))
+    assert means.shape == (4000,)
+    assert means.mean() == pytest.approx(values.mean(), abs=4 * standard_error / math.sqrt(4000) + 1e-12)
+    assert means.std() == pytest.approx(standard_error, rel=0.1)
+
+def test_invalid_experiments_raise():
+    exposures = {"user_id": [1, 2], "variant": ["a", "b"]}
+    outcomes = {"user_id": [1]}
+    with pytest.raises(KPIComputeError):
+        experiment_impact(exposures, outcomes, control="control")
+    with pytest.raises(KPIComputeError):
+        experiment_impact(exposures, outcomes, control="a", metric="median")
+    with pytest.raises(KPIComputeError):
+        experiment_impact(exposures, outcomes, control="a", confidence=1.5)
+    with pytest.raises(KPIComputeError):
+        experiment_impact({"user_id": [], "variant": []}, outcomes)
+    with pytest.raises(KPIComputeError, match="Column value"):
+        experiment_impact(exposures, {"user_id": [1], "value": ["abc"]}, control="a")
+    with pytest.raises(KPIComputeError, match="Column covariate"):
+        experiment_impact({**exposures, "covariate": [1.0, {}]}, outcomes, control="a")
@@ -0,0 +1,81 @@
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+import openai
+
+from app.services import enhanced_azure_openai
+from app.services.azure_clients import close_clients
+from app.services.enhanced_azure_openai import AsyncAzureOpenAIService
+from app.services.metrics import upstream_in_flight
+from app.services.upstreams import Upstream, UpstreamPool
+
+REQUEST = {"model": "gpt-4", "messages": [{"role": "user", "content": "hi"}]}
+RESPONSE = SimpleNamespace(usage=None, choices=[])
+
+def _client(create):
+    return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+
+def _in_flight(name):
+    return upstream_in_flight._values.get((name,), 0.0)
+
+def _hedging_service(monkeypatch, primary_create, secondary_create, prefix):
+    monkeypatch.setattr(enhanced_azure_openai, "HEDGE_DELAY", 0.01)
+    monkeypatch.setattr(enhanced_azure_openai, "HEDGE_OPERATIONS", {"completion"})
+    primary = Upstream(f"{prefix}-primary", "https://example.invalid", "key", "gpt-4", weight=2)
+    secondary = Upstream(f"{prefix}-secondary", "https://example.invalid", "key", "gpt-4")
+    primary._async_client = _client(primary_create)
+    secondary._async_client = _client(secondary_create)
+    service = AsyncAzureOpenAIService()
+    service.pool = UpstreamPool([primary, secondary])
+    return service, primary, secondary
+
+def test_failed_hedge_is_recorded_and_counted_in_flight(monkeypatch):
+    seen = {}
+
+    async def slow_success(**kwargs):
+        await asyncio.sleep(0.1)
+        return RESPONSE
+
+    async def connection_error(**kwargs):
+        seen["in_flight"] = _in_flight("hedge-fail-secondary")
+        raise openai.APIConnectionError(request=httpx.Request("POST", "https://example.invalid"))
+
+    service, primary, secondary = _hedging_service(monkeypatch, slow_success, connection_error, "hedge-fail")
+    response = asyncio.run(service._create_completion(dict(REQUEST), "completion"))
+
+    assert response is RESPONSE
+    assert seen["in_flight"] == 1
+    assert secondary.failures == 1
+    assert secondary.breaker.failures == 1
+    assert primary.latency is not None
+    assert _in_flight("hedge-fail-primary") == _in_flight("hedge-fail-secondary") == 0
+    assert primary.in_flight == secondary.in_flight == 0
+
+def test_cancelled_primary_releases_its_breaker(monkeypatch):
+    async def hangs(**kwargs):
+        await asyncio.sleep(3600)
+
+    async def success(**kwargs):
+        return RESPONSE
+
+    service, primary, secondary = _hedging_service(monkeypatch, hangs, success, "hedge-win")
+    # Primary is the half-open probe of its breaker
+    primary.breaker.opened_at = 0.0
+    response = asyncio.run(service._create_completion(dict(REQUEST), "completion"))
+
+    assert response is RESPONSE
+    assert secondary.latency is not None
+    assert not primary.breaker.probing
+    assert primary.in_flight == secondary.in_flight == 0
+    assert _in_flight("hedge-win-primary") == _in_flight("hedge-win-secondary") == 0
+
+def test_upstream_clients_outlive_close_clients():
+    upstream = Upstream("reopen", "https://example.invalid", "key", "gpt-4")
+    before = (upstream.client, upstream.async_client)
+    asyncio.run(close_clients())
+
+    assert upstream.client is not before[0]
+    assert upstream.async_client is not before[1]
+    assert not upstream.client._client.is_closed
+    assert not upstream.async_client._client.is_closed
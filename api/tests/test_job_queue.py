@@ -0,0 +1,86 @@
+import asyncio
+
+import pytest
+
+from app.services.job_queue import JobCancelError, JobQueue, JobStore
+
+async def _never_finishes(params):
+    await asyncio.sleep(3600)
+
+async def _echo(params):
+    return {"success": True, "echo": params}
+
+def _queue(tmp_path, handler=_echo):
+    return JobQueue(JobStore(str(tmp_path / "jobs.db")), {"test": handler}, workers=1)
+
+def test_wait_timeout_drops_finished_event(tmp_path):
+    async def scenario():
+        queue = _queue(tmp_path)
+        # Not started, so the job stays queued and every wait times out
+        job = await queue.submit("test", {})
+        results = await asyncio.gather(*(queue.wait(job["id"], 0.01) for _ in range(3)))
+        assert [result["status"] for result in results] == ["queued"] * 3
+        assert queue._finished == {}
+        assert queue._waiters == {}
+
+    asyncio.run(scenario())
+
+def test_wait_returns_finished_job(tmp_path):
+    async def scenario():
+        queue = _queue(tmp_path)
+        await queue.start()
+        try:
+            job = await queue.submit("test", {"value": 1})
+            job = await queue.wait(job["id"], 5)
+        finally:
+            await queue.stop()
+        assert job["status"] == "succeeded"
+        assert job["result"]["echo"] == {"value": 1}
+        assert queue._finished == {}
+
+    asyncio.run(scenario())
+
+def test_cancel_running_job_of_another_process_raises(tmp_path):
+    async def scenario():
+        queue = _queue(tmp_path, _never_finishes)
+        job = await queue.submit("test", {})
+        # Claimed by some other process: running, but not in this queue's tasks
+        assert queue.store.claim(job["id"])
+        with pytest.raises(JobCancelError):
+            await queue.cancel(job["id"])
+        assert (await queue.get(job["id"]))["status"] == "running"
+
+    asyncio.run(scenario())
+
+def test_cancel_queued_and_local_running_jobs(tmp_path):
+    async def scenario():
+        queue = _queue(tmp_path, _never_finishes)
+        queued = await queue.submit("test", {})
+        assert (await queue.cancel(queued["id"]))["status"] == "cancelled"
+
+        await queue.start()
+        try:
+            running = await queue.submit("test", {})
+            for _ in range(100):
+                if running["id"] in queue._running:
+                    break
+                await asyncio.sleep(0.01)
+            assert (await queue.cancel(running["id"]))["status"] == "cancelled"
+        finally:
+            await queue.stop()
+
+    asyncio.run(scenario())
+
+def test_counts_follow_job_changes(tmp_path):
+    async def scenario():
+        queue = _queue(tmp_path)
+        job = await queue.submit("test", {})
+        assert queue.counts == {"queued": 1}
+        await queue.start()
+        try:
+            await queue.wait(job["id"], 5)
+            assert queue.counts == {"succeeded": 1}
+        finally:
+            await queue.stop()
+
+    asyncio.run(scenario())
@@ -0,0 +1,91 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+from app.services.enhanced_azure_openai import KPI_PROMPT_VERSION, KPI_SCHEMA, AsyncAzureOpenAIService, AzureOpenAIService
+from app.services.json_repair import conform_to_schema, repair_json
+from app.services.kpi_cache import KPICache, make_cache_key
+from app.services.upstreams import Upstream, UpstreamPool
+
+METRIC = {"category": "Revenue", "name": "MRR", "description": "Monthly recurring revenue", "calculation": "sum(amount)"}
+
+def _response(content):
+    usage = SimpleNamespace(prompt_tokens=1, completion_tokens=1, total_tokens=2)
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))], usage=usage)
+
+def _service_replying(content, name):
+    """Async service whose only upstream answers every completion with content"""
+    async def create(**kwargs):
+        return _response(content)
+
+    service = AsyncAzureOpenAIService(cache=KPICache(max_entries=4, ttl_seconds=60))
+    upstream = Upstream(name, "https://example.invalid", "key", "gpt-4")
+    upstream._async_client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    service.pool = UpstreamPool([upstream])
+    service.client = upstream.client
+    return service
+
+def test_wrongly_typed_field_is_coerced_not_the_whole_metric():
+    document = {"metrics": [{**METRIC, "benchmark": 5}], "summary": "ok"}
+
+    conformed, errors = conform_to_schema(document, KPI_SCHEMA)
+
+    assert conformed["metrics"] == [{**METRIC, "benchmark": "5"}]
+    assert errors == ["$.metrics[0].benchmark: coerced to string"]
+
+def test_uncoercible_field_is_dropped_from_its_element_only():
+    document = {"metrics": [{**METRIC, "visualization": {"type": "line"}}, "not a metric"]}
+
+    conformed, errors = conform_to_schema(document, KPI_SCHEMA)
+
+    assert conformed["metrics"] == [METRIC]
+    assert len(errors) == 2
+
+def test_missing_required_property_drops_the_element():
+    schema = {"type": "object", "properties": {"items": {"type": "array", "items": {
+        "type": "object", "required": ["name"], "properties": {"name": {"type": "string"}}}}}}
+
+    conformed, _ = conform_to_schema({"items": [{"name": "a"}, {"other": 1}]}, schema)
+
+    assert conformed == {"items": [{"name": "a"}]}
+
+def test_root_type_mismatch_returns_none():
+    assert conform_to_schema([1, 2], KPI_SCHEMA)[0] is None
+
+def test_valid_json_is_returned_as_is_even_if_it_does_not_match_the_schema():
+    service = AzureOpenAIService()
+    content = json.dumps([{"answer": 42}])
+
+    result = service._process_response(_response(content), True, "completion", {"type": "object"})
+
+    assert result["success"] is True
+    assert result["content"] == [{"answer": 42}]
+
+def test_cut_off_output_keeps_complete_metrics_with_bad_fields():
+    service = AzureOpenAIService()
+    content = json.dumps({"metrics": [{**METRIC, "benchmark": 12.5}, METRIC]})[:-40]
+
+    result = service._process_response(_response(content), True, "kpi_system", KPI_SCHEMA)
+
+    assert result["success"] is True
+    assert result["content"]["metrics"] == [{**METRIC, "benchmark": "12.5"}]
+    assert result["partial"] is True
+
+def test_repair_json_closes_truncated_array():
+    value, open_depth = repair_json('```json\n{"metrics": [{"name": "a"}, {"name": "b"}, {"na')
+
+    assert value == {"metrics": [{"name": "a"}, {"name": "b"}]}
+    assert open_depth == 2
+
+def test_valid_off_schema_kpi_system_is_conformed_before_caching():
+    company = {"product_type": "SaaS", "company_stage": "Seed", "tech_stack": "Postgres", "industry": "Health"}
+    document = {"metrics": [{**METRIC, "benchmark": 5}, {**METRIC, "name": "ARR", "sql_query": {"q": 1}}], "summary": "ok"}
+    service = _service_replying(json.dumps(document), "conform-before-cache")
+
+    result = asyncio.run(service.generate_kpi_system(company, "structured", mode="single"))
+
+    assert result["success"] is True
+    assert result["content"]["metrics"][0]["benchmark"] == "5"
+    assert "sql_query" not in result["content"]["metrics"][1]
+    key = make_cache_key(company, "structured", service.deployment_name, KPI_PROMPT_VERSION)
+    assert service.cache.get(key)["content"] == result["content"]
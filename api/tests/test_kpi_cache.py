@@ -0,0 +1,71 @@
+import asyncio
+import threading
+import time
+
+from app.services.enhanced_azure_openai import KPI_PROMPT_VERSION, AsyncAzureOpenAIService
+from app.services.kpi_cache import KPICache, make_cache_key
+from app.services.upstreams import Upstream, UpstreamPool
+
+COMPANY = {"product_type": "SaaS", "company_stage": "Growth", "tech_stack": "Postgres", "industry": "Fintech"}
+SYSTEM = {"success": True, "content": {"metrics": [{"name": "MRR"}]}}
+
+def test_get_misses_expired_entry_but_get_stale_serves_it():
+    cache = KPICache(max_entries=4, ttl_seconds=0.01)
+    cache.set("k", SYSTEM)
+    time.sleep(0.02)
+
+    assert cache.get("k") is None
+    assert cache.get_stale("k") == SYSTEM
+
+def test_get_stale_serves_entries_evicted_by_lru():
+    cache = KPICache(max_entries=2, ttl_seconds=60)
+    for key in ("a", "b", "c"):
+        cache.set(key, {"key": key})
+
+    assert cache.get("a") is None
+    assert cache.get_stale("a") == {"key": "a"}
+    assert cache.stats()["entries"] == 2
+
+def test_invalidate_removes_stale_copy():
+    cache = KPICache(max_entries=1, ttl_seconds=60)
+    cache.set("a", SYSTEM)
+    cache.set("b", SYSTEM)
+    cache.invalidate("a")
+
+    assert cache.get_stale("a") is None
+
+def test_open_breaker_after_ttl_serves_stale_system():
+    cache = KPICache(max_entries=4, ttl_seconds=0.01)
+    service = AsyncAzureOpenAIService(cache=cache)
+    upstream = Upstream("stale-cache-test", "https://example.invalid", "key", "gpt-4")
+    service.pool = UpstreamPool([upstream])
+    service.client = upstream.client
+    key = make_cache_key(COMPANY, "structured", service.deployment_name, KPI_PROMPT_VERSION)
+    cache.set(key, SYSTEM)
+    time.sleep(0.02)
+    upstream.breaker.opened_at = time.monotonic()
+
+    result = asyncio.run(service.generate_kpi_system(COMPANY, "structured"))
+
+    assert result["degraded"] == "cache"
+    assert result["content"] == SYSTEM["content"]
+
+def test_async_service_reads_the_sqlite_tier_off_the_event_loop(tmp_path):
+    path = str(tmp_path / "kpi_cache.db")
+    service = AsyncAzureOpenAIService(cache=KPICache(max_entries=4, ttl_seconds=60, path=path))
+    key = make_cache_key(COMPANY, "structured", service.deployment_name, KPI_PROMPT_VERSION)
+    # Written by another worker, so only the SQLite tier has it
+    KPICache(max_entries=4, ttl_seconds=60, path=path).set(key, SYSTEM)
+
+    threads = []
+    disk_get = service.cache._disk_get
+    def recording_disk_get(*args):
+        threads.append(threading.current_thread())
+        return disk_get(*args)
+    service.cache._disk_get = recording_disk_get
+
+    result = asyncio.run(service.generate_kpi_system(COMPANY, "structured"))
+
+    assert result["cached"] is True
+    assert service.cache.stats()["disk_hits"] == 1
+    assert threads and threading.main_thread() not in threads
@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+from app.services.kpi_engine import NAT, KPIComputeError, compute_kpis, to_seconds
+
+FEB_1 = 1706745600
+
+SUBSCRIPTIONS = {
+    "customer_id": ["c1", "c2", "c3"],
+    "amount": [100.0, 1200.0, 50.0],
+    "start": ["2024-01-01", "2024-01-15T12:00:00Z", "2024-02-01"],
+    "end": [None, "2024-03-10", None],
+    "interval": ["month", "year", "month"],
+}
+
+def test_to_seconds_accepts_iso_and_epoch_text():
+    assert to_seconds(["2024-02-01T00:00:00Z", "2024-02-01"]).tolist() == [FEB_1, FEB_1]
+    assert to_seconds([str(FEB_1), None, ""]).tolist() == [FEB_1, NAT, NAT]
+
+def test_to_seconds_mixed_column_reads_numbers_as_epoch_seconds():
+    seconds = to_seconds(["2024-01-01", str(FEB_1), f"{FEB_1}.0", FEB_1, None])
+
+    assert seconds.tolist() == [FEB_1 - 31 * 86400, FEB_1, FEB_1, FEB_1, NAT]
+
+def test_to_seconds_rejects_garbage():
+    with pytest.raises(KPIComputeError):
+        to_seconds(["2024-01-01", "yesterday"])
+
+def test_subscription_metrics_per_month():
+    result = compute_kpis({"subscriptions": SUBSCRIPTIONS}, ["mrr", "active_subscriptions", "new_customers"],
+                          "month", "2024-01-01", "2024-03-31")
+
+    assert result["periods"] == ["2024-01-01", "2024-02-01", "2024-03-01"]
+    # c3 starts exactly on the February edge and counts in February; c2 ends in March
+    assert result["metrics"]["mrr"] == pytest.approx([200.0, 250.0, 150.0])
+    assert result["metrics"]["active_subscriptions"] == [2.0, 3.0, 2.0]
+    assert result["metrics"]["new_customers"] == [2.0, 1.0, 0.0]
+
+def test_mixed_timestamps_inline_count_towards_mrr():
+    tables = {"subscriptions": {**SUBSCRIPTIONS, "start": [1704067200, "2024-01-15T12:00:00Z", str(FEB_1)]}}
+
+    result = compute_kpis(tables, ["mrr"], "month", "2024-01-01", "2024-03-31")
+
+    assert result["metrics"]["mrr"] == pytest.approx([200.0, 250.0, 150.0])
+
+def test_transaction_and_event_metrics():
+    tables = {
+        "transactions": {"amount": [10.0, 30.0, 5.0], "timestamp": ["2024-01-03", "2024-01-20", "2024-02-02"]},
+        "events": {
+            "user_id": ["u1", "u2", "u1", "u3"],
+            "timestamp": ["2024-01-01", "2024-01-02", "2024-02-01", "2024-02-05"],
+            "event": ["visit", "purchase", "visit", "purchase"],
+        },
+    }
+
+    result = compute_kpis(tables, ["revenue", "orders", "aov", "active_users", "conversion_rate"], "month")
+
+    assert result["metrics"]["revenue"] == [40.0, 5.0]
+    assert result["metrics"]["orders"] == [2.0, 1.0]
+    assert result["metrics"]["aov"] == [20.0, 5.0]
+    assert result["metrics"]["active_users"] == [2.0, 2.0]
+    assert result["metrics"]["conversion_rate"] == [0.5, 0.5]
+
+def test_ratio_over_zero_is_none():
+    tables = {"transactions": {"amount": [10.0], "timestamp": ["2024-01-03"]}}
+
+    result = compute_kpis(tables, ["aov"], "month", "2024-01-01", "2024-02-28")
+
+    assert result["metrics"]["aov"] == [10.0, None]
+
+def test_missing_table_is_reported():
+    with pytest.raises(KPIComputeError, match="needs the events table"):
+        compute_kpis({"transactions": {"amount": [], "timestamp": []}}, ["active_users"])
+
+def test_non_numeric_amount_raises_compute_error():
+    tables = {"transactions": {"amount": [10.0, "abc"], "timestamp": ["2024-01-03", "2024-01-20"]}}
+
+    with pytest.raises(KPIComputeError, match="Column amount"):
+        compute_kpis(tables, ["revenue"], "month")
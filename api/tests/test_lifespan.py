@@ -0,0 +1,27 @@
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.routers.auth import DEMO_USER
+from app.services import job_queue
+from app.services.example_catalog import get_example_catalog
+from app.services.job_queue import get_job_queue
+from app.services.token_budget import get_token_budget_planner
+from app.services.user_store import get_user_store
+
+def test_lifespan_starts_and_stops_background_components():
+    with TestClient(app) as client:
+        assert client.get("/health").status_code == 200
+        assert get_example_catalog().version is not None
+        # Loaded (or given up on) before the first request needs it
+        assert get_token_budget_planner().tokenizer._loaded
+        assert get_user_store().get(DEMO_USER["email"]) is not None
+        assert len(get_job_queue()._workers) == get_job_queue().workers
+
+    assert get_job_queue()._workers == []
+
+def test_metrics_scrape_does_not_open_the_job_store(monkeypatch):
+    monkeypatch.setattr(job_queue, "_job_queue", None)
+    response = TestClient(app).get("/metrics")
+    assert response.status_code == 200
+    assert 'metrically_jobs{state="queued"} 0' in response.text
+    assert job_queue._job_queue is None
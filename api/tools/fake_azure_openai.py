@@ -0,0 +1,226 @@
+"""
+Local stand-in for the Azure OpenAI chat completions API
+
+Serves /openai/deployments/{deployment}/chat/completions with canned KPI
+system JSON (for JSON-mode requests) or SQL text, with configurable latency,
+token generation rate, streaming and error/429 injection. Point the API at
+it with:
+
+    AZURE_OPENAI_ENDPOINT=http://127.0.0.1:8090 AZURE_OPENAI_API_KEY=fake
+
+and start it with:
+
+    python -m tools.fake_azure_openai --port 8090 --latency-median 0.8 --tokens-per-second 60
+"""
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+from dataclasses import dataclass, asdict
+from typing import Any, AsyncIterator, Dict, List
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+METRICS = [
+    ("Acquisition", "Customer Acquisition Cost", "Average spend to acquire a paying customer",
+     "Total sales and marketing spend / new customers", "Shows whether growth is efficient",
+     "SELECT SUM(spend) / NULLIF(COUNT(DISTINCT customer_id), 0) AS cac FROM marketing_spend JOIN customers USING (month);",
+     "Line chart by month", "Under one third of first-year LTV"),
+    ("Acquisition", "Visitor to Sign-up Rate", "Share of site visitors who create an account",
+     "Sign-ups / unique visitors", "Measures top-of-funnel effectiveness",
+     "SELECT COUNT(*) FILTER (WHERE event = 'signup')::float / NULLIF(COUNT(DISTINCT visitor_id), 0) FROM events;",
+     "Funnel chart", "2-5% for B2B SaaS"),
+    ("Activation", "Activation Rate", "Share of new users reaching the key action in week one",
+     "Users completing key action within 7 days / new users", "Predicts retention",
+     "SELECT AVG(CASE WHEN activated_at < created_at + INTERVAL '7 days' THEN 1 ELSE 0 END) FROM users;",
+     "Bar chart by signup cohort", "Above 40%"),
+    ("Retention", "Monthly Churn Rate", "Share of customers cancelling each month",
+     "Customers lost in month / customers at start of month", "Compounds directly into revenue",
+     "SELECT date_trunc('month', canceled_at), COUNT(*) FROM subscriptions WHERE canceled_at IS NOT NULL GROUP BY 1;",
+     "Line chart by month", "Below 3% monthly"),
+    ("Retention", "DAU/MAU Ratio", "Stickiness of the product",
+     "Daily active users / monthly active users", "Shows habitual usage",
+     "SELECT COUNT(DISTINCT user_id) FILTER (WHERE ts > now() - INTERVAL '1 day')::float / COUNT(DISTINCT user_id) FROM events WHERE ts > now() - INTERVAL '30 days';",
+     "Line chart", "Above 20%"),
+    ("Revenue", "Monthly Recurring Revenue", "Normalized monthly subscription revenue",
+     "Sum of active subscription amounts normalized to a month", "Core growth metric",
+     "SELECT date_trunc('month', period_start), SUM(amount) FROM subscriptions WHERE status = 'active' GROUP BY 1;",
+     "Area chart by month", "15-20% month over month at seed"),
+    ("Revenue", "Customer Lifetime Value", "Expected revenue per customer",
+     "ARPU / churn rate", "Caps sustainable acquisition spend",
+     "SELECT AVG(amount) / NULLIF((SELECT churn FROM churn_rate), 0) FROM subscriptions;",
+     "Single value with trend", "At least 3x CAC"),
+]
+
+CANNED_KPI_SYSTEM = {
+    "metrics": [
+        dict(zip(("category", "name", "description", "calculation", "importance", "sql_query", "visualization", "benchmark"), metric))
+        for metric in METRICS
+    ],
+    "dashboard_recommendations": [
+        {"name": "Growth", "description": "Acquisition and revenue at a glance",
+         "included_metrics": ["Customer Acquisition Cost", "Monthly Recurring Revenue", "Customer Lifetime Value"]},
+        {"name": "Engagement", "description": "Activation and retention health",
+         "included_metrics": ["Activation Rate", "Monthly Churn Rate", "DAU/MAU Ratio"]},
+    ],
+    "summary": "A compact KPI system covering acquisition efficiency, activation, retention and recurring revenue.",
+}
+
+CANNED_SQL = """-- Monthly recurring revenue by month
+SELECT date_trunc('month', period_start) AS month,
+       SUM(amount) AS mrr
+FROM subscriptions
+WHERE status = 'active'
+GROUP BY 1
+ORDER BY 1;"""
+
+@dataclass
+class FakeAzureConfig:
+    """Behaviour of the fake server"""
+    latency_median: float = 0.5
+    latency_sigma: float = 0.5
+    tokens_per_second: float = 80.0
+    error_rate: float = 0.0
+    throttle_rate: float = 0.0
+    retry_after: int = 1
+    chunk_tokens: int = 4
+
+def _canned_kpi_content(messages: List[Dict[str, str]]) -> Dict[str, Any]:
+    """The part of the canned KPI system a (possibly fanned-out) prompt asks for"""
+    prompt = messages[-1].get("content") or "" if messages else ""
+    for category in ("Acquisition", "Activation", "Retention", "Revenue"):
+        if f"Only produce the {category.upper()} part" in prompt:
+            return {"metrics": [m for m in CANNED_KPI_SYSTEM["metrics"] if m["category"] == category]}
+    if "ONLY the properties: dashboard_recommendations, summary" in prompt:
+        return {key: CANNED_KPI_SYSTEM[key] for key in ("dashboard_recommendations", "summary")}
+    return CANNED_KPI_SYSTEM
+
+def _estimate_tokens(text: str) -> int:
+    """Approximate token count (about four characters per token)"""
+    return max(1, len(text) // 4)
+
+def create_app(config: FakeAzureConfig) -> FastAPI:
+    """Build the fake Azure OpenAI application"""
+    app = FastAPI(title="Fake Azure OpenAI")
+    app.state.config = config
+    app.state.requests = 0
+
+    @app.get("/config")
+    async def get_config():
+        return asdict(app.state.config)
+
+    @app.post("/openai/deployments/{deployment}/chat/completions")
+    async def chat_completions(deployment: str, request: Request):
+        cfg: FakeAzureConfig = app.state.config
+        app.state.requests += 1
+        body = await request.json()
+        messages: List[Dict[str, str]] = body.get("messages", [])
+
+        roll = random.random()
+        if roll < cfg.throttle_rate:
+            return JSONResponse(
+                status_code=429,
+                headers={"Retry-After": str(cfg.retry_after)},
+                content={"error": {"code": "429", "message": "Rate limit is exceeded. Try again later."}},
+            )
+        if roll < cfg.throttle_rate + cfg.error_rate:
+            return JSONResponse(
+                status_code=500,
+                content={"error": {"code": "InternalServerError", "message": "Injected failure"}},
+            )
+
+        json_mode = (body.get("response_format") or {}).get("type") == "json_object"
+        content = json.dumps(_canned_kpi_content(messages)) if json_mode else CANNED_SQL
+        prompt_tokens = sum(_estimate_tokens(m.get("content") or "") for m in messages)
+        completion_tokens = min(_estimate_tokens(content), body.get("max_tokens") or 1 << 30)
+        first_token_delay = random.lognormvariate(0, cfg.latency_sigma) * cfg.latency_median
+
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        created = int(time.time())
+
+        if body.get("stream"):
+            return StreamingResponse(
+                _stream(cfg, completion_id, created, deployment, content, first_token_delay),
+                media_type="text/event-stream",
+            )
+
+        await asyncio.sleep(first_token_delay + completion_tokens / cfg.tokens_per_second)
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": deployment,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+
+    return app
+
+async def _stream(
+    cfg: FakeAzureConfig,
+    completion_id: str,
+    created: int,
+    deployment: str,
+    content: str,
+    first_token_delay: float
+) -> AsyncIterator[str]:
+    """Emit content as chat.completion.chunk events at the configured token rate"""
+    await asyncio.sleep(first_token_delay)
+    step = cfg.chunk_tokens * 4
+    for start in range(0, len(content), step):
+        chunk: Dict[str, Any] = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": deployment,
+            "choices": [{"index": 0, "delta": {"content": content[start:start + step]}, "finish_reason": None}],
+        }
+        yield f"data: {json.dumps(chunk)}\n\n"
+        await asyncio.sleep(cfg.chunk_tokens / cfg.tokens_per_second)
+    final = {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": created,
+        "model": deployment,
+        "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+    }
+    yield f"data: {json.dumps(final)}\n\n"
+    yield "data: [DONE]\n\n"
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Fake Azure OpenAI chat completions server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--latency-median", type=float, default=0.5, help="Median time to first token in seconds")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="Log-normal spread of time to first token")
+    parser.add_argument("--tokens-per-second", type=float, default=80.0, help="Completion token generation rate")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests failing with 500")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of requests failing with 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds sent with 429s")
+    args = parser.parse_args()
+
+    import uvicorn
+
+    config = FakeAzureConfig(
+        latency_median=args.latency_median,
+        latency_sigma=args.latency_sigma,
+        tokens_per_second=args.tokens_per_second,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+        retry_after=args.retry_after,
+    )
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
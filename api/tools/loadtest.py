@@ -0,0 +1,184 @@
+"""
+Open-loop HTTP load generator for the Metrically API
+
+Sends a weighted mix of /auth/token, /ai/generate-kpi, /ai/generate-sql and
+/kpi/generate requests at a fixed arrival rate and prints a JSON report with
+per-endpoint p50/p95/p99 latency, throughput and error rates. Requests are
+launched on schedule regardless of how many are still outstanding, so a slow
+server shows up as rising latency rather than a silently lower request rate.
+
+Typical run against the fake upstream (see tools.fake_azure_openai):
+
+    RATE_LIMIT_ENABLED=false AZURE_OPENAI_ENDPOINT=http://127.0.0.1:8090 \\
+        AZURE_OPENAI_API_KEY=fake uvicorn app.main:app --port 8000
+    python -m tools.loadtest --base-url http://127.0.0.1:8000 --rps 50 --duration 30 > report.json
+"""
+import sys
+import json
+import math
+import time
+import random
+import asyncio
+import argparse
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+COMPANY_PROFILES = [
+    {"product_type": "SaaS", "company_stage": "Seed", "tech_stack": "PostgreSQL", "industry": "Fintech"},
+    {"product_type": "E-commerce", "company_stage": "Series A", "tech_stack": "BigQuery", "industry": "Retail"},
+    {"product_type": "Mobile App", "company_stage": "Pre-seed", "tech_stack": "Firebase", "industry": "Health"},
+]
+
+SQL_ITEMS = [
+    {"metric_name": "MRR", "metric_calculation": "Sum of active subscription amounts", "tech_stack": "PostgreSQL"},
+    {"metric_name": "Churn Rate", "metric_calculation": "Cancelled / starting customers", "tech_stack": "PostgreSQL"},
+    {"metric_name": "DAU/MAU", "metric_calculation": "Daily / monthly active users", "tech_stack": "BigQuery"},
+]
+
+DEFAULT_MIX = "token=1,generate_kpi=3,generate_sql=4,kpi_generate=2"
+
+def percentile(sorted_values: List[float], fraction: float) -> Optional[float]:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+def parse_mix(mix: str) -> List[Tuple[str, float]]:
+    """Parse "name=weight,..." into a list of (scenario, weight)"""
+    weights = []
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        weights.append((name.strip(), float(weight or 1)))
+    return weights
+
+class LoadTest:
+    """Drives the scenario mix and collects per-request results"""
+
+    def __init__(self, base_url: str, email: str, password: str, timeout: float):
+        self.base_url = base_url.rstrip("/")
+        self.email = email
+        self.password = password
+        self.client = httpx.AsyncClient(
+            base_url=self.base_url,
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=None, max_keepalive_connections=200),
+        )
+        self.token: Optional[str] = None
+        self.results: List[Tuple[str, float, Optional[int], Optional[str]]] = []
+
+    async def login(self) -> httpx.Response:
+        return await self.client.post(
+            "/auth/token", data={"username": self.email, "password": self.password}
+        )
+
+    async def run_scenario(self, scenario: str) -> None:
+        headers = {"Authorization": f"Bearer {self.token}"}
+        started = time.perf_counter()
+        status: Optional[int] = None
+        error: Optional[str] = None
+        try:
+            if scenario == "token":
+                response = await self.login()
+            elif scenario == "generate_kpi":
+                response = await self.client.post(
+                    "/ai/generate-kpi", json=random.choice(COMPANY_PROFILES), headers=headers
+                )
+            elif scenario == "generate_sql":
+                response = await self.client.post(
+                    "/ai/generate-sql", json=random.choice(SQL_ITEMS), headers=headers
+                )
+            elif scenario == "kpi_generate":
+                profile = random.choice(COMPANY_PROFILES)
+                response = await self.client.post("/kpi/generate", json=profile, headers=headers)
+            else:
+                raise ValueError(f"Unknown scenario: {scenario}")
+            status = response.status_code
+            if status >= 400:
+                error = f"HTTP {status}"
+        except Exception as e:
+            error = type(e).__name__
+        self.results.append((scenario, time.perf_counter() - started, status, error))
+
+    async def run(self, rps: float, duration: float, mix: List[Tuple[str, float]]) -> Dict[str, Any]:
+        response = await self.login()
+        response.raise_for_status()
+        self.token = response.json()["access_token"]
+
+        names = [name for name, _ in mix]
+        weights = [weight for _, weight in mix]
+        interval = 1.0 / rps
+        tasks = []
+        started = time.perf_counter()
+        next_send = started
+        while next_send - started < duration:
+            delay = next_send - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(self.run_scenario(random.choices(names, weights)[0])))
+            next_send += interval
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+        await self.client.aclose()
+        return self.report(rps, duration, elapsed)
+
+    def report(self, rps: float, duration: float, elapsed: float) -> Dict[str, Any]:
+        groups: Dict[str, List[Tuple[float, Optional[int], Optional[str]]]] = {}
+        for scenario, latency, status, error in self.results:
+            groups.setdefault(scenario, []).append((latency, status, error))
+            groups.setdefault("all", []).append((latency, status, error))
+
+        endpoints = {}
+        for scenario, rows in sorted(groups.items()):
+            latencies = sorted(latency for latency, _, _ in rows)
+            errors = [error for _, _, error in rows if error]
+            statuses: Dict[str, int] = {}
+            for _, status, _ in rows:
+                key = str(status) if status is not None else "none"
+                statuses[key] = statuses.get(key, 0) + 1
+            endpoints[scenario] = {
+                "requests": len(rows),
+                "throughput_rps": len(rows) / elapsed if elapsed else 0.0,
+                "error_rate": len(errors) / len(rows),
+                "status_counts": statuses,
+                "latency_seconds": {
+                    "p50": percentile(latencies, 0.50),
+                    "p95": percentile(latencies, 0.95),
+                    "p99": percentile(latencies, 0.99),
+                    "max": latencies[-1],
+                    "mean": sum(latencies) / len(latencies),
+                },
+            }
+
+        return {
+            "base_url": self.base_url,
+            "target_rps": rps,
+            "duration_seconds": duration,
+            "elapsed_seconds": elapsed,
+            "endpoints": endpoints,
+        }
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Load test the Metrically API")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--rps", type=float, default=10.0, help="Target arrival rate (requests per second)")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds to generate load for")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Scenario weights, e.g. " + DEFAULT_MIX)
+    parser.add_argument("--email", default="demo@metrically.ai")
+    parser.add_argument("--password", default="demopassword")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Per-request timeout in seconds")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for the scenario mix")
+    args = parser.parse_args(argv)
+
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    test = LoadTest(args.base_url, args.email, args.password, args.timeout)
+    report = asyncio.run(test.run(args.rps, args.duration, parse_mix(args.mix)))
+    json.dump(report, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
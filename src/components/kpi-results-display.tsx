@@ -34,8 +34,8 @@ export function KPIResultsDisplay({ kpiResponse }: KPIResultsDisplayProps) {
   const [activeTab, setActiveTab] = useState('metrics');
   const [expandedMetric, setExpandedMetric] = useState<string | null>(null);
   
-  // Extract metrics from the raw response
-  const metrics = extractMetrics(kpiResponse.raw_response);
+  // Use the metrics parsed by the API, falling back to the raw response
+  const metrics = kpiResponse.metrics?.length ? kpiResponse.metrics : extractMetrics(kpiResponse.raw_response);
   
   // Handle copy to clipboard
   const handleCopy = (text: string) => {
@@ -21,6 +21,7 @@ export interface KPIGenerationRequest {
 
 export interface Metric {
   name: string;
+  category?: string;
   description: string;
   calculation: string;
   importance: string;
@@ -32,6 +33,7 @@ export interface Metric {
 export interface KPIGenerationResponse {
   raw_response: string;
   tech_stack: string;
+  metrics?: Metric[];
   metrics_count: number;
   has_sql: boolean;
   has_visualizations: boolean;
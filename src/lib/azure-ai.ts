@@ -65,6 +65,14 @@ export interface KPISystemResponse {
   };
 }
 
+export interface KPIStreamHandlers {
+  onMetric?: (metric: Metric) => void;
+  onDashboard?: (dashboard: Dashboard) => void;
+  onSummary?: (summary: string) => void;
+  onDone?: (info: { cached: boolean }) => void;
+  onError?: (error: string) => void;
+}
+
 export interface SQLResponse {
   success: boolean;
   content?: string;
@@ -159,6 +167,72 @@ class AzureAIService {
     }
   }
   
+  /**
+   * Stream a KPI system, invoking callbacks as each part is generated
+   */
+  async streamKPISystem(
+    companyInfo: CompanyInfo,
+    handlers: KPIStreamHandlers
+  ): Promise<void> {
+    try {
+      const token = await getAuthToken();
+
+      if (!token) {
+        throw new Error('Authentication required');
+      }
+
+      const response = await fetch(`${this.apiBaseUrl}/ai/generate-kpi/stream`, {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/json',
+          'Authorization': `Bearer ${token}`
+        },
+        body: JSON.stringify(companyInfo)
+      });
+
+      if (!response.ok || !response.body) {
+        const errorData = await response.json();
+        throw new Error(errorData.detail || 'Failed to generate KPI system');
+      }
+
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        // Events are separated by a blank line
+        let boundary = buffer.indexOf('\n\n');
+        while (boundary !== -1) {
+          const block = buffer.slice(0, boundary);
+          buffer = buffer.slice(boundary + 2);
+          boundary = buffer.indexOf('\n\n');
+
+          let event = 'message';
+          let data = '';
+          for (const line of block.split('\n')) {
+            if (line.startsWith('event: ')) event = line.slice(7);
+            else if (line.startsWith('data: ')) data += line.slice(6);
+          }
+          if (!data) continue;
+
+          const payload = JSON.parse(data);
+          if (event === 'metric') handlers.onMetric?.(payload);
+          else if (event === 'dashboard_recommendation') handlers.onDashboard?.(payload);
+          else if (event === 'summary') handlers.onSummary?.(payload);
+          else if (event === 'done') handlers.onDone?.(payload);
+          else if (event === 'error') handlers.onError?.(payload.error || 'Failed to generate KPI system');
+        }
+      }
+    } catch (error: any) {
+      console.error('Error streaming KPI system:', error);
+      handlers.onError?.(error.message || 'Failed to generate KPI system');
+    }
+  }
+
   /**
    * Generate SQL for a specific metric
    */